@@ -0,0 +1,285 @@
+"""
+This module contains the implementation of the concurrent avg5m backfill downloader.
+
+Timestamps of 5-minute snapshots that are to be downloaded are kept in a work queue table within the timeseries
+database. A pool of worker threads downloads snapshots concurrently, while a token bucket limits the rate at which
+requests are made across all workers. Failed requests are retried with exponential backoff. The downloaded rows are
+inserted by the calling thread; the rows of a snapshot and the completion of its queue entry are committed as one
+transaction, such that an interrupted backfill continues with the remaining timestamps upon the next run.
+
+The url of the API can be configured, which allows the downloader to be pointed at a local server that serves canned
+/5m?timestamp= responses.
+
+Examples
+--------
+backfill = Avg5mBackfill(rate=4.0, n_workers=8)
+backfill.enqueue(timestamps)
+backfill.run()
+"""
+import json
+import queue
+import random
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from collections.abc import Iterable
+from typing import Dict, List, Tuple
+
+from venv_auto_loader.active_venv import *
+import global_variables.osrs as go
+import global_variables.path as gp
+import util.str_formats as fmt
+from backend.npy_watermark import DirtyRangeTracker
+from common.classes.database import sql_create_timeseries_item_table
+__t0__ = time.perf_counter()
+
+
+wiki_prices_api: str = "https://prices.runescape.wiki/api/v1/osrs"
+
+sql_create_backfill_queue: str = """CREATE TABLE IF NOT EXISTS "avg5m_backfill_queue"(
+    "timestamp" INTEGER PRIMARY KEY,
+    "priority" INTEGER NOT NULL DEFAULT 0,
+    "status" INTEGER NOT NULL DEFAULT 0,
+    "attempts" INTEGER NOT NULL DEFAULT 0,
+    "n_rows" INTEGER NOT NULL DEFAULT 0,
+    "updated" INTEGER NOT NULL DEFAULT 0)"""
+
+sql_create_backfill_queue_index: str = \
+    """CREATE INDEX IF NOT EXISTS "avg5m_backfill_queue_status" ON "avg5m_backfill_queue"(status, priority)"""
+
+PENDING, CLAIMED, DONE, FAILED = 0, 1, 2, 3
+"""Status values of entries in the backfill queue"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter. Tokens are added at `rate` tokens per second, up to `capacity` tokens. Each
+    request consumes one token; if there are no tokens, acquire() blocks until one becomes available.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = max(1.0, rate) if capacity is None else capacity
+        self.tokens = self.capacity
+        self.t_last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Consume one token, block until one is available if needed """
+        while True:
+            with self._lock:
+                t = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (t - self.t_last) * self.rate)
+                self.t_last = t
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def download_avg5m(timestamp: int, url: str = wiki_prices_api, timeout: float = 30.0) -> Dict[str, dict]:
+    """
+    Download the avg5m snapshot of `timestamp` from the prices API at `url`. Raise an exception if the request fails.
+
+    Returns
+    -------
+    Dict[str, dict]
+        Item_ids mapped to a dict with avgHighPrice, highPriceVolume, avgLowPrice and lowPriceVolume
+    """
+    req = urllib.request.Request(f"{url}/5m?timestamp={timestamp}",
+                                 headers={'User-Agent': 'High-res price data scraper'})
+    with urllib.request.urlopen(req, timeout=timeout) as handle:
+        return json.loads(handle.read().decode()).get('data') or {}
+
+
+def avg5m_rows(timestamp: int, data: Dict[str, dict]) -> List[Tuple[int, int, int, int, int]]:
+    """
+    Convert avg5m snapshot `data` of `timestamp` into (item_id, src, timestamp, price, volume) rows. Buy prices (src=1)
+    are the average low prices, sell prices (src=2) are the average high prices. Prices of 0 or None are omitted.
+    """
+    rows = []
+    for item_id, el in data.items():
+        for src, price_key, volume_key in ((1, 'avgLowPrice', 'lowPriceVolume'), (2, 'avgHighPrice', 'highPriceVolume')):
+            price = el.get(price_key)
+            if price is not None and price > 0:
+                rows.append((int(item_id), src, timestamp, price, el.get(volume_key) or 0))
+    return rows
+
+
+class Avg5mBackfill:
+    """
+    Concurrent, rate-limited downloader that backfills avg5m snapshots listed in the backfill queue.
+
+    Attributes
+    ----------
+    db_file : str
+        Path to the timeseries database
+    rate : float
+        Maximum amount of requests per second, across all workers
+    n_workers : int
+        Amount of concurrent download workers
+    max_attempts : int
+        Maximum amount of attempts per timestamp, after which it is marked as failed
+    backoff : float
+        Amount of seconds to wait after the first failed attempt. It is doubled after each subsequent failure.
+    url : str
+        Url of the prices API
+    """
+    def __init__(self, db_file: str = gp.f_db_timeseries, rate: float = 2.0, n_workers: int = 4,
+                 max_attempts: int = 5, backoff: float = 1.0, url: str = wiki_prices_api, timeout: float = 30.0):
+        self.db_file = db_file
+        self.rate = rate
+        self.n_workers = n_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.url = url
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+
+        self.con = sqlite3.connect(db_file, check_same_thread=False)
+        self.con.execute(sql_create_backfill_queue)
+        self.con.execute(sql_create_backfill_queue_index)
+        self.con.commit()
+        self.n_requests, self.n_rows, self.n_failed = 0, 0, 0
+
+    def enqueue(self, timestamps: Iterable[int], priorities: Iterable[int] = None) -> int:
+        """
+        Add `timestamps` to the queue, optionally with `priorities` (higher is downloaded first). Timestamps that were
+        queued before are not re-added. Return the amount of timestamps that were added.
+        """
+        timestamps = list(timestamps)
+        priorities = [0 for _ in timestamps] if priorities is None else priorities
+        n = self.con.executemany("""INSERT OR IGNORE INTO "avg5m_backfill_queue"(timestamp, priority, updated)
+                                    VALUES (?, ?, ?)""", [(int(ts), int(p), int(time.time())) for ts, p in
+                                                          zip(timestamps, priorities) if ts % 300 == 0]).rowcount
+        self.con.commit()
+        return n
+
+    def retry_failed(self) -> int:
+        """ Reset failed timestamps to pending, such that they are attempted again. Return the amount reset. """
+        n = self.con.execute("""UPDATE "avg5m_backfill_queue" SET status=?, attempts=0 WHERE status=?""",
+                             (PENDING, FAILED)).rowcount
+        self.con.commit()
+        return n
+
+    def pending(self) -> List[int]:
+        """ Return the timestamps that have yet to be downloaded, ordered by priority """
+        return [r[0] for r in self.con.execute("""SELECT timestamp FROM "avg5m_backfill_queue" WHERE status IN (?, ?)
+                                                  ORDER BY priority DESC, timestamp""", (PENDING, CLAIMED))]
+
+    def _worker(self, tasks: queue.Queue, results: queue.Queue):
+        """
+        Download the timestamps taken from `tasks` and put (timestamp, rows, attempts, error) on `results`. Exactly one
+        result is put on `results` per timestamp, regardless of the error that occurred.
+        """
+        while True:
+            ts = tasks.get()
+            if ts is None:
+                return
+            error, rows, attempt = None, None, 0
+            for attempt in range(1, self.max_attempts + 1):
+                self.bucket.acquire()
+                try:
+                    rows = avg5m_rows(ts, download_avg5m(ts, self.url, self.timeout))
+                    error = None
+                    break
+                except (urllib.error.URLError, OSError, ValueError) as e:
+                    error = e
+                    if isinstance(e, urllib.error.HTTPError) and 400 <= e.code < 500 and e.code != 429:
+                        break
+                    time.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random() * .1))
+                except Exception as e:
+                    # A malformed response is not retried; it is reported as failed instead of ending the worker
+                    error = e
+                    break
+            results.put((ts, rows, attempt, error))
+
+    def _write(self, ts: int, rows: List[tuple], tables: set, dirty_ranges: DirtyRangeTracker):
+        """ Insert `rows` of `ts`, mark `ts` as done and commit """
+        rows = [r for r in rows if r[0] not in go.timeseries_skip_ids]
+        for item_id in frozenset([r[0] for r in rows]).difference(tables):
+            self.con.execute(sql_create_timeseries_item_table(item_id, check_exists=True))
+            tables.add(item_id)
+        grouped = {}
+        for r in rows:
+            grouped.setdefault(r[0], []).append(r[1:])
+        for item_id, item_rows in grouped.items():
+            self.con.executemany(f"""INSERT OR REPLACE INTO "item{item_id:0>5}"(src, timestamp, price, volume)
+                                     VALUES (?, ?, ?, ?)""", item_rows)
+            for src in frozenset([r[0] for r in item_rows]):
+                dirty_ranges.add(item_id, src, ts)
+        dirty_ranges.flush(self.con)
+        self.con.execute("""UPDATE "avg5m_backfill_queue" SET status=?, n_rows=?, updated=? WHERE timestamp=?""",
+                         (DONE, len(rows), int(time.time()), ts))
+        try:
+            self.con.execute("""DELETE FROM "avg5m_gaps" WHERE timestamp=?""", (ts,))
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise e
+        self.con.commit()
+
+    def run(self, limit: int = None) -> int:
+        """
+        Download the pending timestamps in the queue, at most `limit` if passed, and insert their rows. Timestamps that
+        were claimed by an interrupted run are pending again. Return the amount of rows inserted.
+        """
+        self.con.execute("""UPDATE "avg5m_backfill_queue" SET status=? WHERE status=?""", (PENDING, CLAIMED))
+        self.con.commit()
+        to_do = self.pending()
+        to_do = to_do if limit is None else to_do[:limit]
+        if len(to_do) == 0:
+            return 0
+
+        tasks, results = queue.Queue(), queue.Queue()
+        workers = [threading.Thread(target=self._worker, args=(tasks, results), daemon=True,
+                                    name=f'Avg5mBackfill-{i}') for i in range(self.n_workers)]
+        for w in workers:
+            w.start()
+        self.con.executemany("""UPDATE "avg5m_backfill_queue" SET status=? WHERE timestamp=?""",
+                             [(CLAIMED, ts) for ts in to_do])
+        self.con.commit()
+        for ts in to_do:
+            tasks.put(ts)
+        for _ in workers:
+            tasks.put(None)
+
+        c = self.con.cursor()
+        c.row_factory = None
+        tables = {int(t[0][4:]) for t in c.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                  if len(t[0]) == 9 and t[0][:4] == 'item'}
+        dirty_ranges, start, n_rows = DirtyRangeTracker(), time.perf_counter(), 0
+        try:
+            for idx in range(len(to_do)):
+                ts, rows, attempts, error = results.get()
+                self.n_requests += attempts
+                if error is None:
+                    self._write(ts, rows, tables, dirty_ranges)
+                    n_rows += len(rows)
+                else:
+                    self.n_failed += 1
+                    self.con.execute("""UPDATE "avg5m_backfill_queue" SET status=?, attempts=attempts+?, updated=?
+                                        WHERE timestamp=?""", (FAILED, attempts, int(time.time()), ts))
+                    self.con.commit()
+                    print(f"\tFailed to download avg5m data of {fmt.unix_(ts)} after {attempts} attempts: {error}")
+                elapsed = max(time.perf_counter() - start, 1e-6)
+                print(f"\t[{fmt.passed_pc(start)}] {idx+1}/{len(to_do)} timestamps | Rows: {n_rows} | "
+                      f"Requests: {self.n_requests / elapsed:.2f}/s | Failed: {self.n_failed}  ", end='\r')
+        finally:
+            # Timestamps that were not processed are pending again
+            while not tasks.empty():
+                try:
+                    tasks.get_nowait()
+                except queue.Empty:
+                    break
+            for _ in workers:
+                tasks.put(None)
+            self.con.execute("""UPDATE "avg5m_backfill_queue" SET status=? WHERE status=?""", (PENDING, CLAIMED))
+            self.con.commit()
+        self.n_rows += n_rows
+        print('')
+        return n_rows
+
+    def close(self):
+        """ Close the connection with the timeseries database """
+        self.con.close()
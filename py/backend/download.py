@@ -2,19 +2,23 @@
 Module with various methods for downloading data from a specific source.
 Used for downloading data, but also serves as reference for how the rbpi downloads data.
 
+All requests are made through the shared HttpSession of backend.http_session, which reuses connections and caches
+responses of endpoints that have a TTL configured; repeated downloads of e.g. the item mapping are served from the
+cache or revalidated using a conditional request.
+Note that the /latest realtime prices have a TTL of 60 seconds; realtime_prices() returns the same snapshot when it is
+called again within a minute, rather than downloading a new one. TTLs are configured in
+backend.http_session.endpoint_ttl.
+
 
 Used as import backend.download as dl
 """
 import datetime
-import json
 import os
 import sqlite3
 import time
 import urllib.error
-import urllib.request
 from typing import Tuple, Optional, Dict, Literal
 
-import requests
 from bs4 import BeautifulSoup
 
 from venv_auto_loader.active_venv import *
@@ -24,13 +28,9 @@ import global_variables.path as gp
 import global_variables.values as val
 import util.str_formats as fmt
 import util.unix_time as ut
+from backend.http_session import http_session
 __t0__ = time.perf_counter()
 
-_request_header = {
-    'User-Agent': 'Homemade GE trading GUI/DB | Disc: Maximuis94'
-}
-
-
 # This method should be accessed through global_variables.local_file.RealtimePricesSnapshot
 def realtime_prices(check_rbpi: bool = False, force_rbpi: bool = False) -> dict:
     """
@@ -66,12 +66,11 @@ def realtime_prices(check_rbpi: bool = False, force_rbpi: bool = False) -> dict:
             raise RuntimeError(f'Failed to fetch data from the Raspberry Pi, while force_rbpi=True')
     
     if data is None:
+        # Responses are cached for 60 seconds, see backend.http_session.endpoint_ttl
         url = "https://prices.runescape.wiki/api/v1/osrs/latest"
-        req = urllib.request.Request(url, headers=_request_header)
         try:
-            with urllib.request.urlopen(req) as handle:
-                data = json.loads(handle.read().decode()).get('data')
-                print(f"[{fmt.dt_(fmt_str='%H:%M:%S')}] Downloading realtime prices snapshot")
+            data = http_session().get_json(url).get('data')
+            print(f"[{fmt.dt_(fmt_str='%H:%M:%S')}] Downloading realtime prices snapshot")
         except urllib.error.HTTPError as e:
             print(f"ERROR in download_wiki_prices_latest, url={url}\n{e}")
             return {}
@@ -108,14 +107,12 @@ def wiki_item_ids() -> Tuple[Optional[str], ...]:
 
     """
     url = "https://oldschool.runescape.wiki/?title=Module:GEIDs/data.json&action=raw&ctype=application%2Fjson"
-    req = urllib.request.Request(url, headers={'User-Agent': 'High-res price data scraper'})
 
     try:
-        with urllib.request.urlopen(req) as handle:
-            _json = json.loads(handle.read().decode())
-            id_name = {_id: _name for _name, _id in _json.items() if not _name.startswith('%')}
+        _json = http_session().get_json(url)
+        id_name = {_id: _name for _name, _id in _json.items() if not _name.startswith('%')}
 
-            return tuple([id_name.get(_id, None) for _id in range(max(list(id_name.keys()))+1)])
+        return tuple([id_name.get(_id, None) for _id in range(max(list(id_name.keys()))+1)])
     except urllib.error.HTTPError as e:
         print(f"ERROR downloading the item_id : item_name mapping in download.wiki_item_ids()\n\tURL: {url}")
         raise e
@@ -152,10 +149,8 @@ def wiki_mapping() -> Dict[int, Dict[str, int | str]]:
     >>> ids[2].get("name") == "Cannonball"
     """
     url = "https://prices.runescape.wiki/api/v1/osrs/mapping"
-    req = urllib.request.Request(url, headers={'User-Agent': 'High-res price data scraper'})
     try:
-        with urllib.request.urlopen(req) as handle:
-            return {int(el.get('id')): el for el in json.loads(handle.read().decode())}
+        return {int(el.get('id')): el for el in http_session().get_json(url)}
     except urllib.error.HTTPError as e:
         print(f"ERROR in download_wiki_mapping, url={url}")
         print(e)
@@ -167,10 +162,7 @@ def wiki_graph(item_id: int or str, min_ts: int = 1427500800):
     if isinstance(item_id, int):
         item_id = str(item_id)
     api_url = f"https://api.weirdgloop.org/exchange/history/osrs/all?id={item_id}"
-    j = None
-    req = urllib.request.Request(api_url, headers=_request_header)
-    with urllib.request.urlopen(req) as url:
-        j = json.loads(url.read().decode())
+    j = http_session().get_json(api_url)
     n_days = int((time.time() - min_ts + 240000) // 86400)
     j, graph = j.get(item_id), []
     j = j[-n_days:]
@@ -195,8 +187,7 @@ def scrape_wiki(url: str, min_ts: int or float = 0):
     :return: The scraped entries, with the oldest entry TS being equal to min_ts
     """
     try:
-        page = requests.get(url)
-        bs = BeautifulSoup(page.content, 'html.parser')
+        bs = BeautifulSoup(http_session().get(url), 'html.parser')
         results = bs.find(id='mw-content-text')
         dat = results.find('div', class_='GEdataprices')['data-data']
         dat = dat.split('|')
@@ -223,7 +214,7 @@ def scrape_wiki(url: str, min_ts: int or float = 0):
                     el += [-1]
                 output.append(el)
             return output
-    except AttributeError:
+    except (AttributeError, urllib.error.HTTPError):
         print(f"AttributeError for url {url}, URL might be corrupted!")
         return None
     except TypeError:
@@ -257,8 +248,7 @@ def osrs_graph_official(item_id: int):
     
     url = f"https://secure.runescape.com/m=itemdb_oldschool/{item_name_url}/viewitem?obj={item_id}"
     # exit(123)
-    page = requests.get(url)
-    bs = BeautifulSoup(page.content, 'html.parser')
+    bs = BeautifulSoup(http_session().get(url), 'html.parser')
     # chart_section = bs.find('div', class_='chart')
     # trade_data = bs.find_all('script')
     # prices, trends, volumes = {}, {}, {}
@@ -336,10 +326,8 @@ def graph_realtime_timeseries(item_id: int):
     
     for next_timestep in list(output.keys()):
         try:
-            req = urllib.request.Request(base_url.replace('X', next_timestep), headers=_request_header)
-            with urllib.request.urlopen(req) as handle:
-                # output[next_timestep] = json.loads(handle.read().decode()).get('data')
-                output[next_timestep] = json.loads(handle.read().decode())
+            # output[next_timestep] = http_session().get_json(base_url.replace('X', next_timestep)).get('data')
+            output[next_timestep] = http_session().get_json(base_url.replace('X', next_timestep))
         except urllib.error.HTTPError as e:
             pass
     return output
@@ -367,12 +355,10 @@ def download_wiki_prices_rt_averaged(timespan: str = '5m', timestamp: int = None
         else:
             # print(f"Unable to download averaged realtime prices with timespan={timespan} for timestamp {timestamp}")
             return None
-    req = urllib.request.Request(url, headers={'User-Agent': 'High-res price data scraper'})
     try:
-        with urllib.request.urlopen(req) as handle:
-            j = json.loads(handle.read().decode())
-            # print(j)
-            return j.get('data'), j.get('timestamp')
+        j = http_session().get_json(url)
+        # print(j)
+        return j.get('data'), j.get('timestamp')
     except urllib.error.HTTPError as e:
         print(f"ERROR in download_wiki_prices_latest, url={url}")
         print(e)
@@ -382,23 +368,21 @@ def download_wiki_prices_rt_averaged(timespan: str = '5m', timestamp: int = None
 def graph_wiki_historical(item_id: int, t1: int or float = 0, t2: int or float = time.time()):
     """ Download historical wiki data for the given `item_id` within the specified time frame """
     url = f"https://api.weirdgloop.org/exchange/history/osrs/all?id={item_id}"
-    req = urllib.request.Request(url, headers=_request_header)
     try:
-        with urllib.request.urlopen(req) as handle:
-            temp = json.loads(handle.read().decode()).get(str(item_id))
-            graph = []
-            for e in temp:
-                timestamp = e.get('timestamp') // 1000
-                ts_as_dt = ut.loc_unix_dt(timestamp=timestamp)
-                if not t1 <= timestamp <= t2:
-                    continue
-                e.update_transaction({
-                    'timestamp': timestamp,
-                    'date': ts_as_dt,
-                    'day_of_week': ts_as_dt.weekday()
-                })
-                graph.append(e)
-            return graph
+        temp = http_session().get_json(url).get(str(item_id))
+        graph = []
+        for e in temp:
+            timestamp = e.get('timestamp') // 1000
+            ts_as_dt = ut.loc_unix_dt(timestamp=timestamp)
+            if not t1 <= timestamp <= t2:
+                continue
+            e.update_transaction({
+                'timestamp': timestamp,
+                'date': ts_as_dt,
+                'day_of_week': ts_as_dt.weekday()
+            })
+            graph.append(e)
+        return graph
     except urllib.error.HTTPError as e:
         return None
 
@@ -0,0 +1,387 @@
+"""
+This module contains the shared HTTP download layer that is used by backend.download.
+
+An HttpSession reuses connections; each thread keeps one persistent (keep-alive) connection per host, rather than
+establishing a new connection for every request. Responses of endpoints that have a time-to-live (TTL) configured are
+stored in an on-disk response cache, which is a sqlite database;
+- If a cached response is younger than its TTL, it is returned without making a request.
+- If it is older, a conditional request is made using its ETag / Last-Modified headers. If the server responds with
+  304 Not Modified, the cached response is returned and its age is reset.
+- Responses of endpoints without a TTL are not cached.
+- Corrupt cache entries are discarded and downloaded again.
+- Responses that expired more than `max_stale` seconds ago are pruned from the cache while responses are stored, so
+  per-item responses (e.g. full wiki histories) do not accumulate.
+
+Concurrent requests for the same url are coalesced; only one request is made, while the other callers wait for its
+result.
+
+HTTP errors are raised as urllib.error.HTTPError, such that callers can handle them like they would when using urllib.
+
+Examples
+--------
+data = json.loads(http_session().get("https://prices.runescape.wiki/api/v1/osrs/mapping"))
+"""
+import gzip
+import http.client
+import json
+import sqlite3
+import threading
+import urllib.error
+import urllib.parse
+import zlib
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from venv_auto_loader.active_venv import *
+import global_variables.path as gp
+__t0__ = time.perf_counter()
+
+
+request_header: Dict[str, str] = {
+    'User-Agent': 'Homemade GE trading GUI/DB | Disc: Maximuis94'
+}
+
+endpoint_ttl: Tuple[Tuple[str, int], ...] = (
+    ("prices.runescape.wiki/api/v1/osrs/latest", 60),
+    ("prices.runescape.wiki/api/v1/osrs/mapping", 86400),
+    ("prices.runescape.wiki/api/v1/osrs/timeseries", 300),
+    ("prices.runescape.wiki/api/v1/osrs/5m", 300),
+    ("prices.runescape.wiki/api/v1/osrs/1h", 3600),
+    ("oldschool.runescape.wiki/?title=Module:GEIDs/data.json", 86400),
+    ("secure.runescape.com/m=itemdb_oldschool/", 3600),
+)
+"""
+Url fragments of cached endpoints and the TTL (seconds) of their responses. Urls that match none are not cached, e.g.
+the weirdgloop exchange history API, as its large per-item responses are downloaded once per update.
+"""
+
+sql_create_http_cache: str = """CREATE TABLE IF NOT EXISTS "http_cache"(
+    "url" TEXT PRIMARY KEY,
+    "etag" TEXT,
+    "last_modified" TEXT,
+    "fetched" INTEGER NOT NULL,
+    "body" BLOB NOT NULL,
+    "expires" INTEGER NOT NULL DEFAULT 0)"""
+
+sql_create_http_cache_index: str = """CREATE INDEX IF NOT EXISTS "http_cache_expires" ON "http_cache"(expires)"""
+
+_redirect_codes = frozenset((301, 302, 303, 307, 308))
+_stale_connection_errors = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError,
+                            ConnectionResetError, ConnectionAbortedError)
+
+
+def get_ttl(url: str) -> Optional[int]:
+    """ Return the TTL of responses from `url`, or None if they are not to be cached """
+    for fragment, ttl in endpoint_ttl:
+        if fragment in url:
+            return ttl
+    return None
+
+
+class CachedResponse(NamedTuple):
+    """
+    Response as stored in the response cache
+
+    Attributes
+    ----------
+    url : str
+        Url of the request
+    etag : Optional[str]
+        ETag header of the response
+    last_modified : Optional[str]
+        Last-Modified header of the response
+    fetched : int
+        Unix timestamp at which the response was last downloaded or revalidated
+    body : bytes
+        Decoded body of the response
+    """
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched: int
+    body: bytes
+
+
+class ResponseCache:
+    """
+    On-disk response cache, stored in the sqlite database at `path`. Access is serialized via a lock. Responses that
+    expired more than `max_stale` seconds ago are pruned at most once per `prune_interval` seconds, while storing a
+    response.
+    """
+    def __init__(self, path: str = gp.f_db_http_cache, max_stale: int = 3600, prune_interval: int = 60):
+        self.path = str(path)
+        self.max_stale = max_stale
+        self.prune_interval = prune_interval
+        self._next_prune = 0
+        self._lock = threading.Lock()
+        self.con = sqlite3.connect(self.path, check_same_thread=False)
+        self.con.execute(sql_create_http_cache)
+        if 'expires' not in [r[1] for r in self.con.execute("""PRAGMA table_info("http_cache")""")]:
+            # Cache created without expiry times; its responses cannot be pruned, so discard them
+            self.con.execute("""DROP TABLE "http_cache" """)
+            self.con.execute(sql_create_http_cache)
+        self.con.execute(sql_create_http_cache_index)
+        self.con.commit()
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """ Return the cached response of `url`, or None if it has not been cached or if its entry is corrupt """
+        with self._lock:
+            row = self.con.execute("""SELECT url, etag, last_modified, fetched, body FROM "http_cache" WHERE url=?""",
+                                   (url,)).fetchone()
+        if row is None:
+            return None
+        response = CachedResponse(*row)
+        if not isinstance(response.fetched, int) or not isinstance(response.body, bytes):
+            self.discard(url)
+            return None
+        return response
+
+    def put(self, response: CachedResponse, ttl: int):
+        """
+        Store `response` with a TTL of `ttl` seconds in the cache, replacing the existing response of its url. Prune
+        responses that expired more than `max_stale` seconds ago if the prune interval has passed.
+        """
+        with self._lock:
+            self.con.execute("""INSERT OR REPLACE INTO "http_cache"(url, etag, last_modified, fetched, body, expires)
+                                VALUES (?, ?, ?, ?, ?, ?)""", (*response, response.fetched + ttl))
+            if response.fetched >= self._next_prune:
+                self.con.execute("""DELETE FROM "http_cache" WHERE expires < ?""",
+                                 (response.fetched - self.max_stale,))
+                self._next_prune = response.fetched + self.prune_interval
+            self.con.commit()
+
+    def touch(self, url: str, fetched: int, ttl: int):
+        """ Mark the cached response of `url` as revalidated at `fetched`, with a TTL of `ttl` seconds """
+        with self._lock:
+            self.con.execute("""UPDATE "http_cache" SET fetched=?, expires=? WHERE url=?""",
+                             (fetched, fetched + ttl, url))
+            self.con.commit()
+
+    def discard(self, url: str):
+        """ Remove the cached response of `url` """
+        with self._lock:
+            self.con.execute("""DELETE FROM "http_cache" WHERE url=?""", (url,))
+            self.con.commit()
+
+    def clear(self):
+        """ Remove all cached responses """
+        with self._lock:
+            self.con.execute("""DELETE FROM "http_cache" """)
+            self.con.commit()
+
+    def close(self):
+        with self._lock:
+            self.con.close()
+
+
+class _PendingRequest:
+    """ Request that is in progress, shared by all callers that requested the same url """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+
+
+class HttpSession:
+    """
+    HTTP client with persistent connections, a conditional-request response cache and request coalescing.
+
+    Attributes
+    ----------
+    cache : Optional[ResponseCache]
+        The response cache. If None, responses are not cached.
+    headers : Dict[str, str]
+        Headers that are sent with each request
+    timeout : float
+        Amount of seconds to wait for a response before raising an exception
+    stats : Counter
+        Amount of requests per outcome; 'hit' (fresh cache entry), 'not_modified' (revalidated cache entry),
+        'downloaded' (full response) and 'coalesced' (result of a concurrent request for the same url)
+    """
+    def __init__(self, cache: Optional[ResponseCache] = None, headers: Dict[str, str] = None, timeout: float = 30.0,
+                 max_redirects: int = 5):
+        self.cache = cache
+        self.headers = dict(request_header if headers is None else headers)
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.stats = Counter()
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, _PendingRequest] = {}
+        self._connections: Dict[threading.Thread, List[http.client.HTTPConnection]] = {}
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        """ Return the persistent connection of the current thread with `netloc`, establish it if needed """
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        con = connections.get((scheme, netloc))
+        if con is None:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            con = cls(netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = con
+            with self._lock:
+                self._connections.setdefault(threading.current_thread(), []).append(con)
+            self.release_connections()
+        return con
+
+    def release_connections(self) -> int:
+        """ Close the connections of threads that have exited and return the amount of closed connections """
+        with self._lock:
+            exited = [t for t in self._connections if not t.is_alive()]
+            connections = [con for t in exited for con in self._connections.pop(t)]
+        for con in connections:
+            con.close()
+        return len(connections)
+
+    def _request(self, url: str, headers: Dict[str, str]) -> Tuple[int, str, http.client.HTTPMessage, bytes]:
+        """ Make a GET request to `url` via a persistent connection and return its status, reason, headers and body """
+        for _ in range(self.max_redirects + 1):
+            parsed = urllib.parse.urlsplit(url)
+            path = (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+            for attempt in range(2):
+                con = self._connection(parsed.scheme, parsed.netloc)
+                try:
+                    con.request('GET', path, headers={**self.headers, 'Accept-Encoding': 'gzip, deflate', **headers})
+                    response = con.getresponse()
+                    body = response.read()
+                    break
+                except _stale_connection_errors as e:
+                    # The server closed the kept-alive connection; reconnect once
+                    con.close()
+                    if attempt == 1:
+                        raise e
+                except (OSError, http.client.HTTPException) as e:
+                    con.close()
+                    raise e
+            if response.will_close:
+                con.close()
+            if response.status in _redirect_codes and response.getheader('Location'):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            encoding = (response.getheader('Content-Encoding') or '').lower()
+            if encoding == 'gzip':
+                body = gzip.decompress(body)
+            elif encoding == 'deflate':
+                body = zlib.decompress(body)
+            return response.status, response.reason, response.headers, body
+        raise urllib.error.HTTPError(url, 310, "Too many redirects", None, None)
+
+    def _fetch(self, url: str, ttl: Optional[int]) -> bytes:
+        """ Return the body of `url`, from the cache if possible """
+        cached = None if self.cache is None or ttl is None else self.cache.get(url)
+        t = int(time.time())
+        if cached is not None and t - cached.fetched < ttl:
+            self._count('hit')
+            return cached.body
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        status, reason, response_headers, body = self._request(url, headers)
+
+        if status == 304 and cached is not None:
+            self._count('not_modified')
+            self.cache.touch(url, t, ttl)
+            return cached.body
+        if status >= 400:
+            raise urllib.error.HTTPError(url, status, reason, response_headers, None)
+        self._count('downloaded')
+        if self.cache is not None and ttl is not None:
+            self.cache.put(CachedResponse(url, response_headers.get('ETag'), response_headers.get('Last-Modified'),
+                                          t, body), ttl)
+        return body
+
+    def get(self, url: str, ttl: Optional[int] = -1) -> bytes:
+        """
+        Return the body of the response from `url`. If another thread is requesting `url` already, wait for its
+        result instead.
+
+        Parameters
+        ----------
+        url : str
+            Url that is requested
+        ttl : Optional[int], optional
+            TTL of the response in seconds. If None, the response is not cached. By default, the TTL configured for
+            the endpoint is used.
+
+        Returns
+        -------
+        bytes
+            The decoded body of the response
+
+        Raises
+        ------
+        urllib.error.HTTPError
+            If the server responded with an error status code
+        """
+        ttl = get_ttl(url) if ttl == -1 else ttl
+        with self._lock:
+            pending = self._pending.get(url)
+            is_owner = pending is None
+            if is_owner:
+                pending = self._pending[url] = _PendingRequest()
+        if not is_owner:
+            pending.done.wait()
+            self._count('coalesced')
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            pending.result = self._fetch(url, ttl)
+            return pending.result
+        except BaseException as e:
+            pending.error = e
+            raise e
+        finally:
+            with self._lock:
+                del self._pending[url]
+            pending.done.set()
+
+    def get_json(self, url: str, ttl: Optional[int] = -1):
+        """
+        Return the json-decoded body of the response from `url`, see HttpSession.get(). If the body was served from the
+        cache and cannot be decoded, the cached response is discarded and downloaded again.
+        """
+        cached = None if self.cache is None else self.cache.get(url)
+        body = self.get(url, ttl)
+        try:
+            return json.loads(body.decode())
+        except ValueError as e:
+            if self.cache is not None:
+                self.cache.discard(url)
+            if cached is None or cached.body != body:
+                raise e
+        return json.loads(self.get(url, ttl).decode())
+
+    def close(self):
+        """ Close all connections and the response cache """
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for con in [con for cons in connections.values() for con in cons]:
+            con.close()
+        self._local = threading.local()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_session: Optional[HttpSession] = None
+_session_lock = threading.Lock()
+
+
+def http_session() -> HttpSession:
+    """ Return the HttpSession shared by all downloads; establish it upon the first call """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = HttpSession(ResponseCache())
+        return _session
@@ -0,0 +1,146 @@
+"""
+This module contains the implementation of the ingest journal of the timeseries database.
+
+The journal is a table within the timeseries database with one entry per source file that is ingested. An entry holds
+the checksum of the file, a progress marker and whether the file has been ingested completely. Rows of a source file
+are ingested in ascending item_id order and committed in chunks. Each commit includes the progress marker; the highest
+item_id of which all rows have been ingested. As a result, the journal and the timeseries data are always consistent
+with each other, regardless of when the transfer is interrupted.
+
+If a transfer is interrupted, the next transfer resumes each source file right after its progress marker. Rows that
+were committed already are not read again. Since rows are inserted with INSERT OR IGNORE, replaying a source file that
+was (partially) ingested before does not change the outcome.
+
+A source file is identified by its name and its checksum. If a file is registered with a checksum that differs from its
+journal entry, its progress is discarded and the file is ingested from the start.
+
+The journal supersedes the merged_exports manifest. Upon creating the journal, the exports listed in the manifest are
+migrated as completed entries without a checksum. These are identified by name only; the checksum is filled in when the
+file is registered again.
+
+Examples
+--------
+journal = IngestJournal(con)
+if journal.register('240101000000.db', file_checksum(path), os.path.getsize(path)).completed:
+    ...
+"""
+import hashlib
+import sqlite3
+from typing import NamedTuple, Optional, Set
+
+from venv_auto_loader.active_venv import *
+__t0__ = time.perf_counter()
+
+
+sql_create_journal: str = """CREATE TABLE IF NOT EXISTS "ingest_journal"(
+    "file" TEXT PRIMARY KEY,
+    "checksum" TEXT NOT NULL,
+    "size" INTEGER NOT NULL,
+    "progress" INTEGER NOT NULL DEFAULT -1,
+    "n_rows" INTEGER NOT NULL DEFAULT 0,
+    "n_inserted" INTEGER NOT NULL DEFAULT 0,
+    "completed" INTEGER NOT NULL DEFAULT 0,
+    "timestamp" INTEGER NOT NULL)"""
+
+sql_migrate_merged_exports: str = """INSERT OR IGNORE INTO "ingest_journal"(file, checksum, size, progress, n_rows,
+    n_inserted, completed, timestamp) SELECT file, '', 0, -1, n_rows, n_inserted, 1, timestamp FROM "merged_exports" """
+
+sql_register: str = """INSERT OR REPLACE INTO "ingest_journal"(file, checksum, size, timestamp) VALUES (?, ?, ?, ?)"""
+
+sql_update_progress: str = """UPDATE "ingest_journal" SET progress=?, n_rows=n_rows+?, n_inserted=n_inserted+?,
+    completed=?, timestamp=? WHERE file=?"""
+
+
+def file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    """ Return the sha256 checksum of the file at `path` as a hex string """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class JournalEntry(NamedTuple):
+    """
+    Journal entry of a source file
+
+    Attributes
+    ----------
+    file : str
+        Name of the source file
+    checksum : str
+        sha256 checksum of the source file
+    size : int
+        Size of the source file in bytes
+    progress : int
+        item_id up to which (inclusive) all rows of the source file have been committed, -1 if none were committed
+    n_rows : int
+        Amount of rows of the source file that have been processed
+    n_inserted : int
+        Amount of processed rows that were inserted, i.e. rows that did not exist yet
+    completed : bool
+        True if all rows of the source file have been committed
+    timestamp : int
+        Unix timestamp of the most recent journal update
+    """
+    file: str
+    checksum: str
+    size: int
+    progress: int
+    n_rows: int
+    n_inserted: int
+    completed: bool
+    timestamp: int
+
+
+class IngestJournal:
+    """
+    Interface for the ingest journal table of the database connected to via `con`. Progress updates are not committed,
+    so they can be committed together with the rows they refer to.
+    """
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+        self.con.execute(sql_create_journal)
+        if self._cursor().execute("""SELECT name FROM sqlite_master WHERE type='table' AND name='merged_exports'""")\
+                .fetchone() is not None:
+            self.con.execute(sql_migrate_merged_exports)
+            self.con.execute("""DROP TABLE "merged_exports" """)
+        self.con.commit()
+
+    def _cursor(self) -> sqlite3.Cursor:
+        c = self.con.cursor()
+        c.row_factory = None
+        return c
+
+    def entry(self, file: str) -> Optional[JournalEntry]:
+        """ Return the journal entry of `file`, or None if it has not been registered """
+        row = self._cursor().execute("""SELECT * FROM "ingest_journal" WHERE file=?""", (file,)).fetchone()
+        return None if row is None else JournalEntry(*row[:6], bool(row[6]), row[7])
+
+    def completed(self) -> Set[str]:
+        """ Return the names of all source files that have been ingested completely """
+        return {r[0] for r in self._cursor().execute("""SELECT file FROM "ingest_journal" WHERE completed=1""")}
+
+    def register(self, file: str, checksum: str, size: int) -> JournalEntry:
+        """
+        Register source file `file` with checksum `checksum` and return its journal entry. If `file` was registered
+        with the same checksum before, or if it was migrated from the merged_exports manifest, its existing entry is
+        returned, else its progress is reset. Changes are committed.
+        """
+        entry = self.entry(file)
+        if entry is not None and entry.checksum == checksum:
+            return entry
+        if entry is not None and entry.checksum == '' and entry.completed:
+            self.con.execute("""UPDATE "ingest_journal" SET checksum=?, size=? WHERE file=?""", (checksum, size, file))
+            self.con.commit()
+            return self.entry(file)
+        self.con.execute(sql_register, (file, checksum, size, int(time.time())))
+        self.con.commit()
+        return self.entry(file)
+
+    def update_progress(self, file: str, progress: int, n_rows: int, n_inserted: int, completed: bool = False):
+        """
+        Set the progress marker of `file` to `progress` and add `n_rows` and `n_inserted` to its counts. Changes are
+        not committed.
+        """
+        self.con.execute(sql_update_progress, (progress, n_rows, n_inserted, int(completed), int(time.time()), file))
@@ -0,0 +1,242 @@
+"""
+This module contains the implementation of the item_stats table of the timeseries database.
+
+The item_stats table holds summary statistics per item, per src; the amount of rows, the first and last timestamp, the
+price and volume of the most recent row and rolling averages of the price and volume over the most recent rows. All
+statistics of all items can be loaded with one query, and those of one item with one primary key lookup.
+
+The table is maintained incrementally while rows are ingested; each time a DirtyRangeTracker is flushed, the statistics
+of the (item_id, src) pairs that were touched are updated. Rows that were appended after the last timestamp of the
+statistics are counted via a range scan on the primary key. If rows were ingested before the last timestamp, e.g.
+backfilled avg5m data, the row count is marked as stale. Stale row counts are recomputed via refresh_item_stats(),
+which is executed after an import. When the table is created in an existing database, the statistics of all items are
+computed from scratch, such that pairs that are not touched by subsequent ingests have statistics as well.
+
+Examples
+--------
+stats = load_item_stats(con)
+n_wiki_rows = stats[2][0].n_rows
+"""
+import sqlite3
+from collections.abc import Iterable
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from venv_auto_loader.active_venv import *
+import util.str_formats as fmt
+__t0__ = time.perf_counter()
+
+
+n_rolling: int = 7
+"""Amount of most recent rows (with a price) that the rolling averages are computed over"""
+
+sql_create_item_stats: str = """CREATE TABLE IF NOT EXISTS "item_stats"(
+    "item_id" INTEGER NOT NULL,
+    "src" INTEGER NOT NULL,
+    "n_rows" INTEGER NOT NULL DEFAULT 0,
+    "t0" INTEGER,
+    "t1" INTEGER,
+    "price" INTEGER,
+    "volume" INTEGER,
+    "avg_price" REAL,
+    "avg_volume" REAL,
+    "stale" INTEGER NOT NULL DEFAULT 0,
+    "updated" INTEGER NOT NULL,
+    PRIMARY KEY(item_id, src) ) WITHOUT ROWID"""
+
+sql_upsert_item_stats: str = """INSERT OR REPLACE INTO "item_stats"(item_id, src, n_rows, t0, t1, price, volume,
+    avg_price, avg_volume, stale, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+sql_select_item_stats: str = """SELECT item_id, src, n_rows, t0, t1, price, volume, avg_price, avg_volume, stale,
+    updated FROM "item_stats" """
+
+
+class ItemStats(NamedTuple):
+    """
+    Statistics of the rows of one src in the timeseries table of one item
+
+    Attributes
+    ----------
+    item_id : int
+        The item_id
+    src : int
+        The src of the rows
+    n_rows : int
+        Amount of rows. If `stale`, rows ingested before `t1` since the last refresh may not be included.
+    t0 : Optional[int]
+        Timestamp of the oldest row
+    t1 : Optional[int]
+        Timestamp of the most recent row
+    price : Optional[int]
+        Price of the most recent row
+    volume : Optional[int]
+        Volume of the most recent row
+    avg_price : Optional[float]
+        Average price of the most recent `n_rolling` rows with a price
+    avg_volume : Optional[float]
+        Average volume of the most recent `n_rolling` rows with a price
+    stale : bool
+        True if n_rows is to be recomputed
+    updated : int
+        Unix timestamp of the most recent update
+    """
+    item_id: int
+    src: int
+    n_rows: int
+    t0: Optional[int]
+    t1: Optional[int]
+    price: Optional[int]
+    volume: Optional[int]
+    avg_price: Optional[float]
+    avg_volume: Optional[float]
+    stale: bool
+    updated: int
+
+
+def create_table(con: sqlite3.Connection) -> bool:
+    """
+    Create the item_stats table in the database connected to via `con`, if it does not exist. Return True if it was
+    created.
+    """
+    if con.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name='item_stats'""").fetchone() is not None:
+        return False
+    con.execute(sql_create_item_stats)
+    return True
+
+
+def _timeseries_pairs(c: sqlite3.Cursor) -> List[Tuple[int, int]]:
+    """ Return the (item_id, src) pairs of all rows in the timeseries tables """
+    tables = [t[0] for t in c.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+    return [(int(t[4:]), src) for t in tables if len(t) == 9 and t[:4] == 'item' and t[4:].isdigit()
+            for src, in c.execute(f"""SELECT DISTINCT src FROM "{t}" """).fetchall()]
+
+
+def _compute_stats(c: sqlite3.Cursor, item_id: int, src: int, n_rows: int, stale: bool) -> tuple:
+    """ Compute the statistics of `item_id`, `src` other than the row count and return them as an item_stats row """
+    table = f'"item{item_id:0>5}"'
+    t0 = c.execute(f"""SELECT MIN(timestamp) FROM {table} WHERE src=?""", (src,)).fetchone()[0]
+    last = c.execute(f"""SELECT timestamp, price, volume FROM {table} WHERE src=? ORDER BY timestamp DESC LIMIT 1""",
+                     (src,)).fetchone() or (None, None, None)
+    avg_price, avg_volume = c.execute(f"""SELECT AVG(price), AVG(volume) FROM (SELECT price, volume FROM {table}
+                                          WHERE src=? AND price > 0 ORDER BY timestamp DESC LIMIT ?)""",
+                                      (src, n_rolling)).fetchone()
+    return item_id, src, n_rows, t0, *last, avg_price, avg_volume, int(stale), int(time.time())
+
+
+def compute_item_stats(con: sqlite3.Connection, item_id: int, src: int) -> Optional[ItemStats]:
+    """
+    Compute the statistics of `item_id`, `src` from its timeseries table, without registering them. Return None if
+    there are no rows.
+    """
+    c = con.cursor()
+    c.row_factory = None
+    try:
+        n_rows = c.execute(f"""SELECT COUNT(*) FROM "item{item_id:0>5}" WHERE src=?""", (src,)).fetchone()[0]
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return None
+        raise e
+    if n_rows == 0:
+        return None
+    row = _compute_stats(c, item_id, src, n_rows, False)
+    return ItemStats(*row[:9], bool(row[9]), row[10])
+
+
+def update_item_stats(con: sqlite3.Connection, ranges: Dict[Tuple[int, int], Iterable[int]]) -> int:
+    """
+    Update the statistics of the (item_id, src) pairs in `ranges`, which maps them to the (t0, t1) timestamp range of
+    the rows that were ingested. Changes are not committed. Return the amount of statistics rows that were updated.
+    """
+    if len(ranges) == 0:
+        return 0
+    c = con.cursor()
+    c.row_factory = None
+    if create_table(con):
+        # Seed the statistics of all items, including the ingested rows
+        rows = []
+        for item_id, src in _timeseries_pairs(c):
+            n_rows = c.execute(f"""SELECT COUNT(*) FROM "item{item_id:0>5}" WHERE src=?""", (src,)).fetchone()[0]
+            rows.append(_compute_stats(c, item_id, src, n_rows, False))
+        con.executemany(sql_upsert_item_stats, rows)
+        return len(rows)
+    
+    rows = []
+    for (item_id, src), (t0, _) in ranges.items():
+        table = f'"item{item_id:0>5}"'
+        current = c.execute("""SELECT n_rows, t1, stale FROM "item_stats" WHERE item_id=? AND src=?""",
+                            (item_id, src)).fetchone()
+        if current is None or current[1] is None:
+            n_rows, stale = c.execute(f"""SELECT COUNT(*) FROM {table} WHERE src=?""", (src,)).fetchone()[0], False
+        elif t0 > current[1]:
+            n_rows = current[0] + c.execute(f"""SELECT COUNT(*) FROM {table} WHERE src=? AND timestamp > ?""",
+                                            (src, current[1])).fetchone()[0]
+            stale = bool(current[2])
+        else:
+            n_rows, stale = current[0], True
+        rows.append(_compute_stats(c, item_id, src, n_rows, stale))
+    con.executemany(sql_upsert_item_stats, rows)
+    return len(rows)
+
+
+def refresh_item_stats(con: sqlite3.Connection, item_ids: Iterable[int] = None, stale_only: bool = True) -> int:
+    """
+    Recompute the item statistics and commit the changes. Return the amount of statistics rows that were recomputed.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the timeseries database
+    item_ids : Iterable[int], optional, None by default
+        If passed, only recompute the statistics of these items
+    stale_only : bool, optional, True by default
+        If True, only recompute statistics with a stale row count. If False, compute the statistics of each src of each
+        item from scratch. If the item_stats table does not exist yet, all statistics are computed from scratch.
+    """
+    c = con.cursor()
+    c.row_factory = None
+    if create_table(con):
+        stale_only = False
+    if stale_only:
+        pairs = c.execute("""SELECT item_id, src FROM "item_stats" WHERE stale=1""").fetchall()
+    else:
+        pairs = _timeseries_pairs(c)
+    if item_ids is not None:
+        item_ids = frozenset(item_ids)
+        pairs = [p for p in pairs if p[0] in item_ids]
+
+    start, rows = time.perf_counter(), []
+    for idx, (item_id, src) in enumerate(pairs, start=1):
+        n_rows = c.execute(f"""SELECT COUNT(*) FROM "item{item_id:0>5}" WHERE src=?""", (src,)).fetchone()[0]
+        rows.append(_compute_stats(c, item_id, src, n_rows, False))
+        if idx % 100 == 0:
+            print(f"\t[{fmt.passed_pc(start)}] Refreshing item stats {idx}/{len(pairs)}", end='\r')
+    if not stale_only:
+        c.execute("""DELETE FROM "item_stats" """)
+    con.executemany(sql_upsert_item_stats, rows)
+    con.commit()
+    return len(rows)
+
+
+def load_item_stats(con: sqlite3.Connection, item_ids: Iterable[int] = None) -> Dict[int, Dict[int, ItemStats]]:
+    """
+    Load the statistics of all items, or of `item_ids` if passed, with one query. Return them as a dict with item_id as
+    key and a dict that maps src to its ItemStats as value.
+    """
+    c = con.cursor()
+    c.row_factory = lambda _, row: ItemStats(*row[:9], bool(row[9]), row[10])
+    sql, parameters = sql_select_item_stats, ()
+    if item_ids is not None:
+        parameters = tuple(item_ids)
+        sql += f"""WHERE item_id IN ({', '.join(['?' for _ in parameters])})"""
+    stats = {}
+    try:
+        for s in c.execute(sql, parameters):
+            stats.setdefault(s.item_id, {})[s.src] = s
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise e
+    return stats
+
+
+def get_item_stats(con: sqlite3.Connection, item_id: int) -> Dict[int, ItemStats]:
+    """ Return the statistics of `item_id` as a dict that maps src to its ItemStats """
+    return load_item_stats(con, (item_id,)).get(item_id, {})
@@ -0,0 +1,216 @@
+"""
+This module contains the implementation of the columnar npy array store.
+
+Each item has its own directory within the array directory. Every column is saved as a separate, fixed-dtype .npy file,
+next to a small json manifest that describes the columns, their dtypes and the timestamp range covered. Files are saved
+without pickling, which allows them to be opened as read-only memory maps; opening an item does not copy its data into
+memory, only the parts of a column that are actually accessed are read from disk.
+
+Rows are sorted by timestamp, so time-range slices are derived via a binary search on the timestamp column, rather than
+via boolean masks that span the entire array.
+
+Examples
+--------
+Saving the columns of an item;
+    NpyArrayStore().save_item(2, {'timestamp': timestamps, 'buy_price': buy_prices})
+
+Loading the buy prices from the past week;
+    item = NpyArrayStore().load_item(2)
+    buy_prices = item.time_slice(t0=int(time.time()) - 604800)['buy_price']
+
+Loading an item for a graph, which also exposes item attributes like item.item_name and item.buy_limit;
+    item = load_npy_array(2)
+"""
+import json
+from collections.abc import Iterable, Mapping
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from venv_auto_loader.active_venv import *
+import global_variables.osrs as go
+import global_variables.path as gp
+__t0__ = time.perf_counter()
+
+
+def column_dtype(column: str) -> np.dtype:
+    """ Return the dtype of `column`; float64 for gap and coefficient columns, int64 for all other columns """
+    return np.dtype(np.float64) if column[:3] == 'gap' or 'coefficient' in column else np.dtype(np.int64)
+
+
+def split_columns(ar: np.ndarray, column_names: Iterable[str]) -> Dict[str, np.ndarray]:
+    """ Split 2-dimensional array `ar` into fixed-dtype columns named after `column_names` """
+    return {c: ar[:, idx].astype(column_dtype(c)) for idx, c in enumerate(column_names)}
+
+
+class NpyItemArrays(Mapping):
+    """
+    Read-only view on the columns of a single item in the array store. Columns are opened as memory maps upon first
+    access. Columns can be accessed as item['buy_price'] or as item.buy_price. Attributes that are not a column, e.g.
+    item.item_name, are taken from `item`, which is fetched from the ItemDb upon first access if it was not passed.
+    """
+    def __init__(self, item_id: int, directory: str, manifest: dict, mmap_mode: Optional[str] = 'r', item=None):
+        self.item_id = item_id
+        self.directory = directory
+        self.manifest = manifest
+        self.mmap_mode = mmap_mode
+        self._item = item
+        self._columns: Dict[str, np.ndarray] = {}
+
+    @property
+    def columns(self) -> List[str]:
+        """ The names of the columns in this item """
+        return list(self.manifest['columns'])
+
+    @property
+    def n_rows(self) -> int:
+        """ The amount of rows in this item """
+        return self.manifest['n_rows']
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        ar = self._columns.get(column)
+        if ar is None:
+            if column not in self.manifest['columns']:
+                raise KeyError(f"Column {column} does not exist for item_id={self.item_id}")
+            ar = np.load(f"{self.directory}{column}.npy", mmap_mode=self.mmap_mode, allow_pickle=False)
+            self._columns[column] = ar
+        return ar
+
+    @property
+    def item(self):
+        """ The Item this array belongs to """
+        if self._item is None:
+            self._item = go.itemdb[self.item_id]
+        return self._item
+
+    def __getattr__(self, column: str) -> np.ndarray:
+        if column.startswith('_') or column in ('item_id', 'directory', 'manifest', 'mmap_mode'):
+            raise AttributeError(column)
+        if column in self.manifest['columns']:
+            return self[column]
+        try:
+            return getattr(self.item, column)
+        except AttributeError as e:
+            raise AttributeError(f"Column {column} does not exist for item_id={self.item_id}") from e
+
+    def __iter__(self):
+        return iter(self.manifest['columns'])
+
+    def __len__(self):
+        return len(self.manifest['columns'])
+
+    def index_range(self, t0: int = None, t1: int = None) -> Tuple[int, int]:
+        """ Return the index range [i0, i1) of the rows with a timestamp in [`t0`, `t1`) via a binary search """
+        timestamps = self['timestamp']
+        i0 = 0 if t0 is None else int(np.searchsorted(timestamps, t0, side='left'))
+        i1 = len(timestamps) if t1 is None else int(np.searchsorted(timestamps, t1, side='left'))
+        return i0, max(i0, i1)
+
+    def time_slice(self, t0: int = None, t1: int = None, columns: Iterable[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Return the rows with a timestamp in [`t0`, `t1`) for each of the `columns`, or all columns if `columns` is None.
+        The arrays that are returned are views on the memory maps, which means no data is copied.
+        """
+        i0, i1 = self.index_range(t0, t1)
+        return {c: self[c][i0:i1] for c in (self.columns if columns is None else columns)}
+
+
+class NpyArrayStore:
+    """
+    Class for saving and loading the columns of npy db items as memory-mappable npy files.
+
+    Attributes
+    ----------
+    directory : str
+        Root directory of the array store. Each item is saved in a subdirectory named after its zero-padded item_id.
+    """
+    manifest_file: str = 'manifest.json'
+
+    def __init__(self, directory: str = gp.dir_npy_arrays):
+        self.directory = directory if directory.endswith('/') else directory + '/'
+
+    def item_directory(self, item_id: int) -> str:
+        """ Return the directory in which the columns of `item_id` are saved """
+        return f"{self.directory}{item_id:0>5}/"
+
+    def manifest(self, item_id: int) -> Optional[dict]:
+        """ Return the manifest of `item_id`, or None if `item_id` has not been saved """
+        try:
+            with open(self.item_directory(item_id) + self.manifest_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def item_ids(self) -> List[int]:
+        """ Return the item_ids that are saved in this store """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted([int(d) for d in os.listdir(self.directory)
+                       if d.isdigit() and os.path.exists(f"{self.directory}{d}/{self.manifest_file}")])
+
+    def save_item(self, item_id: int, columns: Mapping[str, np.ndarray]):
+        """
+        Save `columns` of `item_id`. Columns are sorted by timestamp and each column is saved as a contiguous,
+        fixed-dtype npy file. The manifest is written last, so a partially saved item is never loaded.
+
+        Parameters
+        ----------
+        item_id : int
+            The item_id the columns belong to
+        columns : Mapping[str, np.ndarray]
+            Column names mapped to 1-dimensional arrays of equal length. Should include a 'timestamp' column.
+        """
+        if 'timestamp' not in columns:
+            raise ValueError(f"Unable to save columns of item_id={item_id} without a timestamp column")
+        order = np.argsort(np.asarray(columns['timestamp']), kind='stable')
+        sorted_columns = {c: np.ascontiguousarray(np.asarray(ar)[order]) for c, ar in columns.items()}
+        for c, ar in sorted_columns.items():
+            if ar.dtype == object:
+                raise TypeError(f"Column {c} of item_id={item_id} has dtype object, which cannot be saved without "
+                                f"pickling")
+
+        directory = self.item_directory(item_id)
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = directory + self.manifest_file
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        for c, ar in sorted_columns.items():
+            np.save(f"{directory}{c}.tmp.npy", ar, allow_pickle=False)
+            os.replace(f"{directory}{c}.tmp.npy", f"{directory}{c}.npy")
+
+        timestamps = sorted_columns['timestamp']
+        manifest = {
+            'item_id': item_id,
+            'n_rows': len(timestamps),
+            't0': int(timestamps[0]) if len(timestamps) > 0 else None,
+            't1': int(timestamps[-1]) if len(timestamps) > 0 else None,
+            'columns': {c: ar.dtype.str for c, ar in sorted_columns.items()},
+            'created': int(time.time())
+        }
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def load_item(self, item_id: int, mmap_mode: Optional[str] = 'r', item=None) -> NpyItemArrays:
+        """
+        Load the columns of `item_id`. Columns are opened lazily as memory maps with mode `mmap_mode`; pass None to
+        load them into memory instead. `item` is used for attributes that are not a column; if it is not passed, it is
+        fetched upon first access.
+        """
+        manifest = self.manifest(item_id)
+        if manifest is None:
+            raise FileNotFoundError(f"No arrays were saved for item_id={item_id} in {self.directory}")
+        return NpyItemArrays(item_id, self.item_directory(item_id), manifest, mmap_mode, item)
+
+    def delete_item(self, item_id: int):
+        """ Remove all files of `item_id` from the store """
+        shutil.rmtree(self.item_directory(item_id), ignore_errors=True)
+
+
+def load_npy_array(item_id: int, item=None, directory: str = gp.dir_npy_arrays) -> NpyItemArrays:
+    """
+    Open the columns of `item_id` in the array store at `directory` as read-only memory maps. This replaces the old
+    NpyArray loaders; the item is opened without reading its columns, which are paged in as they are sliced.
+    """
+    return NpyArrayStore(directory).load_item(item_id, item=item)
@@ -21,6 +21,10 @@ import util.file as uf
 import util.str_formats as fmt
 import util.unix_time as ut
 from common.item import create_item, Item
+import backend.npy_watermark as npy_wm
+from backend.npy_array_store import NpyArrayStore, NpyItemArrays, split_columns
+from backend.npy_row_builder import build_npy_rows
+from backend.prices_listbox import build_prices_listbox, prices_listbox_entry
 from data_processing.npy_array_computations import avg_price_summed_volume
 from file.file import File
 from global_variables.datapoint import NpyDatapoint as NpyDp
@@ -47,6 +51,7 @@ class NpyDbUpdater(Database):
     NpyDatapoint = NpyDp
     npy_columns = NpyDatapoint.__match_args__
     array_directory = gp.dir_npy_arrays
+    array_store: NpyArrayStore = NpyArrayStore(gp.dir_npy_arrays)
     sql_i = f"""INSERT OR REPLACE INTO ___{str(NpyDatapoint.__match_args__)}
                             VALUES {str(tuple(['?' for _ in NpyDatapoint.__match_args__]))}""".replace("'", "")
     sql_del_rows: str = """DELETE FROM ___ WHERE timestamp < ?"""
@@ -63,7 +68,7 @@ class NpyDbUpdater(Database):
     vacuum_db: bool = False
     
     def __init__(self, db_path: File = gp.f_db_npy, source_db_path: str = gp.f_db_timeseries,
-                 item_ids: Sequence = go.npy_items, prices_listbox_path: File or None = gp.f_prices_listbox,
+                 item_ids: Sequence = None, prices_listbox_path: File or None = gp.f_prices_listbox,
                  execute_update: bool = True, add_arrays: bool = True, **kwargs):
         """
         
@@ -93,8 +98,8 @@ class NpyDbUpdater(Database):
         
         """
         super().__init__(path=db_path, parse_tables=False)
-        self.item_ids = item_ids
-        self.n = len(item_ids)
+        self.item_ids = go.npy_items if item_ids is None else item_ids
+        self.n = len(self.item_ids)
         self.global_counter = False
         
         if kwargs.get('new_db') is not None and kwargs.get('new_db') and db_path.exists():
@@ -169,15 +174,7 @@ class NpyDbUpdater(Database):
     
     def configure_default_timestamps(self):
         """ Set up the timestamp array, given the configurations. """
-        t1 = 0
-        for i in go.most_traded_items:
-            t1 = max(t1, self.src_db.execute(
-                self.set_table_name(f"""SELECT MAX(timestamp) FROM ___
-                WHERE src in {SRC.by_source('avg5m')}""", i),
-                factory=0).fetchone())
-        t1 = int(round(t1 / cfg.npy_round_t1, 0) * cfg.npy_round_t1)
-        self.t0 = t1 - t1 % cfg.npy_round_t0 - cfg.npy_db_timespan_days * 86400
-        self.t1 = t1 - t1 % cfg.npy_round_t1
+        self.t0, self.t1 = npy_wm.default_timestamps(self.src_db)
         self.timestamps = range(self.t0, self.t1, 300)
         global min_timestamp, max_timestamp, _n_to_do
         min_timestamp, max_timestamp = self.t0, self.t1
@@ -195,7 +192,7 @@ class NpyDbUpdater(Database):
                   f'Db size: +{fmt.fsize(self.fsize() - self.db_size_start)}  '
                   f'Rows [+ {n_rows} / - {n_deleted}]  {n_tables}', end='\r')
     
-    def generate_db(self, item_ids: Sequence = go.npy_items, t0: int = None, t1: int = None):
+    def generate_db(self, item_ids: Sequence = None, t0: int = None, t1: int = None):
         """
         Generate rows for the Npy db on a per-item basis. Iterate over item_ids in `item_ids` and fetch row data
         spanning from `t0` to `t1`. Default timestamp interval is based on global_variables.configurations values.
@@ -219,11 +216,17 @@ class NpyDbUpdater(Database):
 
         """
         print(f'\tUpdating Npy array db...')
+        if item_ids is None:
+            item_ids = go.npy_items
         if t0 is None:
             t0 = self.t0
         if t1 is None:
             t1 = self.t1
         self.con = self.write_con
+        con = self.src_db.write_con
+        npy_wm.prune_dirty_ranges(con)
+        con.commit()
+        con.close()
         exe_times_item = []
         n_items, n_rows, n_deleted, n_created, n_skipped = len(item_ids), 0, 0, 0, 0
         for idx, item_id in enumerate(item_ids):
@@ -231,73 +234,33 @@ class NpyDbUpdater(Database):
             self.update_item_id(item_id)
             
             global item, est_vol_per_char
+            item = create_item(item_id)
+            if not isinstance(item, Item):
+                raise TypeError
             sql_i = self.sql.get('insert')
             try:
                 self.generate_table()
                 # print(f'Generated new table item{item_id:0>5}')
                 n_created += 1
                 _t0 = t0
+                self.repair_dirty_ranges(item_id, item.buy_limit, t1)
             except sqlite3.OperationalError:
                 # print(f'Removing expired rows for item {item_id}')
                 n_deleted += self.delete_rows()
+                n_rows += self.repair_dirty_ranges(item_id, item.buy_limit, t1)
                 _t0 = self.execute(self.sql.get("get_t0"), factory=0).fetchone()
-                if _t0 is not None and _t0 >= t1-300:
+                if _t0 is None:
+                    _t0 = t0
+                elif _t0 >= t1-300:
                     n_skipped += 1
                     self.updater_print(idx-n_skipped, n_items-n_skipped, n_rows, n_deleted, n_created, exe_times_item)
                     continue
             
-            item = create_item(item_id)
-            if not isinstance(item, Item):
-                raise TypeError
             try:
-                item_rows = 0
-                for timestamp, w_p, w_v, w_ts, b_p, b_v, s_p, s_v, rt_p in self.generate_rows(item_id, _t0, t1):
-                    # n_rows += 1
-                    item_rows += 1
-                    # print(rt_p)
-                    n_rt = len(rt_p)
-                    if n_rt > 0:
-                        rt_min, rt_max, rt_avg = rt_p[0], rt_p[-1], sum(rt_p) // len(rt_p)
-                        tax = int(np.average(rt_p) * .01)
-                        rt_margin = rt_p[-1]-rt_p[0]-tax
-                    else:
-                        rt_min, rt_max, rt_avg, rt_margin = 0, 0, 0, 0
-                        tax = int(max(s_p, b_p, w_p) * .01)
-                    avg5m_margin = s_p - b_p-tax if min(b_p, s_p) != 0 else 0
-                    est_vol_per_char = min(item.buy_limit*4, w_v // 10)
-                    volume_coefficient = min(item.buy_limit, w_v) / max(item.buy_limit, 1)
-                    
-                    dt = ut.utc_unix_dt(timestamp)
-                    avg5m_price, avg5m_volume = ((b_p+s_p)//2 if min(b_p, s_p) > 0 else max(b_p, s_p)), b_v+s_v
-                    try:
-                        self.con.execute(sql_i, (item_id, timestamp, dt.minute, dt.hour, dt.day, dt.month, dt.year,
-                                                 dt.weekday(), timestamp//3600, timestamp // 86400, timestamp // 604800,
-                                                 w_ts, w_p, w_v, w_p * w_v, w_v // 288,
-                                                 b_p, b_v, b_p*b_v,
-                                                 s_p, s_v, s_p*s_v,
-                                                 avg5m_price, avg5m_volume, avg5m_price*avg5m_volume, avg5m_margin,
-                                                 (s_p-b_p)/w_p, (b_p-w_p)/w_p, (s_p-w_p)/w_p,
-                                                 rt_avg, rt_min, rt_max, n_rt, rt_margin,
-                                                 tax, est_vol_per_char, volume_coefficient))
-                    except OverflowError as e:
-                        # print(avg5m_price*avg5m_volume, w_p*w_v)
-                        raise e
-                    except sqlite3.ProgrammingError as e:
-                        warn(RuntimeWarning(f"Insufficient amount of bindings supplied for item_id={item_id}, "
-                                            f"timestamp={timestamp}. Added 0s instead."))
-                        params = [item_id, timestamp, dt.minute, dt.hour, dt.day, dt.month, dt.year,
-                                  dt.weekday(), timestamp//3600, timestamp // 86400, timestamp // 604800,
-                                  w_ts, w_p, w_v, w_p * w_v, w_v // 288,
-                                  b_p, b_v, b_p*b_v,
-                                  s_p, s_v, s_p*s_v,
-                                  avg5m_price, avg5m_volume, avg5m_price*avg5m_volume, avg5m_margin,
-                                  (s_p-b_p)/w_p, (b_p-w_p)/w_p, (s_p-w_p)/w_p,
-                                  rt_avg, rt_min, rt_max, n_rt, rt_margin,
-                                  tax, est_vol_per_char, volume_coefficient]
-                        while len(params) < len(self.npy_columns):
-                            params.append(0)
-                        self.con.execute(sql_i, tuple(params))
+                rows = build_npy_rows(self.src_db, item_id, _t0, t1, item.buy_limit, self.npy_columns)
+                item_rows = len(rows)
                 if item_rows > 0:
+                    self.con.executemany(sql_i, rows)
                     self.con.commit()
                     if self.add_npy_array_files:
                         self.generate_npy_array(item_id)
@@ -311,6 +274,47 @@ class NpyDbUpdater(Database):
             #     print(k, v)
         print(f"\nUpdated db in {fmt.delta_t(sum(exe_times_item))}", '\n')
     
+    def repair_dirty_ranges(self, item_id: int, buy_limit: int, t1: int = None) -> int:
+        """
+        Recompute the existing rows of `item_id` that are affected by timeseries rows that were ingested after the npy
+        rows were generated, as registered in the dirty range table of the timeseries database. Consumed dirty ranges
+        are removed afterwards. Return the amount of recomputed rows.
+        
+        Parameters
+        ----------
+        item_id : int
+            The item_id of the rows that are to be repaired
+        buy_limit : int
+            The buy limit of `item_id`
+        t1 : int, optional, None by default
+            Upper bound timestamp (exclusive). Rows beyond the most recent npy row are not recomputed, as they will be
+            generated during the update itself.
+        
+        See Also
+        --------
+        backend.npy_watermark
+            For more information on the watermark and dirty range tables
+        """
+        self.update_item_id(item_id)
+        ranges = npy_wm.get_dirty_ranges(self.src_db, item_id)
+        if len(ranges) == 0:
+            return 0
+        
+        n_rows, t_max = 0, self.execute(self.sql.get('get_t0'), factory=0).fetchone()
+        if t_max is not None:
+            t_max = min(t_max + 300, self.t1 if t1 is None else t1)
+            for _t0, _t1 in npy_wm.dirty_intervals(self.src_db, item_id, ranges, self.t0, t_max):
+                rows = build_npy_rows(self.src_db, item_id, _t0, _t1, buy_limit, self.npy_columns)
+                self.con.executemany(self.sql.get('insert'), rows)
+                n_rows += len(rows)
+            self.con.commit()
+        
+        con = self.src_db.write_con
+        npy_wm.clear_dirty_ranges(con, [r[0] for r in ranges])
+        con.commit()
+        con.close()
+        return n_rows
+    
     def update_item_id(self, item_id: int):
         """
         Load a new item_id; update sql statements by inserting its table. Each time this method is called, all sql
@@ -354,16 +358,6 @@ class NpyDbUpdater(Database):
             # exit(1)
             # print(self.sql.get('fetch_wiki'))
     
-    def generate_rows(self, item_id: int = None, t0: int = None, t1: int = None):
-        """ Generate rows for `item_id` with timestamps spanning from `t0` to `t1` """
-        if item_id is not None:
-            self.update_item_id(item_id)
-        return [list(self.get_src_data(SRC.w, timestamp, item_id)) +
-                list(self.get_src_data(SRC.a_b, timestamp, item_id)) +
-                list(self.get_src_data(SRC.a_s, timestamp, item_id)) +
-                [self.get_src_data(5, timestamp, item_id)]
-                for timestamp in range(self.t0 if t0 is None else t0, (self.t1 if t1 is None else t1), 300)]
-    
     def get_src_data(self, src: int or DataSource, timestamp: int, item_id: int = None):
         """
         Get data from source `src` from the currently configured item_id or set config to `item_id`, if specified.````
@@ -429,10 +423,10 @@ class NpyDbUpdater(Database):
         return n_rows
     
     def generate_npy_array(self, item_id: int, overwrite: bool = True, generate_csv: bool = False):
-        """ Generate arrays with data of `item_id` and export them to a npy file in the array directory. """
+        """ Generate arrays with data of `item_id` and save them as columns in the npy array store. """
         if not os.path.exists(self.array_directory):
             raise FileNotFoundError(f"Unable to export array files to non-existent directory {self.array_directory}")
-        if not overwrite and self.array_file(item_id).exists():
+        if not overwrite and self.array_store.manifest(item_id) is not None:
             return
         self.update_item_id(item_id=item_id)
         global cols, ar
@@ -453,23 +447,19 @@ class NpyDbUpdater(Database):
                 self.column_file.save(cols)
             self.save_arrays(ar, cols, item_id)
     
-    def array_file(self, item_id) -> File:
-        """ Return the path to the array file with data for `item_id` """
-        return File(f'{self.array_directory}{item_id:0>5}.npy')
-    
     def save_arrays(self, arrays: np.ndarray, column_names: Iterable[str], item_id: int):
-        """ Save `arrays` with corresponding `column_names` for `item_id` under the appropriate file name """
-        return uf.save((column_names, arrays), self.array_file(item_id))
+        """ Save `arrays` with corresponding `column_names` for `item_id` as fixed-dtype columns in the array store """
+        self.array_store.save_item(item_id, split_columns(arrays, column_names))
     
-    def load_arrays(self, item_id: int) -> Tuple[np.ndarray, Iterable[str]]:
-        """ Load the array file with data for `item_id` """
-        column_names, arrays = uf.load(self.array_file(item_id))
-        return column_names, arrays
+    def load_arrays(self, item_id: int) -> NpyItemArrays:
+        """ Open the columns of `item_id` as read-only memory maps """
+        return self.array_store.load_item(item_id)
     
     def generate_remaining_arrays(self, item_ids):
         """ Generate the array files from `item_ids` that have not been generated with the current data. """
-        f_size = os.path.getsize(uf.get_newest_file(list(uf.get_files(self.array_directory))))
-        done = [int(f.split('.')[-2][-5:]) for f in uf.get_files(self.array_directory) if os.path.getsize(f) == f_size]
+        manifests = [self.array_store.manifest(i) for i in self.array_store.item_ids()]
+        t1 = max([m['t1'] or 0 for m in manifests], default=0)
+        done = [m['item_id'] for m in manifests if m['t1'] == t1]
         # print(done)
         to_do = frozenset(item_ids).difference(done)
         n_to_do = len(to_do)
@@ -541,7 +531,7 @@ class NpyDbUpdater(Database):
         db.execute("ALTER TABLE item00002 RENAME TO ___")
         db.commit()
         db.close()
-        shutil.copy2(db.array_directory+'00002.npy', os.path.dirname(path)+'/___.npy')
+        shutil.copytree(db.array_store.item_directory(2), os.path.dirname(path)+'/___/', dirs_exist_ok=True)
     
     @override
     def vacuum(self, temp_file: str = None, verify_vacuumed_db: bool = True, remove_temp_file: bool = True):
@@ -588,26 +578,25 @@ class NpyDbUpdater(Database):
             return -1
     
     def update_listbox(self):
-        """ Update all prices listbox entries and save the result """
+        """ Update all prices listbox entries in one batch and save the result """
+        if self.prices_listbox is None:
+            return
         t_listbox = time.perf_counter()
         prt(f'Updating Listbox. Processed 0/{self.n} items...      ', end='\r')
-        for idx, item_id in enumerate(self.item_ids):
-            prt(f'Updating Listbox. Processed {idx+1}/{self.n} items...      ', end='\r')
-            self.update_prices_listbox_entry(item_id)
+        
+        def print_progress(n_done: int):
+            prt(f'Updating Listbox. Processed {n_done}/{self.n} items...      ', end='\r')
+        
+        self.prices_listbox = build_prices_listbox(self, self.item_ids, t_default=self.t0,
+                                                   prices_listbox=self.prices_listbox, progress_callback=print_progress)
+        self.updated_listbox = True
         self.prices_listbox_path.save(self.prices_listbox)
         prt(f'Updated {self.n} listbox entries in {fmt.delta_t(time.perf_counter()-t_listbox)}', n_newline=1)
     
     def update_prices_listbox_entry(self, item_id: int, n_rows: int = cfg.prices_listbox_days, n_intervals: int = 6):
         """
         Compute prices listbox entries for `item_id`. Each row shows the price development for an item throughout the
-        day and summarizes this.
-        Provide a sell price for past 24h and a buy price for each 4h interval for past 24h for the given item.
-    
-        The buy price is saved for each 4h interval encountered and corresponds to the index at 10% of the sorted, non-zero
-        prices list. The sell price is determined by averaging the 3 highest sell prices across the prices at the top 90% of
-        the sorted, non-zero prices list across all 4h intervals. The resulting rows cover 24h each, sequentially and non-
-        overlapping.
-    
+        day and summarizes this. The entry is computed from a single range scan; see backend.prices_listbox.
     
         Parameters
         ----------
@@ -628,58 +617,7 @@ class NpyDbUpdater(Database):
         """
         if self.prices_listbox is None:
             return
-        interval_start = self.execute(f"SELECT MAX(timestamp) FROM item{item_id:0>5}", factory=0).fetchone()-86100
-        interval_size = int(24 / n_intervals)*3600
-        
-        # Fix for missing entries (would otherwise
-        if interval_start % interval_size != 0:
-            interval_start = interval_start + cfg.listbox_column_timespan - interval_start % cfg.listbox_column_timespan
-        
-        buy_tags = {0: 'b_0_4', 4: 'b_4_8', 8: 'b_8_12', 12: 'b_12_16', 16: 'b_16_20', 20: 'b_20_24'}
-        rows = []
-        interval_step = 288 // n_intervals
-        
-        for day_idx in range(n_rows):
-            min_buy = None
-            cur = {'t0': fmt.unix_(interval_start, fmt_str='%d-%m %H:%M')}  # , 'ts': interval_start}
-            sell_prices = []
-            for i in range(0, n_intervals*interval_step, interval_step):
-                
-                params = (interval_start, interval_start+interval_size-1)
-                a5m_p = np.array(self.execute(f"SELECT avg5m_price FROM item{item_id:0>5} WHERE timestamp "
-                                              f"BETWEEN ? AND ? AND avg5m_price > 0 ORDER BY avg5m_price",
-                                              params, factory=0).fetchall(), dtype=np.int32)
-                
-                tag = buy_tags.get(interval_start % 86400 // 3600)
-                
-                try:
-                    ar_5p = int(len(a5m_p) * .05)
-                    buy_price = int(a5m_p[ar_5p])
-                    cur[tag] = buy_price
-                    sell_prices.append(a5m_p[-ar_5p])
-                    min_buy = min(buy_price, min_buy) if isinstance(min_buy, int) else buy_price
-                except IndexError:
-                    cur[tag] = 1
-                cur['ts'] = interval_start
-                interval_start += interval_size
-            try:
-                cur['s_24h_last'] = int(sell_prices[-1])
-                s_h = int(np.average(np.sort(sell_prices)[-3:]))
-                cur['s_24h_high'] = s_h
-                cur['volume'] = int(self.execute(f"SELECT AVG(wiki_volume) FROM item{item_id:0>5} WHERE timestamp "
-                                                 f"BETWEEN ? AND ? ORDER BY timestamp ",
-                                                 (interval_start-86400, interval_start), factory=0).fetchone())
-                cur['delta_s_b'] = s_h - min_buy
-            
-            except ValueError:
-                print(f'ValueError for item {go.id_name[item_id]}')
-                continue
-            except IndexError:
-                ...
-            
-            rows.append(cur)
-            interval_start = interval_start - 86400 * 2
-        self.prices_listbox[item_id] = rows
+        self.prices_listbox[item_id] = prices_listbox_entry(self, item_id, self.t0, n_rows, n_intervals)
         self.updated_listbox = True
     
     def new_db(self):
@@ -745,7 +683,7 @@ def clear_recent_rows(ts_threshold, item_ids, t0=time.perf_counter()):
     return
 
 
-def recompute_recent_rows(ts_threshold: int, item_ids: List[int] = go.npy_items):
+def recompute_recent_rows(ts_threshold: int, item_ids: List[int] = None):
     """
     Delete rows that are newer than `ts_threshold` for all items in `item_ids`, then re-compute each row.
     
@@ -768,6 +706,7 @@ def recompute_recent_rows(ts_threshold: int, item_ids: List[int] = go.npy_items)
 
     """
     print(f"[{fmt.unix_(time.time())}] Executing npy_db_updater.recompute_recent_rows()")
+    item_ids = go.npy_items if item_ids is None else item_ids
     
     
     
@@ -0,0 +1,266 @@
+"""
+This module contains a process-based implementation of the npy db updater.
+
+Computing npy rows is CPU-bound; if the rows are computed by multiple threads, they are bound by the GIL. Instead, items
+are sharded across a pool of worker processes. Each worker reads from the timeseries database via its own read-only
+connection and streams the resulting rows back to the main process. The main process is the only process that writes
+to the npy database, and it writes each item within a single transaction.
+
+Cancellation is cooperative. After cancel() is invoked, or if the update is interrupted via a KeyboardInterrupt, workers
+stop picking up new items and the writer stops after committing the item it is currently writing. Items that were not
+written are simply picked up during the next update, which leaves the database in a consistent state.
+
+Examples
+--------
+The update is started upon initialization;
+    NpyDbProcessUpdater(n_processes=4)
+
+Or, to configure it first;
+    updater = NpyDbProcessUpdater(execute_update=False)
+    updater.run()
+
+"""
+import multiprocessing
+import signal
+import sqlite3
+from collections import namedtuple
+from collections.abc import Callable, Sequence
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Optional, Tuple
+
+from venv_auto_loader.active_venv import *
+import backend.npy_watermark as npy_wm
+import global_variables.configurations as cfg
+import global_variables.osrs as go
+import global_variables.path as gp
+import util.str_formats as fmt
+import util.unix_time as ut
+from backend.npy_row_builder import build_npy_rows
+from common.classes.data_source import SRC
+from common.item import create_item
+from file.file import File
+from global_variables.datapoint import NpyDatapoint as NpyDp
+__t0__ = time.perf_counter()
+
+
+NpyItemTask = namedtuple('NpyItemTask', ['item_id', 'intervals', 'buy_limit', 'dirty_rowids'])
+"""Rows that are to be computed for one item; intervals is a list of (t0, t1) tuples, t1 being exclusive"""
+
+_src_con: Optional[sqlite3.Connection] = None
+_cancel_event = None
+
+
+def _init_worker(source_db_path: str, cancel_event):
+    """ Initializer of a worker process; connect to the timeseries db and leave interrupts to the main process """
+    global _src_con, _cancel_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _src_con = sqlite3.connect(f"file:{source_db_path}?mode=ro", uri=True)
+    _cancel_event = cancel_event
+
+
+def _compute_item_rows(item_id: int, intervals: Sequence[Tuple[int, int]], buy_limit: int) \
+        -> Tuple[int, Optional[List[tuple]]]:
+    """ Compute the npy rows of `item_id` for each of the `intervals`. Return None as rows if the update was cancelled """
+    if _cancel_event.is_set():
+        return item_id, None
+    rows = []
+    for t0, t1 in intervals:
+        rows += build_npy_rows(_src_con, item_id, t0, t1, buy_limit)
+    return item_id, rows
+
+
+class NpyDbProcessUpdater:
+    """
+    Multiprocess updater for the Npy db. Rows are computed by a pool of `n_processes` worker processes and written to
+    the npy database by the main process.
+
+    Attributes
+    ----------
+    db_from : File
+        The timeseries database that rows are computed from
+    db_to : File
+        The npy database that rows are written to
+    n_processes : int
+        The amount of worker processes
+    max_pending : int
+        The maximum amount of items that are computed or waiting to be written at any given time. Bounds memory usage.
+    """
+    db_from: File = gp.f_db_timeseries
+    db_to: File = gp.f_db_npy
+    npy_columns: Tuple[str] = NpyDp.__match_args__
+    sql_insert: str = f"""INSERT OR REPLACE INTO "item_____" ({', '.join(NpyDp.__match_args__)})
+                          VALUES ({', '.join(['?' for _ in NpyDp.__match_args__])})"""
+
+    def __init__(self, item_ids: Sequence[int] = None, n_processes: int = None,
+                 start_time: int or float = time.perf_counter(), execute_update: bool = True,
+                 update_listbox: bool = True, progress_callback: Callable = None):
+        """
+
+        Parameters
+        ----------
+        item_ids : Sequence[int], optional, global_variables.osrs.npy_items by default
+            The item_ids that are included in the update
+        n_processes : int, optional, None by default
+            Amount of worker processes. Defaults to the amount of CPU cores.
+        start_time : int or float, optional, time.perf_counter() by default
+            Timestamp used to tag printed progress updates with
+        execute_update : bool, optional, True by default
+            If True, run the update upon initialization
+        update_listbox : bool, optional, True by default
+            If True, update the prices listbox after the npy db was updated
+        progress_callback : Callable, optional, None by default
+            Executed each time an item was written as progress_callback(n_done: int, n_total: int)
+        """
+        self.item_ids = go.npy_items if item_ids is None else item_ids
+        self.n_processes = os.cpu_count() if n_processes is None else n_processes
+        self.max_pending = self.n_processes * 2
+        self.start_time = start_time
+        self.update_listbox = update_listbox
+        self.progress_callback = progress_callback
+
+        self.t0, self.t1 = 0, 0
+        self.tasks: List[NpyItemTask] = []
+        self.n_done, self.n_rows, self.n_created, self.n_deleted = 0, 0, 0, 0
+
+        self._ctx = multiprocessing.get_context()
+        self._cancel_event = self._ctx.Event()
+        self._t_print = 0
+
+        if execute_update:
+            self.run()
+
+    @property
+    def cancelled(self) -> bool:
+        """ True if the update was cancelled """
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """ Cancel the update. Items that are being written are committed, all other items are skipped. """
+        self._cancel_event.set()
+
+    def configure_default_timestamps(self):
+        """ Set up the timestamp bounds, given the configurations and the avg5m watermark of the timeseries db. """
+        src_db = sqlite3.connect(database=f"file:{self.db_from}?mode=ro", uri=True)
+        self.t0, self.t1 = npy_wm.default_timestamps(src_db)
+        src_db.close()
+        print(f"\t[{fmt.passed_pc(self.start_time)}] Timestamp range was set to {ut.loc_unix_dt(self.t0)} - "
+              f"{ut.loc_unix_dt(self.t1)}")
+
+    def prepare_tasks(self, con: sqlite3.Connection):
+        """
+        Create missing tables, remove expired rows and determine which rows have to be computed for each item. An item
+        has to be extended up to t1, and its rows that are affected by dirty ranges have to be recomputed.
+        """
+        from backend.npy_db_updater_threaded import NpyDbUpdater
+        src_con = sqlite3.connect(self.db_from)
+        npy_wm.prune_dirty_ranges(src_con)
+        src_con.commit()
+        src_con.close()
+        src_db = sqlite3.connect(database=f"file:{self.db_from}?mode=ro", uri=True)
+        c = con.cursor()
+        c.row_factory = lambda _c, row: row[0]
+
+        self.tasks = []
+        for item_id in self.item_ids:
+            table = f'"item{item_id:0>5}"'
+            try:
+                t_max = c.execute(f"""SELECT MAX(timestamp) FROM {table}""").fetchone()
+                self.n_deleted += c.execute(f"""DELETE FROM {table} WHERE timestamp < ?""", (self.t0,)).rowcount
+            except sqlite3.OperationalError as e:
+                if 'no such table' not in str(e):
+                    raise e
+                c.execute(NpyDbUpdater.get_create_table_sql(item_id))
+                t_max = None
+                self.n_created += 1
+
+            ranges = npy_wm.get_dirty_ranges(src_db, item_id)
+            intervals = []
+            if t_max is None:
+                intervals.append((self.t0, self.t1))
+            else:
+                intervals += npy_wm.dirty_intervals(src_db, item_id, ranges, self.t0, min(t_max + 300, self.t1))
+                if t_max < self.t1 - 300:
+                    intervals.append((max(t_max, self.t0), self.t1))
+            if len(intervals) == 0 and len(ranges) == 0:
+                continue
+            self.tasks.append(NpyItemTask(item_id, npy_wm.merge_intervals(intervals), create_item(item_id).buy_limit,
+                                          [r[0] for r in ranges]))
+        con.commit()
+        src_db.close()
+        print(f"\t[{fmt.passed_pc(self.start_time)}] Prepared npy db | New tables: {self.n_created} | "
+              f"Rows deleted: {self.n_deleted} | Items to update: {len(self.tasks)}/{len(self.item_ids)}")
+
+    def write_item(self, con: sqlite3.Connection, task: NpyItemTask, rows: List[tuple]):
+        """ Write `rows` of item `task.item_id` in one transaction, then clear the dirty ranges it consumed. """
+        if len(rows) > 0:
+            con.executemany(self.sql_insert.replace('_____', f'{task.item_id:0>5}'), rows)
+        con.commit()
+        self.n_rows += len(rows)
+
+        if len(task.dirty_rowids) > 0:
+            src_con = sqlite3.connect(self.db_from)
+            npy_wm.clear_dirty_ranges(src_con, task.dirty_rowids)
+            src_con.commit()
+            src_con.close()
+
+    def print_progress(self, force: bool = False):
+        """ Print a progress update if the print cooldown has passed or if `force` is True """
+        if not force and time.perf_counter() < self._t_print:
+            return
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        print(f"\t[{fmt.passed_pc(self.start_time)}] Items: {self.n_done}/{len(self.tasks)} | "
+              f"Rows written: {self.n_rows} ({int(self.n_rows / elapsed)}/s) | Processes: {self.n_processes}       ",
+              end='\r')
+        self._t_print = time.perf_counter() + cfg.data_transfer_print_frequency
+
+    def run(self):
+        """ Execute the update; compute rows via the process pool and write them as they are returned """
+        self.configure_default_timestamps()
+        con = sqlite3.connect(self.db_to)
+        self.prepare_tasks(con)
+
+        tasks, pending = iter(self.tasks), {}
+        executor = ProcessPoolExecutor(max_workers=self.n_processes, mp_context=self._ctx, initializer=_init_worker,
+                                       initargs=(str(self.db_from), self._cancel_event))
+        try:
+            while True:
+                while not self.cancelled and len(pending) < self.max_pending:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    pending[executor.submit(_compute_item_rows, *task[:3])] = task
+                if len(pending) == 0:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    try:
+                        _, rows = future.result()
+                    except sqlite3.Error as e:
+                        print(f"\n\t* Unable to compute npy rows for item_id={task.item_id} ({e})")
+                        continue
+                    if rows is None or self.cancelled:
+                        continue
+                    self.write_item(con, task, rows)
+                    self.n_done += 1
+                    if self.progress_callback is not None:
+                        self.progress_callback(self.n_done, len(self.tasks))
+                    self.print_progress()
+        except KeyboardInterrupt:
+            print(f"\n\t[{fmt.passed_pc(self.start_time)}] Interrupted; cancelling npy db update...")
+            self.cancel()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            con.close()
+        self.print_progress(force=True)
+
+        if self.cancelled:
+            print(f"\n\t[{fmt.passed_pc(self.start_time)}] Npy db update was cancelled after writing "
+                  f"{self.n_done}/{len(self.tasks)} items")
+            return
+        print(f"\n\t[{fmt.passed_pc(self.start_time)}] Updated npy db")
+
+        if self.update_listbox:
+            from backend.npy_db_updater_threaded import NpyDbUpdater
+            NpyDbUpdater(listbox_updater=True, thread_id=0, item_ids=self.item_ids, start_time=self.start_time)
@@ -22,13 +22,17 @@ import util.file as uf
 import util.str_formats as fmt
 from util.logger import prt
 import util.unix_time as ut
+import backend.npy_watermark as npy_wm
 from common.item import create_item, Item
+from backend.npy_array_store import NpyArrayStore, NpyItemArrays, split_columns
+from backend.npy_row_builder import build_npy_rows
+from backend.npy_row_writer import NpyRowWriter
+from backend.prices_listbox import build_prices_listbox, prices_listbox_entry
 from data_processing.npy_array_computations import avg_price_summed_volume
 from file.file import File
 from global_variables.datapoint import NpyDatapoint as NpyDp
 from common.classes.data_source import DataSource, SRC
 from common.classes.database import Database
-from tasks.async_task import AsyncTask
 __t0__ = time.perf_counter()
 
 t_start = int(time.perf_counter())
@@ -49,7 +53,6 @@ _n_active_threads = 0
 _initialized, _n_to_do, _items_done, _item_ids, _n_threads = False, 0, 0, {}, -1
 _rows_deleted, _rows_skipped, _rows_exported, _rows_processed, _tables_added = 0, 0, 0, 0, 0
 new_ids, skip_ids = [], []
-_files_imported = 0
 _db_size_start, f_db = gp.f_db_npy.fsize(), gp.f_db_npy
 
 _r = ("'", "")
@@ -65,6 +68,7 @@ class NpyDbUpdater(Database):
     """
     npy_columns = NpyDp.__match_args__
     array_directory = gp.dir_npy_arrays
+    array_store: NpyArrayStore = NpyArrayStore(gp.dir_npy_arrays)
     sql_i = f"""INSERT OR REPLACE INTO ___{str(NpyDp.__match_args__)}
                             VALUES {str(tuple(['?' for _ in NpyDp.__match_args__]))}""".replace("'", "")
     sql_del_rows: str = """DELETE FROM ___ WHERE timestamp < ?"""
@@ -86,7 +90,7 @@ class NpyDbUpdater(Database):
     prices_listbox_path: File = gp.f_prices_listbox
     
     def __init__(self, thread_id: int, check_stop_execution: Callable = None, db_path: File = gp.f_db_npy,
-                 source_db_path: str = gp.f_db_timeseries, item_ids: Sequence = go.npy_items,
+                 source_db_path: str = gp.f_db_timeseries, item_ids: Sequence = None,
                  execute_update: bool = True, add_arrays: bool = False, listbox_updater: bool = False,
                  update_counter: Callable = None, **kwargs):
         """
@@ -111,6 +115,9 @@ class NpyDbUpdater(Database):
             existing database.
         itemdb : sqlite3.Connection, optional, None by default
             If passed, use this connection for itemdb interactions instead
+        row_writer : NpyRowWriter, optional, None by default
+            If passed, generated rows are queued for insertion by this writer thread. If not, rows are inserted by this
+            updater instead.
         
         """
         # if not _initialized:
@@ -122,11 +129,12 @@ class NpyDbUpdater(Database):
         self.to_export = []
         self.check_stop_execution = check_stop_execution
         self.sql, self.sql_keys = {}, None
+        self.row_writer: Optional[NpyRowWriter] = kwargs.get('row_writer')
         
         if kwargs.get('new_db') is not None and kwargs.get('new_db') and db_path.exists():
             self.new_db()
 
-        self.item_id_list = item_ids
+        self.item_id_list = go.npy_items if item_ids is None else item_ids
         self.listbox_items = []
         
         # If True, only update the listbox
@@ -136,7 +144,7 @@ class NpyDbUpdater(Database):
         else:
             self.prices_listbox = None
             try:
-                self.tuple_items = isinstance(item_ids[0], tuple)
+                self.tuple_items = isinstance(self.item_id_list[0], tuple)
             except IndexError:
                 self.tuple_items = False
             
@@ -198,21 +206,8 @@ class NpyDbUpdater(Database):
         # If this is the case, a value was previously computed and should be re-used
         if max_timestamp > 0:
             self.t0, self.t1 = min_timestamp, max_timestamp
-        
-        # ... If not, determine lower and upper bound timestamp thresholds via most traded items
-        t1 = 0
-        for i in go.most_traded_items:
-            try:
-                t1 = max(t1, self.src_db.execute(
-                    self.set_table_name(f"""SELECT MAX(timestamp) FROM ___
-                    WHERE src in {SRC.by_source('avg5m')}""", i),
-                    factory=0).fetchone())
-            except TypeError:
-                ...
-        
-        t1 = int(round(t1 / cfg.npy_round_t1, 0) * cfg.npy_round_t1)
-        self.t0 = t1 - t1 % cfg.npy_round_t0 - cfg.npy_db_timespan_days * 86400
-        self.t1 = t1 - t1 % cfg.npy_round_t1
+        else:
+            self.t0, self.t1 = npy_wm.default_timestamps(self.src_db)
         self.timestamps = range(self.t0, self.t1, 300)
         min_timestamp, max_timestamp = self.t0, self.t1
     
@@ -223,12 +218,12 @@ class NpyDbUpdater(Database):
         try:
             print(f'\t[{fmt.passed_pc(self.t_start)}] Items: {_items_done + 1}/{_n_to_do}  '
                       f'Db size: +{fmt.fsize(self.fsize() - _db_size_start)}  '
-                      f'Rows [+ {_rows_exported} / - {_rows_deleted}]  {_files_imported} files imported into db'
+                      f'Rows [+ {_rows_exported} / - {_rows_deleted}]  '
                       f'Avg/item: {fmt.delta_t(sum(exe_times_item) / len(exe_times_item))}', end='\r')
         except ZeroDivisionError:
             print(f'\t[{fmt.passed_pc(self.t_start)}] Items: {_items_done + 1}/{_n_to_do}  '
                   f'Db size: +{fmt.fsize(self.fsize() - _db_size_start)}  '
-                  f'Rows [+ {_rows_exported} / - {_rows_deleted}]  {_files_imported} files imported into db', end='\r')
+                  f'Rows [+ {_rows_exported} / - {_rows_deleted}]', end='\r')
             
     def generate_db(self):
         """
@@ -280,57 +275,9 @@ class NpyDbUpdater(Database):
                 print(f"\n\t* Unable to assign an Item to item_id={self.i}                           ")
                 continue
             try:
-                item_rows = 0
-                for timestamp, w_p, w_v, w_ts, b_p, b_v, s_p, s_v, rt_p in self.generate_rows():
-                    if w_p is None:
-                        w_p = 0
-                    if w_v is None:
-                        w_v = 0
-                    if b_p is None:
-                        b_p = 0
-                    if b_v is None:
-                        b_v = 0
-                    if s_p is None:
-                        s_p = 0
-                    if s_v is None:
-                        s_v = 0
-                    self.n_processed += 1
-                    n_rt = len(rt_p)
-                    if n_rt > 0:
-                        rt_min, rt_max, rt_avg = rt_p[0], rt_p[-1], sum(rt_p) // len(rt_p)
-                        tax = int(np.average(rt_p) * .01)
-                        rt_margin = rt_p[-1]-rt_p[0]-tax
-                    else:
-                        rt_min, rt_max, rt_avg, rt_margin = 0, 0, 0, 0
-                        try:
-                            tax = int(max([s_p if s_p is not None else 0,
-                                      b_p if b_p is not None else 0,
-                                      w_p if w_p is not None else 0]) * .01)
-                        except ValueError:
-                            tax = 0
-                    avg5m_margin = s_p - b_p-tax if min(b_p, s_p) != 0 else 0
-                    self.est_vol_per_char = min(self.item.buy_limit*4, w_v // 10)
-                    volume_coefficient = min(item.buy_limit, w_v) / max(item.buy_limit, 1)
-                    
-                    dt = ut.utc_unix_dt(timestamp)
-                    avg5m_price, avg5m_volume = ((b_p+s_p)//2 if min(b_p, s_p) > 0 else max(b_p, s_p)), b_v+s_v
-                    try:
-                        self.to_export.append((item_id, timestamp, dt.minute, dt.hour, dt.day, dt.month, dt.year,
-                                               dt.weekday(), timestamp//3600, timestamp // 86400, timestamp // 604800,
-                                               w_ts, w_p, w_v, w_p * w_v, w_v // 288,
-                                               b_p, b_v, b_p*b_v,
-                                               s_p, s_v, s_p*s_v,
-                                               avg5m_price, avg5m_volume, avg5m_price*avg5m_volume, avg5m_margin,
-                                               (s_p-b_p)/w_p if w_p > 0 else 0, (b_p-w_p)/w_p if w_p > 0 else 0,
-                                               (s_p-w_p)/w_p if w_p > 0 else 0,
-                                               rt_avg, rt_min, rt_max, n_rt, rt_margin,
-                                               tax, self.est_vol_per_char, volume_coefficient))
-                    except OverflowError as e:
-                        print(e)
-                        raise e
-                    except sqlite3.ProgrammingError as e:
-                        print(e)
-                        raise e
+                self.to_export = self.build_rows()
+                item_rows = len(self.to_export)
+                self.n_processed += item_rows
                 if len(self.to_export) > 10:
                     self.export_rows()
                     if self.add_npy_array_files:
@@ -346,24 +293,21 @@ class NpyDbUpdater(Database):
             self.active = item_id == last_item
     
     def export_rows(self):
-        """ Return the next path to dump an export for this updater """
+        """ Pass the generated rows of the active item to the row writer, or insert them if there is no row writer """
         el = self.to_export[-1]
-        # print(el)
         if self.execute(f"""SELECT COUNT(*) FROM "item{el[0]:0>5}" WHERE timestamp=?""", (el[1],), factory=0).fetchone() == 0:
-            f = File(self.dir_export + f"{self.thread_id}_{self.cur_id:0>5}.dat")
-            while f.exists():
-                f = File(f.path.replace('.dat', '_.dat'))
-            # if self.thread_id == 0:
-            #     for el in self.to_export:
-            #         print(el)
-            self.check_stop_execution()
-            f.save(self.to_export)
-            self.listbox_items.append(self.cur_id if isinstance(self.cur_id, int) else self.cur_id[0])
+            if self.check_stop_execution is not None:
+                self.check_stop_execution()
+            item_id = self.cur_id if isinstance(self.cur_id, int) else self.cur_id[0]
+            if self.row_writer is None:
+                self.con.executemany(self.sql_i.replace('___', self.get_table_name(item_id)), self.to_export)
+                self.con.commit()
+            else:
+                self.row_writer.put(item_id, self.to_export)
+            self.listbox_items.append(item_id)
             global t_export, _rows_exported
             _rows_exported += len(self.to_export)
             t_export = time.perf_counter()
-        else:
-            print(':(')
         self.to_export = []
         self.cur_id = self.item_id
         self.item_id = 0
@@ -409,24 +353,26 @@ class NpyDbUpdater(Database):
                 self.sql_keys = tuple(self.sql.keys())
             # print(f"[{self.thread_id}] item_id was set to", self.item_id, self.cur_id, f'{len(_item_ids)} remaining')
     
-    def generate_rows(self, t0: int = None):
-        """ Generate rows for `item_id` with timestamps spanning from `t0` to `t1` """
+    def get_row_t0(self, t0: int = None) -> Optional[int]:
+        """ Return the lower bound timestamp of the rows that are to be generated, or None if the item is up to date """
         self.update_item_id()
         if t0 is None:
             t0 = self.execute(f"""SELECT MAX(timestamp) FROM "item{self.item_id:0>5}" """, factory=0).fetchone()
             if t0 is None:
                 t0 = self.t0
-                t1 = self.t1
         t0 = t0 - t0 % 300
         
         if t0 >= self.t1-300 or \
                 self.execute(f"""SELECT COUNT(*) FROM "item{self.item_id:0>5}" WHERE timestamp=? """, (self.t1-300,), factory=0).fetchone() >= 1:
+            return None
+        return t0
+    
+    def build_rows(self, t0: int = None) -> List[tuple]:
+        """ Generate npy rows for the active item_id from `t0` to `t1` using backend.npy_row_builder """
+        t0 = self.get_row_t0(t0)
+        if t0 is None:
             return []
-        return [list(self.get_src_data(SRC.w, timestamp)) +
-                list(self.get_src_data(SRC.a_b, timestamp)) +
-                list(self.get_src_data(SRC.a_s, timestamp)) +
-                [self.get_src_data(5, timestamp)]
-                for timestamp in range(t0, self.t1, 300)]
+        return build_npy_rows(self.src_db, self.item_id, t0, self.t1, self.item.buy_limit, self.npy_columns)
     
     def get_src_data(self, src: int or DataSource, timestamp: int):
         """
@@ -494,10 +440,10 @@ class NpyDbUpdater(Database):
         return n_rows
     
     def generate_npy_array(self, item_id: int, overwrite: bool = True, generate_csv: bool = False):
-        """ Generate arrays with data of `item_id` and export them to a npy file in the array directory. """
+        """ Generate arrays with data of `item_id` and save them as columns in the npy array store. """
         if not os.path.exists(self.array_directory):
             raise FileNotFoundError(f"Unable to export array files to non-existent directory {self.array_directory}")
-        if not overwrite and self.array_file(item_id).exists():
+        if not overwrite and self.array_store.manifest(item_id) is not None:
             return
         # self.update_item_id(item_id=item_id)
         global cols, ar
@@ -518,23 +464,19 @@ class NpyDbUpdater(Database):
                 self.column_file.save(cols)
             self.save_arrays(ar, cols, item_id)
     
-    def array_file(self, item_id) -> File:
-        """ Return the path to the array file with data for `item_id` """
-        return File(f'{self.array_directory}{item_id:0>5}.npy')
-    
     def save_arrays(self, arrays: np.ndarray, column_names: Iterable[str], item_id: int):
-        """ Save `arrays` with corresponding `column_names` for `item_id` under the appropriate file name """
-        return uf.save((column_names, arrays), self.array_file(item_id))
+        """ Save `arrays` with corresponding `column_names` for `item_id` as fixed-dtype columns in the array store """
+        self.array_store.save_item(item_id, split_columns(arrays, column_names))
     
-    def load_arrays(self, item_id: int) -> Tuple[np.ndarray, Iterable[str]]:
-        """ Load the array file with data for `item_id` """
-        column_names, arrays = uf.load(self.array_file(item_id))
-        return column_names, arrays
+    def load_arrays(self, item_id: int) -> NpyItemArrays:
+        """ Open the columns of `item_id` as read-only memory maps """
+        return self.array_store.load_item(item_id)
     
     def generate_remaining_arrays(self, item_ids):
         """ Generate the array files from `item_ids` that have not been generated with the current data. """
-        f_size = os.path.getsize(uf.get_newest_file(list(uf.get_files(self.array_directory))))
-        done = [int(f.split('.')[-2][-5:]) for f in uf.get_files(self.array_directory) if os.path.getsize(f) == f_size]
+        manifests = [self.array_store.manifest(i) for i in self.array_store.item_ids()]
+        t1 = max([m['t1'] or 0 for m in manifests], default=0)
+        done = [m['item_id'] for m in manifests if m['t1'] == t1]
         # print(done)
         to_do = frozenset(item_ids).difference(done)
         n_to_do = len(to_do)
@@ -606,7 +548,7 @@ class NpyDbUpdater(Database):
         db.execute("ALTER TABLE item00002 RENAME TO ___")
         db.commit()
         db.close()
-        shutil.copy2(db.array_directory+'00002.npy', os.path.dirname(path)+'/___.npy')
+        shutil.copytree(db.array_store.item_directory(2), os.path.dirname(path)+'/___/', dirs_exist_ok=True)
     
     @staticmethod
     def get_create_table_sql(item_id: int = None) -> str:
@@ -665,48 +607,37 @@ class NpyDbUpdater(Database):
             return -1
     
     def update_listbox(self, force_rebuild: bool = True):
-        """ Update all prices listbox entries and save the result """
+        """ Update all prices listbox entries in one batch and save the result """
         t_listbox = time.perf_counter()
-        to_do = self.item_id_list
         if force_rebuild or not self.prices_listbox_path.exists():
             self.prices_listbox = {}
         else:
             self.prices_listbox = self.prices_listbox_path.load()
-        to_do = [i[0] if isinstance(i, tuple) else i for i in to_do]
-        n_to_do, n_failed = len(to_do), 0
+        to_do = [i[0] if isinstance(i, tuple) else i for i in self.item_id_list]
+        to_do = [i for i in to_do if go.id_name[i] is not None]
+        n_to_do = len(to_do)
         print('')
         print(f'\tUpdating Listbox. Processed 0/{n_to_do} items...      ', end='\r')
+        
+        def print_progress(n_done: int):
+            if n_done % 25 == 0 or n_done == n_to_do:
+                print(f'\t[{fmt.passed_pc(self.t_start)}] Updating Listbox. Processed {n_done}/{n_to_do} items...',
+                      end='\r')
+        
         con = self.read_con
-        for idx, item_id in enumerate([i for i in to_do if go.id_name[i] is not None]):
-            print(f'\t[{fmt.passed_pc(self.t_start)}] Updating Listbox. Processed {idx+1}/{n_to_do} items...', end='\r')
-            try:
-                
-                try:
-                    self.update_prices_listbox_entry(item_id, cur_t1=self.prices_listbox.get(item_id)[0].get('t0'),
-                                                     con=con)
-                except TypeError:
-                    self.update_prices_listbox_entry(item_id, con=con)
-            except AttributeError as e:
-                n_failed += 1
-                print(f"Failed to create listbox entry for item {go.id_name[item_id]} "
-                      f"({n_failed} {'entry' if n_failed == 1 else 'entries'} failed so far)")
-                
+        self.prices_listbox = build_prices_listbox(con, to_do, t_default=min_timestamp,
+                                                   prices_listbox=self.prices_listbox, progress_callback=print_progress)
+        con.close()
+        self.updated_listbox = True
         self.prices_listbox_path.save(self.prices_listbox)
         print(f'\n\t[{fmt.passed_pc(self.t_start)}] Updated {n_to_do} listbox entries in {fmt.passed_pc(t_listbox)}')
     
     def update_prices_listbox_entry(self, item_id: int, _n_rows: int = cfg.prices_listbox_days, n_intervals: int = 6,
-                                    cur_t1: dict = None, **kwargs):
+                                    cur_t1: str = None, con: sqlite3.Connection = None):
         """
         Compute prices listbox entries for `item_id`. Each row shows the price development for an item throughout the
-        day and summarizes this.
-        Provide a sell price for past 24h and a buy price for each 4h interval for past 24h for the given item.
-    
-        The buy price is saved for each 4h interval encountered and corresponds to the index at 10% of the sorted, non-zero
-        prices list. The sell price is determined by averaging the 3 highest sell prices across the prices at the top 90% of
-        the sorted, non-zero prices list across all 4h intervals. The resulting rows cover 24h each, sequentially and non-
-        overlapping.
-    
-    
+        day and summarizes this. The entry is computed from a single range scan; see backend.prices_listbox.
+
         Parameters
         ----------
         item_id : int
@@ -715,10 +646,12 @@ class NpyDbUpdater(Database):
             Amount of rows to produce as output, where each row corresponds to a 24 hour timespan.
         n_intervals : int, optional, 6 by default
             Amount of smaller, equally sized intervals to divide each 24-hour timespan in
+        cur_t1 : str, optional, None by default
+            t0 of the most recent row of the current entry. If it is still up-to-date, the entry is not recomputed.
         con: Optional[sqlite3.Connection]
             Database connection used to access data. Passing one will prevent creation of a massive amount of
             connections.
-    
+
         Notes
         -----
         The tags are encoded as b_X_Y, with b referring to buy price, X referring to the first hour of the interval and
@@ -729,65 +662,9 @@ class NpyDbUpdater(Database):
         """
         if self.prices_listbox is None:
             raise TypeError
-        try:
-            interval_start = self.execute(f"SELECT MAX(timestamp) FROM item{item_id:0>5}", factory=0, **kwargs).fetchone()-86100
-        except TypeError:
-            interval_start = self.t0
-        interval_size = int(24 / n_intervals)*3600
-        
-        # Fix for missing entries (would otherwise
-        if interval_start % interval_size != 0:
-            interval_start = interval_start + cfg.listbox_column_timespan - interval_start % cfg.listbox_column_timespan
-        
-        # Entry was computed earlier -- move on instead
-        if cur_t1 is not None and cur_t1 == fmt.unix_(interval_start, fmt_str='%d-%m %H:%M'):
+        rows = prices_listbox_entry(self if con is None else con, item_id, min_timestamp, _n_rows, n_intervals, cur_t1)
+        if rows is None:
             return
-        
-        buy_tags = {0: 'b_0_4', 4: 'b_4_8', 8: 'b_8_12', 12: 'b_12_16', 16: 'b_16_20', 20: 'b_20_24'}
-        rows = []
-        interval_step = 288 // n_intervals
-        
-        for day_idx in range(_n_rows):
-            min_buy = None
-            cur = {'t0': fmt.unix_(interval_start, fmt_str='%d-%m %H:%M')}  # , 'ts': interval_start}
-            sell_prices = []
-            for i in range(0, n_intervals*interval_step, interval_step):
-                
-                params = (interval_start, interval_start+interval_size-1)
-                a5m_p = np.array(self.execute(f"SELECT avg5m_price FROM item{item_id:0>5} WHERE timestamp "
-                                              f"BETWEEN ? AND ? AND avg5m_price > 0 ORDER BY avg5m_price",
-                                              params, factory=0, **kwargs).fetchall(), dtype=np.int32)
-                
-                tag = buy_tags.get(interval_start % 86400 // 3600)
-                
-                try:
-                    ar_5p = int(len(a5m_p) * .05)
-                    buy_price = int(a5m_p[ar_5p])
-                    cur[tag] = buy_price
-                    sell_prices.append(a5m_p[-ar_5p])
-                    min_buy = min(buy_price, min_buy) if isinstance(min_buy, int) else buy_price
-                except IndexError:
-                    cur[tag] = 1
-                cur['ts'] = interval_start
-                interval_start += interval_size
-            try:
-                cur['s_24h_last'] = int(sell_prices[-1])
-                s_h = int(np.average(np.sort(sell_prices)[-3:]))
-                cur['s_24h_high'] = s_h
-                cur['volume'] = int(self.execute(f"SELECT AVG(wiki_volume) FROM item{item_id:0>5} WHERE timestamp "
-                                                 f"BETWEEN ? AND ? ORDER BY timestamp ",
-                                                 (interval_start-86400, interval_start), factory=0,
-                                                 **kwargs).fetchone())
-                cur['delta_s_b'] = s_h - min_buy
-            
-            except ValueError:
-                print(f'ValueError for item {go.id_name[item_id]}')
-                continue
-            except IndexError:
-                ...
-            
-            rows.append(cur)
-            interval_start = interval_start - 86400 * 2
         self.prices_listbox[item_id] = rows
         self.updated_listbox = True
     
@@ -826,61 +703,6 @@ def get_sqls(item_id: int) -> Tuple[str, str]:
     return sql_c + "PRIMARY KEY(timestamp) )", f"""INSERT OR REPLACE INTO {table} {sql_i_end}""".replace("'", "")
 
 
-def import_files(src_dir: str, npy_db: File):
-    """ Upload all dat files present in `src_dir` to sqlite database `npy_db` """
-    files = uf.get_files(src=src_dir, ext='dat', full_path=False)
-    
-    for f in files:
-        f = File(src_dir+f)
-        try:
-            item_id = int(f.file[2:7])
-            if time.time()-f.mtime() < 10 or not f.file[0].isdigit():
-                continue
-        except TypeError as e:
-            print(e)
-            continue
-        con = sqlite3.connect(npy_db)
-        sql_c, sql_i = get_sqls(item_id)
-        con.execute(sql_c)
-        _c, commit = 0, False
-        for values in f.load():
-            try:
-                con.execute(sql_i, values)
-                commit = True
-            except sqlite3.Error as e:
-                print(sql_i)
-                print(e, values)
-                _c += 1
-        if commit:
-            con.commit()
-            if _c == 0:
-                f.delete()
-                
-                global _files_imported
-                _files_imported += 1
-            else:
-                print(f'Failed to insert {_c} rows from file {f}')
-    
-
-def importer_task(src_dir=gp.dir_npy_import, min_runtime: int = 15, can_proceed: Callable = None):
-    """ Thread designed to upload generated batches to the sqlite db. After uploading a batch, it is deleted. """
-    threader_count = threading.active_count()
-    min_runtime = time.perf_counter() + min_runtime
-    if can_proceed is None:
-        def can_proceed():
-            """ Return True to keep going, False to proceed with other updates. """
-            return (threading.active_count() > threader_count or
-                    len(os.listdir(gp.dir_npy_import)) > 0 or
-                    time.perf_counter() < min_runtime)
-    
-    # By design, the thread should stay active as long as threads supplying it data are active / there is data to upload
-    while can_proceed():
-        import_files(src_dir=src_dir, npy_db=gp.f_db_npy)
-        time.sleep(3)
-    prt(f"Importer thread was completed! Updating listbox...                               ", n_newline=1, n_indent=1)
-    NpyDbUpdater(listbox_updater=True, thread_id=4)
-
-
 def do_nothing():
     """ Default method for undefined Callable args """
     ...
@@ -891,7 +713,7 @@ class AsyncPreprocessing(threading.Thread):
     Class for a single thread to produce npy db rows
     """
     def __init__(self, idx: int, callback_end: Callable = do_nothing, callback_completed: Callable = do_nothing,
-                 callback_failed: Callable = do_nothing, item_ids: List[int] = go.npy_items, n_threads: int = 4,
+                 callback_failed: Callable = do_nothing, item_ids: List[int] = None, n_threads: int = 4,
                  decrease_count: Callable = do_nothing, **kwargs):
         """ `idx` is the index of this thread; callback_[end/completed/failed] are executed at the end of the thread """
         threading.Thread.__init__(self, name=kwargs.get('name'), daemon=kwargs.get('daemon'))
@@ -904,6 +726,8 @@ class AsyncPreprocessing(threading.Thread):
         self.active = False
         self.db_path = gp.f_db_npy if kwargs.get('db_path') is None else kwargs['db_path']
         self.completed = False
+        if item_ids is None:
+            item_ids = go.npy_items
         
         self.kwargs = {
             'item_ids': [i for i in item_ids if i % n_threads == idx],
@@ -915,7 +739,8 @@ class AsyncPreprocessing(threading.Thread):
             'prices_listbox_path': None,
             'itemdb': sqlite3.connect(database=f"file:{gp.f_db_local}?mode=ro", uri=True),
             'check_stop_execution': self.conditionally_terminate_thread,
-            'update_counter': decrease_count
+            'update_counter': decrease_count,
+            'row_writer': kwargs.get('row_writer')
         }
         # NpyDbUpdater(**self.kwargs)
         # self.run()
@@ -987,7 +812,9 @@ class UpdaterThreadManager:
     can be divided by 300. Due to the sheer amount of rows per item and the time needed to compute rows for each item,
     the subset of items is restricted. Initial computation of all rows might take a while, as each tracked item has
     ~131k rows. The multi-threaded approach has N threads computing row data, and one thread uploading row data produced
-     by other threads.
+     by other threads. Rows are passed to the uploading thread via a bounded queue (see backend.npy_row_writer).
+    Existing rows affected by data that was ingested afterwards are recomputed before the threads are started (see
+    backend.npy_watermark).
     """
     t0_floor_value: int = cfg.npy_round_t0
     t1_floor_value: int = cfg.npy_round_t1
@@ -995,30 +822,44 @@ class UpdaterThreadManager:
     db_to: File = gp.f_db_npy
     npy_columns: Tuple[str] = NpyDp.__match_args__
     
-    def __init__(self, n_threads: int = 3, item_ids: List[int] = go.npy_items,
-                 start_time: int or float = time.perf_counter()):
+    def __init__(self, n_threads: int = 3, item_ids: List[int] = None,
+                 start_time: int or float = time.perf_counter(), spill_to_disk: bool = False):
+        """
+        
+        Parameters
+        ----------
+        n_threads : int, optional, 3 by default
+            Amount of threads that compute rows
+        item_ids : List[int], optional, global_variables.osrs.npy_items by default
+            The item_ids that are included in the update
+        start_time : int or float, optional, time.perf_counter() by default
+            Timestamp used to tag printed progress updates with
+        spill_to_disk : bool, optional, False by default
+            If True, save rows in global_variables.path.dir_npy_import until they are committed, so they can be
+            recovered if the update is interrupted
+        """
         self.threads = []
         self.n_threads = n_threads
         self.start_time = start_time
         self.t0: int = 0
         self.t1: int = 0
-        self.item_ids: List[int] = item_ids
+        self.item_ids: List[int] = go.npy_items if item_ids is None else item_ids
         self.to_do: List[int] = []
         self.item_t1 = {}
-        self.n_to_do = len(item_ids)
+        self.n_to_do = len(self.item_ids)
         self.skip_ids: List[int] = []
         self.n_created: int = 0
         self.n_deleted: int = 0
         self.n_inserted: int = 0
         self.active_threads_at_start = 0
         self.n_remaining = 0
-        self.importer_active = True
         
         self.timestamps_configured = False
         self.queue_sorted = False
         self.database_preprocessed = False
 
-        self.import_thread = AsyncTask(task=importer_task, can_proceed=self.is_active, callback_oncomplete=self.deactivate_importer)
+        self.row_writer = NpyRowWriter(db_path=self.db_to, spill_dir=gp.dir_npy_import if spill_to_disk else None,
+                                       daemon=True)
         self.initialize()
         
     def start_threads(self):
@@ -1035,32 +876,30 @@ class UpdaterThreadManager:
                 item_ids=self.to_do,
                 callback_completed=self.thread_completed,
                 callback_failed=self.thread_failed,
-                decrease_count=self.decrease_n_to_do
+                decrease_count=self.decrease_n_to_do,
+                row_writer=self.row_writer
             )
             self.threads.append(_thread)
 
         print(f"\t[{fmt.passed_pc(self.start_time)}] Starting threads...")
+        self.row_writer.start()
         for idx, t in enumerate(self.threads):
-            # print(f"[{fmt.passed_pc(self.start_time)}] Starting thread {idx+1}...")
             t.start()
-        # print(f"[{fmt.passed_pc(self.start_time)}] Starting import thread...")
-        self.import_thread.start()
         
         self.n_threads = len(self.threads)
-        len_import_files = 1
-        while self.n_threads > 0 or len_import_files > 0 or self.importer_active:
+        while any(t.is_alive() for t in self.threads):
             time.sleep(2)
-            len_import_files = len(uf.get_files(gp.dir_npy_import, ext='dat', full_path=False))
-            if len_import_files + self.n_remaining > 0:
-                print(f"\t[{fmt.passed_pc(self.start_time)}] n_threads active: {self.n_threads} | "
-                      f"n_import files: {len_import_files} | Items remaining: {self.n_remaining}                 ",
-                      end='\r')
-            else:
-                self.n_threads = 0
-                for t in self.threads:
-                    
-                    t.join()
-        print(f"\t[{fmt.passed_pc(self.start_time)}] Done")
+            print(f"\t[{fmt.passed_pc(self.start_time)}] n_threads active: {self.n_threads} | "
+                  f"Queued items: {self.row_writer.queue.qsize()} | Rows written: {self.row_writer.n_rows} | "
+                  f"Items remaining: {self.n_remaining}                 ", end='\r')
+        for t in self.threads:
+            t.join()
+        self.row_writer.close()
+        print(f"\n\t[{fmt.passed_pc(self.start_time)}] Done | Rows written: {self.row_writer.n_rows} | "
+              f"Transactions: {self.row_writer.n_commits}")
+        
+        prt(f"Updating listbox...", n_indent=1)
+        NpyDbUpdater(listbox_updater=True, thread_id=4)
     
     def decrease_n_to_do(self, value: int = 1):
         """ Method for decreasing the items remaining count by `value` """
@@ -1082,12 +921,8 @@ class UpdaterThreadManager:
     def configure_default_timestamps(self):
         """ Set up the timestamp array, given the configurations. """
         src_db = sqlite3.connect(database=f"file:{self.db_from}?mode=ro", uri=True)
-        src_db.row_factory = lambda c, row: row[0]
-        t1 = max([src_db.execute(f"""SELECT MAX(timestamp) FROM item{i:0>5} WHERE src in {SRC.by_source('avg5m')}"""
-                                 ).fetchone() for i in go.most_traded_items])
-        t1 = int(round(t1 / cfg.npy_round_t1, 0) * cfg.npy_round_t1)
-        self.t0 = t1 - t1 % cfg.npy_round_t0 - cfg.npy_db_timespan_days * 86400
-        self.t1 = t1 - t1 % cfg.npy_round_t1
+        self.t0, self.t1 = npy_wm.default_timestamps(src_db)
+        src_db.close()
         prt(f"Timestamp range was set to {ut.loc_unix_dt(self.t0)} - {ut.loc_unix_dt(self.t1)}")
         self.timestamps_configured = True
     
@@ -1186,10 +1021,54 @@ class UpdaterThreadManager:
         if self.database_preprocessed:
             return
         self.database_preprocessed = True
+        n_repaired = self.repair_dirty_ranges(con=con)
+        con.close()
+        if n_repaired > 0:
+            prt(f"Recomputed {n_repaired} rows affected by dirty ranges")
         self.start_threads()
+    
+    def repair_dirty_ranges(self, con: sqlite3.Connection) -> int:
+        """
+        Recompute the existing npy rows of `item_ids` that are affected by timeseries rows that were ingested after the
+        npy rows were generated, as registered in the dirty range table of the timeseries database. Consumed dirty ranges
+        are removed afterwards. Rows beyond the most recent npy row of an item are generated by the threads instead.
+        Return the amount of recomputed rows.
+        
+        See Also
+        --------
+        backend.npy_watermark
+            For more information on the watermark and dirty range tables
+        """
+        src_con = sqlite3.connect(self.db_from)
+        npy_wm.prune_dirty_ranges(src_con)
+        src_con.commit()
+        
+        n_rows = 0
+        for i in self.item_ids:
+            ranges = npy_wm.get_dirty_ranges(src_con, i)
+            if len(ranges) == 0:
+                continue
+            
+            t_max = con.execute(f"""SELECT MAX(timestamp) FROM "item{i:0>5}" """).fetchone()
+            if t_max is not None:
+                buy_limit = create_item(i).buy_limit
+                sql_i = NpyDbUpdater.sql_i.replace('___', NpyDbUpdater.get_table_name(i))
+                for _t0, _t1 in npy_wm.dirty_intervals(src_con, i, ranges, self.t0, min(t_max + 300, self.t1)):
+                    rows = build_npy_rows(src_con, i, _t0, _t1, buy_limit, self.npy_columns)
+                    con.executemany(sql_i, rows)
+                    n_rows += len(rows)
+                con.commit()
+            
+            npy_wm.clear_dirty_ranges(src_con, [r[0] for r in ranges])
+            src_con.commit()
+        src_con.close()
+        return n_rows
         
     def initialize(self):
         """ Set up the pipeline; initialize variables and execute """
+        n_recovered = self.row_writer.recover(create_table=lambda i: get_sqls(i)[0])
+        if n_recovered > 0:
+            prt(f"Recovered {n_recovered} files with rows from an interrupted update")
         self.configure_default_timestamps()
         self.preprocess_database()
         # self.sort_queue(reverse_sort=False)
@@ -1214,10 +1093,8 @@ class UpdaterThreadManager:
         return output
     
     def is_active(self):
-        return self.n_remaining > 0 or len(uf.get_files(gp.dir_npy_import, ext='dat', full_path=False)) > 0
-    
-    def deactivate_importer(self):
-        self.importer_active = False
+        """ Return True if rows are still being computed or written """
+        return self.n_remaining > 0 or self.row_writer.is_alive()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,243 @@
+"""
+This module contains a vectorized implementation for generating npy db rows.
+
+Rather than querying the timeseries database for each 5-minute timestamp (see NpyDbUpdater.get_src_data), each source
+is read with a single range scan per item. The resulting arrays are aligned with the npy timestamps as follows;
+- wiki: as-of join; each timestamp is assigned the most recent wiki row with a timestamp smaller than it
+- avg5m: direct alignment, as avg5m timestamps coincide with npy timestamps
+- realtime: rows are bucketed per 300 seconds and aggregated per bucket
+
+All NpyDatapoint columns are subsequently computed with numpy, rather than on a per-row basis. The rows that are
+produced are identical to the rows produced by the per-timestamp implementation.
+
+Notes
+-----
+The realtime aggregates mimic the per-timestamp implementation; rt_min and rt_max refer to the first and the last
+realtime price of a 5-minute bucket, with realtime prices being sorted by (src, timestamp).
+
+"""
+import sqlite3
+from collections.abc import Sequence
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from venv_auto_loader.active_venv import *
+from common.classes.data_source import SRC
+from global_variables.datapoint import NpyDatapoint as NpyDp
+__t0__ = time.perf_counter()
+
+
+_sql_fetch_wiki: str = f"""SELECT timestamp, price, volume FROM "item_____" WHERE src={SRC.w} AND timestamp < ?
+                            ORDER BY timestamp"""
+_sql_fetch_avg5m: str = f"""SELECT src, timestamp, price, volume FROM "item_____" WHERE src IN {SRC.by_source('avg5m')}
+                             AND timestamp BETWEEN ? AND ?"""
+_sql_fetch_realtime: str = f"""SELECT src, timestamp, price FROM "item_____" WHERE src IN {SRC.by_source('realtime')}
+                                AND timestamp BETWEEN ? AND ? ORDER BY src, timestamp"""
+
+
+def _fetch_array(con: sqlite3.Connection, sql: str, parameters: tuple, n_columns: int) -> np.ndarray:
+    """ Execute `sql` with `parameters` and return the result as a 2-dimensional int64 array with `n_columns` columns """
+    c = con.cursor()
+    c.row_factory = None
+    return np.array(c.execute(sql, parameters).fetchall(), dtype=np.int64).reshape(-1, n_columns)
+
+
+def fetch_item_sources(con: sqlite3.Connection, item_id: int, t0: int, t1: int) -> Tuple[np.ndarray, ...]:
+    """
+    Fetch all timeseries data of `item_id` needed to compute npy rows with timestamps ranging from `t0` to `t1`. Each
+    source is fetched with one query.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the timeseries database
+    item_id : int
+        The item_id to fetch data for
+    t0 : int
+        Lower bound timestamp of the npy rows (inclusive)
+    t1 : int
+        Upper bound timestamp of the npy rows (exclusive)
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Wiki rows (timestamp, price, volume), avg5m rows (src, timestamp, price, volume) and realtime rows
+        (src, timestamp, price)
+    """
+    table, t_last = f'{item_id:0>5}', t0 + (t1 - t0 - 1) // 300 * 300
+    return (
+        _fetch_array(con, _sql_fetch_wiki.replace('_____', table), (t_last,), 3),
+        _fetch_array(con, _sql_fetch_avg5m.replace('_____', table), (t0, t_last), 4),
+        _fetch_array(con, _sql_fetch_realtime.replace('_____', table), (t0, t_last+299), 3)
+    )
+
+
+def utc_datetime_columns(timestamps: np.ndarray) -> Dict[str, np.ndarray]:
+    """ Return the minute, hour, day, month, year and day_of_week (UTC) of each of the `timestamps` """
+    days = timestamps // 86400
+    dt_day = days.astype('datetime64[D]')
+    dt_month = dt_day.astype('datetime64[M]')
+    return {
+        'minute': timestamps % 3600 // 60,
+        'hour': timestamps % 86400 // 3600,
+        'day': (dt_day - dt_month.astype('datetime64[D]')).astype(np.int64) + 1,
+        'month': dt_month.astype(np.int64) % 12 + 1,
+        'year': dt_day.astype('datetime64[Y]').astype(np.int64) + 1970,
+        'day_of_week': (days + 3) % 7
+    }
+
+
+def compute_npy_columns(item_id: int, t0: int, t1: int, buy_limit: int, wiki: np.ndarray, avg5m: np.ndarray,
+                        realtime: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Compute all NpyDatapoint columns for `item_id` with timestamps ranging from `t0` up to `t1`, given source arrays
+    `wiki`, `avg5m` and `realtime` as returned by fetch_item_sources().
+
+    Parameters
+    ----------
+    item_id : int
+        The item_id the rows are computed for
+    t0 : int
+        Lower bound timestamp (inclusive). Should be divisible by 300.
+    t1 : int
+        Upper bound timestamp (exclusive)
+    buy_limit : int
+        Buy limit of the item, used to compute the estimated volume per character and the volume coefficient
+    wiki : np.ndarray
+        Wiki rows (timestamp, price, volume), sorted by timestamp
+    avg5m : np.ndarray
+        Avg5m rows (src, timestamp, price, volume)
+    realtime : np.ndarray
+        Realtime rows (src, timestamp, price), sorted by src, timestamp
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        A dict with an array for each of the NpyDatapoint columns
+    """
+    timestamps = np.arange(t0, t1, 300, dtype=np.int64)
+    n = len(timestamps)
+    zeros = lambda: np.zeros(n, dtype=np.int64)
+
+    # Wiki; as-of join on the most recent timestamp that is smaller than the npy timestamp
+    w_ts, w_p, w_v = zeros(), zeros(), zeros()
+    if len(wiki) > 0:
+        idx = np.searchsorted(wiki[:, 0], timestamps, side='left') - 1
+        has_wiki = idx >= 0
+        idx = idx[has_wiki]
+        w_ts[has_wiki], w_p[has_wiki], w_v[has_wiki] = wiki[idx, 0], wiki[idx, 1], wiki[idx, 2]
+
+    # Avg5m; timestamps are aligned with the npy timestamps
+    b_p, b_v, s_p, s_v = zeros(), zeros(), zeros(), zeros()
+    if len(avg5m) > 0:
+        offset = avg5m[:, 1] - t0
+        on_grid = offset % 300 == 0
+        for src_id, price, volume in ((SRC.a_b.src_id, b_p, b_v), (SRC.a_s.src_id, s_p, s_v)):
+            mask = on_grid & (avg5m[:, 0] == src_id)
+            pos = offset[mask] // 300
+            price[pos], volume[pos] = avg5m[mask, 2], avg5m[mask, 3]
+
+    # Realtime; aggregated per 5-minute bucket, bucket elements are ordered by (src, timestamp)
+    n_rt, rt_min, rt_max, rt_avg, rt_margin, tax = zeros(), zeros(), zeros(), zeros(), zeros(), zeros()
+    has_rt = np.zeros(n, dtype=bool)
+    if len(realtime) > 0:
+        bucket = (realtime[:, 1] - t0) // 300
+        order = np.argsort(bucket, kind='stable')
+        bucket, rt_p = bucket[order], realtime[order, 2]
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        ends = np.r_[starts[1:], len(bucket)]
+        pos, counts = bucket[starts], ends - starts
+        sums = np.add.reduceat(rt_p, starts)
+
+        has_rt[pos], n_rt[pos] = True, counts
+        rt_min[pos], rt_max[pos], rt_avg[pos] = rt_p[starts], rt_p[ends-1], sums // counts
+        tax[pos] = (sums.astype(np.float64) / counts * .01).astype(np.int64)
+        rt_margin[pos] = rt_max[pos] - rt_min[pos] - tax[pos]
+    no_rt = ~has_rt
+    tax[no_rt] = (np.maximum(np.maximum(s_p, b_p), w_p)[no_rt] * .01).astype(np.int64)
+
+    has_avg5m = np.minimum(b_p, s_p) > 0
+    avg5m_price = np.where(has_avg5m, (b_p + s_p) // 2, np.maximum(b_p, s_p))
+    avg5m_volume = b_v + s_v
+
+    has_wiki_price = w_p > 0
+    w_p_div = np.where(has_wiki_price, w_p, 1).astype(np.float64)
+    gap = lambda a, b: np.where(has_wiki_price, (a - b) / w_p_div, 0.0)
+
+    return {
+        'item_id': np.full(n, item_id, dtype=np.int64),
+        'timestamp': timestamps,
+        **utc_datetime_columns(timestamps),
+        'hour_id': timestamps // 3600,
+        'day_id': timestamps // 86400,
+        'week_id': timestamps // 604800,
+        'wiki_ts': w_ts,
+        'wiki_price': w_p,
+        'wiki_volume': w_v,
+        'wiki_value': w_p * w_v,
+        'wiki_volume_5m': w_v // 288,
+        'buy_price': b_p,
+        'buy_volume': b_v,
+        'buy_value': b_p * b_v,
+        'sell_price': s_p,
+        'sell_volume': s_v,
+        'sell_value': s_p * s_v,
+        'avg5m_price': avg5m_price,
+        'avg5m_volume': avg5m_volume,
+        'avg5m_value': avg5m_price * avg5m_volume,
+        'avg5m_margin': np.where(has_avg5m, s_p - b_p - tax, 0),
+        'gap_bs': gap(s_p, b_p),
+        'gap_wb': gap(b_p, w_p),
+        'gap_ws': gap(s_p, w_p),
+        'rt_avg': rt_avg,
+        'rt_min': rt_min,
+        'rt_max': rt_max,
+        'n_rt': n_rt,
+        'realtime_margin': rt_margin,
+        'tax': tax,
+        'est_vol_per_char': np.minimum(buy_limit * 4, w_v // 10),
+        'volume_coefficient': np.minimum(buy_limit, w_v) / max(buy_limit, 1)
+    }
+
+
+def columns_to_rows(columns: Dict[str, np.ndarray], npy_columns: Sequence[str] = NpyDp.__match_args__) -> List[tuple]:
+    """
+    Convert `columns` into a list of rows with values ordered as `npy_columns`. Values are converted to builtin python
+    types, so the rows can be inserted via sqlite3.Connection.executemany(). Columns in `npy_columns` that are not in
+    `columns` are filled with 0s.
+    """
+    n = len(columns['timestamp'])
+    return list(zip(*[columns[c].tolist() if c in columns else [0] * n for c in npy_columns]))
+
+
+def build_npy_rows(con: sqlite3.Connection, item_id: int, t0: int, t1: int, buy_limit: int,
+                   npy_columns: Sequence[str] = NpyDp.__match_args__) -> List[tuple]:
+    """
+    Generate all npy db rows for `item_id` with timestamps ranging from `t0` up to `t1` using the timeseries db connected
+    to via `con`. Each timeseries source is read with one range scan and rows are computed in bulk.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the timeseries database
+    item_id : int
+        The item_id to generate rows for
+    t0 : int
+        Lower bound timestamp (inclusive)
+    t1 : int
+        Upper bound timestamp (exclusive)
+    buy_limit : int
+        Buy limit of the item
+    npy_columns : Sequence[str], optional, NpyDatapoint.__match_args__ by default
+        Column order of the rows that are returned
+
+    Returns
+    -------
+    List[tuple]
+        A list of rows that can be inserted into the npy database, one row for each 5 minutes from `t0` to `t1`.
+    """
+    if t0 >= t1:
+        return []
+    wiki, avg5m, realtime = fetch_item_sources(con, item_id, t0, t1)
+    return columns_to_rows(compute_npy_columns(item_id, t0, t1, buy_limit, wiki, avg5m, realtime), npy_columns)
@@ -0,0 +1,190 @@
+"""
+This module contains the consumer side of the threaded npy db updater; a writer thread that inserts rows produced by
+other threads into the npy database.
+
+Producers put the rows of an item on a bounded queue. The writer holds one connection with the npy database for its
+entire lifetime and inserts queued rows with executemany. Rows are committed in large transactions; a transaction is
+committed once it holds at least `batch_size` rows, or once the queue has been drained.
+
+Optionally, rows can be spilled to disk before they are queued. A spill file is removed after its rows have been
+committed. If the process crashes, the remaining spill files are imported upon the next start via recover(). By default,
+it reads global_variables.path.dir_npy_import; the spill directory of the threaded updater and the directory in which
+the former file-based importer left its files.
+"""
+import queue
+import sqlite3
+import threading
+from collections.abc import Callable, Sequence
+from typing import List, Optional, Tuple
+
+from venv_auto_loader.active_venv import *
+import global_variables.path as gp
+import util.file as uf
+from file.file import File
+from global_variables.datapoint import NpyDatapoint as NpyDp
+__t0__ = time.perf_counter()
+
+
+def spill_file_item_id(file_name: str) -> int:
+    """
+    Parse the item_id from spill file `file_name`. Spill files are named as `{item_id:0>5}_{time_ns}.dat`, files left
+    behind by the former file-based importer are named as `{thread_id}_{item_id:0>5}.dat`, possibly suffixed with _.
+    """
+    parts = file_name.split('.')[0].rstrip('_').split('_')
+    return int(parts[0] if len(parts[0]) == 5 else parts[-1])
+
+
+class NpyRowWriter(threading.Thread):
+    """
+    Writer thread that inserts npy rows put on its queue by producer threads.
+
+    Attributes
+    ----------
+    n_rows : int
+        The amount of rows that have been committed
+    n_items : int
+        The amount of items of which the rows have been committed
+    n_commits : int
+        The amount of transactions that have been committed
+    """
+    sql_insert: str = f"""INSERT OR REPLACE INTO "item_____" ({', '.join(NpyDp.__match_args__)})
+                          VALUES ({', '.join(['?' for _ in NpyDp.__match_args__])})"""
+    _stop_signal = None
+
+    def __init__(self, db_path: str = gp.f_db_npy, max_queue_size: int = 16, batch_size: int = 500000,
+                 spill_dir: Optional[str] = None, callback_item_written: Callable = None, **kwargs):
+        """
+
+        Parameters
+        ----------
+        db_path : str, optional, global_variables.path.f_db_npy by default
+            Path to the npy database
+        max_queue_size : int, optional, 16 by default
+            The maximum amount of items on the queue. If the queue is full, producers block until an item was taken.
+        batch_size : int, optional, 500000 by default
+            Minimum amount of rows in a transaction before it is committed, unless the queue is empty
+        spill_dir : Optional[str], optional, None by default
+            If passed, rows are saved in this directory before they are queued and deleted after they were committed
+        callback_item_written : Callable, optional, None by default
+            Executed as callback_item_written(item_id: int, n_rows: int) after the rows of an item were committed
+        """
+        threading.Thread.__init__(self, name=kwargs.get('name', 'NpyRowWriter'), daemon=kwargs.get('daemon'))
+        self.db_path = db_path
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.spill_dir = spill_dir
+        self.callback_item_written = callback_item_written
+        self.n_rows, self.n_items, self.n_commits = 0, 0, 0
+        self.exception: Optional[BaseException] = None
+
+    def put(self, item_id: int, rows: Sequence[tuple]):
+        """ Queue `rows` of `item_id` for insertion. Blocks if the queue is full. """
+        if self.exception is not None:
+            raise RuntimeError("Unable to queue rows, as the NpyRowWriter was terminated") from self.exception
+        spill_file = None
+        if self.spill_dir is not None:
+            spill_file = File(f"{self.spill_dir}{item_id:0>5}_{time.time_ns()}.dat")
+            spill_file.save(list(rows))
+        self.queue.put((item_id, rows, spill_file))
+
+    def close(self, timeout: float = .5):
+        """
+        Signal the writer that there is no more data, then wait for it to commit the remaining rows. If the writer was
+        terminated by an exception, it is re-raised. While the queue is full, the writer is checked for being alive
+        every `timeout` seconds, such that a writer that died does not block this call indefinitely.
+        """
+        while self.is_alive():
+            try:
+                self.queue.put(self._stop_signal, timeout=timeout)
+                break
+            except queue.Full:
+                continue
+        self.join()
+        if self.exception is not None:
+            raise self.exception
+
+    def run(self):
+        """ Consume the queue; insert rows and commit them in batches until the stop signal is received """
+        con = None
+        try:
+            con = sqlite3.connect(self.db_path, check_same_thread=False)
+            stop = False
+            while not stop:
+                batch: List[Tuple[int, Sequence[tuple], Optional[File]]] = []
+                n_batch = 0
+                el = self.queue.get()
+                while True:
+                    if el is self._stop_signal:
+                        stop = True
+                        break
+                    batch.append(el)
+                    n_batch += len(el[1])
+                    if n_batch >= self.batch_size:
+                        break
+                    try:
+                        el = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                self.write_batch(con, batch)
+        except BaseException as e:
+            self.exception = e
+            # Unblock producers that may be waiting for the queue
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+        finally:
+            if con is not None:
+                con.close()
+
+    def write_batch(self, con: sqlite3.Connection, batch: List[Tuple[int, Sequence[tuple], Optional[File]]]):
+        """ Insert all rows in `batch` within a single transaction and remove their spill files afterwards """
+        if len(batch) == 0:
+            return
+        with con:
+            for item_id, rows, _ in batch:
+                con.executemany(self.sql_insert.replace('_____', f'{item_id:0>5}'), rows)
+        self.n_commits += 1
+
+        for item_id, rows, spill_file in batch:
+            if spill_file is not None:
+                spill_file.delete()
+            self.n_rows += len(rows)
+            self.n_items += 1
+            if self.callback_item_written is not None:
+                self.callback_item_written(item_id, len(rows))
+
+    def recover(self, create_table: Callable[[int], str] = None, spill_dir: str = None) -> int:
+        """
+        Insert rows of spill files that were left behind by an earlier run and remove the files. Should be called
+        before the writer thread is started. Return the amount of recovered files.
+
+        Parameters
+        ----------
+        create_table : Callable[[int], str], optional, None by default
+            Method that returns a CREATE TABLE IF NOT EXISTS statement for an item_id. If passed, it is executed before
+            inserting the rows of that item.
+        spill_dir : str, optional, None by default
+            Directory with the spill files. By default, the spill directory of this writer or, if it does not spill
+            rows, global_variables.path.dir_npy_import.
+        """
+        if spill_dir is None:
+            spill_dir = gp.dir_npy_import if self.spill_dir is None else self.spill_dir
+        if not os.path.isdir(spill_dir):
+            return 0
+        con, n = sqlite3.connect(self.db_path), 0
+        for f in uf.get_files(spill_dir, ext='dat', full_path=False):
+            f = File(spill_dir + f)
+            try:
+                item_id = spill_file_item_id(f.file)
+            except ValueError:
+                continue
+            with con:
+                if create_table is not None:
+                    con.execute(create_table(item_id))
+                con.executemany(self.sql_insert.replace('_____', f'{item_id:0>5}'), f.load())
+            f.delete()
+            n += 1
+        con.close()
+        return n
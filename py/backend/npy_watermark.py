@@ -0,0 +1,246 @@
+"""
+This module contains the implementation of the watermark and dirty range tables of the timeseries database. These
+tables are used to update the npy database incrementally.
+
+The watermark table holds the most recent timestamp that was ingested per item, per src. The dirty range table holds
+the timestamp ranges of rows that were ingested since the npy db updater last consumed them, per item, per src. Both
+tables are maintained while rows are transferred into the timeseries database (see tasks.data_transfer).
+
+While updating the npy database, the dirty ranges are converted into the 5-minute npy timestamps affected by them. Only
+those rows are recomputed, after which the consumed dirty ranges are removed. This also covers data that arrives late,
+e.g. avg5m datapoints that were downloaded afterwards.
+
+Notes
+-----
+A wiki datapoint affects all npy rows up to the next wiki datapoint, as wiki data is joined as-of. Avg5m and realtime
+datapoints only affect the npy row of the 5-minute interval they fall into.
+
+Dirty ranges are only registered for the items in global_variables.osrs.npy_items, as they are only consumed while
+updating the npy database. The watermarks are kept for all items.
+"""
+import json
+import sqlite3
+from collections.abc import Iterable
+from typing import Dict, List, Optional, Tuple
+
+from venv_auto_loader.active_venv import *
+import global_variables.configurations as cfg
+import global_variables.osrs as go
+from backend.item_stats import update_item_stats
+from common.classes.data_source import SRC
+from timeseries.view.materialized import invalidate_materialized_views
+__t0__ = time.perf_counter()
+
+
+sql_create_watermark: str = """CREATE TABLE IF NOT EXISTS "npy_watermark"(
+    "item_id" INTEGER NOT NULL,
+    "src" INTEGER NOT NULL,
+    "timestamp" INTEGER NOT NULL,
+    PRIMARY KEY(item_id, src) ) WITHOUT ROWID"""
+
+sql_create_dirty_range: str = """CREATE TABLE IF NOT EXISTS "npy_dirty_range"(
+    "item_id" INTEGER NOT NULL,
+    "src" INTEGER NOT NULL,
+    "t0" INTEGER NOT NULL,
+    "t1" INTEGER NOT NULL )"""
+
+sql_create_dirty_range_index: str = \
+    """CREATE INDEX IF NOT EXISTS "npy_dirty_range_item_id" ON "npy_dirty_range"(item_id)"""
+
+sql_upsert_watermark: str = """INSERT INTO "npy_watermark"(item_id, src, timestamp) VALUES (?, ?, ?)
+    ON CONFLICT(item_id, src) DO UPDATE SET timestamp=MAX(timestamp, excluded.timestamp)"""
+
+sql_insert_dirty_range: str = """INSERT INTO "npy_dirty_range"(item_id, src, t0, t1) VALUES (?, ?, ?, ?)"""
+
+sql_select_dirty_ranges: str = """SELECT rowid, src, t0, t1 FROM "npy_dirty_range" WHERE item_id=?"""
+
+sql_next_wiki_ts: str = f"""SELECT MIN(timestamp) FROM "item_____" WHERE src={SRC.w} AND timestamp > ?"""
+
+
+def _cursor(con: sqlite3.Connection) -> sqlite3.Cursor:
+    """ Return a cursor of `con` that returns rows as tuples, regardless of the row factory of `con` """
+    c = con.cursor()
+    c.row_factory = None
+    return c
+
+
+def create_tables(con: sqlite3.Connection):
+    """ Create the watermark and dirty range tables in the database connected to via `con`, if they do not exist """
+    for sql in (sql_create_watermark, sql_create_dirty_range, sql_create_dirty_range_index):
+        con.execute(sql)
+
+
+class DirtyRangeTracker:
+    """
+    Class for keeping track of the timestamp range of rows ingested per item_id, per src. Ranges are accumulated while
+    rows are inserted and registered in the watermark and dirty range tables in one go via flush().
+
+    Examples
+    --------
+    tracker = DirtyRangeTracker()
+    for item_id, src, timestamp, price, volume in rows:
+        con.execute(sql_insert, (src, timestamp, price, volume))
+        tracker.add(item_id, src, timestamp)
+    tracker.flush(con)
+    con.commit()
+    """
+    def __init__(self):
+        self.ranges: Dict[Tuple[int, int], List[int]] = {}
+
+    def add(self, item_id: int, src: int, timestamp: int):
+        """ Register an ingested row of `item_id` from source `src` with timestamp `timestamp` """
+        r = self.ranges.get((item_id, src))
+        if r is None:
+            self.ranges[(item_id, src)] = [timestamp, timestamp]
+        elif timestamp < r[0]:
+            r[0] = timestamp
+        elif timestamp > r[1]:
+            r[1] = timestamp
+
+    def add_range(self, item_id: int, src: int, t0: int, t1: int):
+        """ Register ingested rows of `item_id` from source `src` with timestamps ranging from `t0` to `t1` """
+        self.add(item_id, src, t0)
+        self.add(item_id, src, t1)
+
+    def flush(self, con: sqlite3.Connection) -> int:
+        """
+        Register all accumulated ranges in the database connected to via `con`, update the item_stats of the affected
+        items (see backend.item_stats), lower the high-water marks of their materialized views (see
+        timeseries.view.materialized) and reset the tracker. Changes are not committed, so they can be committed
+        together with the ingested rows. Return the amount of registered ranges.
+        """
+        n = len(self.ranges)
+        if n > 0:
+            create_tables(con)
+            con.executemany(sql_upsert_watermark, [(i, s, r[1]) for (i, s), r in self.ranges.items()])
+            con.executemany(sql_insert_dirty_range, npy_dirty_ranges(self.ranges))
+            update_item_stats(con, self.ranges)
+            invalidate_materialized_views(con, self.ranges)
+            self.ranges = {}
+        return n
+
+    def __len__(self):
+        return len(self.ranges)
+
+
+def get_watermark(con: sqlite3.Connection, src: int | Iterable[int], item_ids: Iterable[int] = None) -> Optional[int]:
+    """
+    Return the highest timestamp ingested for source(s) `src`, optionally restricted to `item_ids`. Return None if there
+    is no watermark.
+    """
+    src = (src,) if isinstance(src, int) else tuple(src)
+    sql = f"""SELECT MAX(timestamp) FROM "npy_watermark" WHERE src IN ({', '.join(['?' for _ in src])})"""
+    parameters = src
+    if item_ids is not None:
+        item_ids = tuple(item_ids)
+        sql += f""" AND item_id IN ({', '.join(['?' for _ in item_ids])})"""
+        parameters += item_ids
+    try:
+        return _cursor(con).execute(sql, parameters).fetchone()[0]
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return None
+        raise e
+
+
+def default_timestamps(con: sqlite3.Connection) -> Tuple[int, int]:
+    """
+    Return the default (t0, t1) timestamp bounds of the npy database, given the configurations and the avg5m watermark
+    of the most traded items in the timeseries database connected to via `con`. If there is no watermark, the most
+    recent avg5m timestamp of these items is used instead.
+    """
+    t1 = get_watermark(con, SRC.by_source('avg5m', 'src_id'), go.most_traded_items)
+    if t1 is None:
+        c, t1 = _cursor(con), 0
+        for i in go.most_traded_items:
+            t1 = max(t1, c.execute(f"""SELECT MAX(timestamp) FROM "item{i:0>5}" WHERE src IN {SRC.by_source('avg5m')}"""
+                                   ).fetchone()[0] or 0)
+    t1 = int(round(t1 / cfg.npy_round_t1, 0) * cfg.npy_round_t1)
+    return t1 - t1 % cfg.npy_round_t0 - cfg.npy_db_timespan_days * 86400, t1 - t1 % cfg.npy_round_t1
+
+
+def get_dirty_ranges(con: sqlite3.Connection, item_id: int) -> List[Tuple[int, int, int, int]]:
+    """ Return the dirty ranges of `item_id` as a list of (rowid, src, t0, t1) tuples """
+    try:
+        return _cursor(con).execute(sql_select_dirty_ranges, (item_id,)).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return []
+        raise e
+
+
+def dirty_intervals(con: sqlite3.Connection, item_id: int, ranges: Iterable[Tuple[int, int, int, int]],
+                    t_min: int, t_max: int) -> List[Tuple[int, int]]:
+    """
+    Convert dirty `ranges` of `item_id` into merged, non-overlapping intervals of npy timestamps that are affected by
+    them. Intervals are clipped to [`t_min`, `t_max`).
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the timeseries database, used to look up subsequent wiki datapoints
+    item_id : int
+        The item_id the dirty ranges refer to
+    ranges : Iterable[Tuple[int, int, int, int]]
+        Dirty ranges as (rowid, src, t0, t1) tuples, as returned by get_dirty_ranges()
+    t_min : int
+        Lower bound npy timestamp (inclusive)
+    t_max : int
+        Upper bound npy timestamp (exclusive)
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        Sorted list of (t0, t1) tuples, where t0 is inclusive and t1 is exclusive.
+    """
+    c, intervals = _cursor(con), []
+    for _, src, t0, t1 in ranges:
+        if src == SRC.w.src_id:
+            # A wiki row affects all npy timestamps greater than it, up to and including the next wiki timestamp
+            next_ts = c.execute(sql_next_wiki_ts.replace('_____', f'{item_id:0>5}'), (t1,)).fetchone()[0]
+            t0 = t0 - t0 % 300 + 300
+            t1 = t_max if next_ts is None else next_ts - next_ts % 300 + 300
+        else:
+            t0, t1 = t0 - t0 % 300, t1 - t1 % 300 + 300
+        t0, t1 = max(t0, t_min), min(t1, t_max)
+        if t0 < t1:
+            intervals.append((t0, t1))
+
+    return merge_intervals(intervals)
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """ Merge overlapping and adjacent (t0, t1) `intervals` and return them sorted """
+    merged = []
+    for t0, t1 in sorted(intervals):
+        if len(merged) > 0 and t0 <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(t1, merged[-1][1]))
+        else:
+            merged.append((t0, t1))
+    return merged
+
+
+def clear_dirty_ranges(con: sqlite3.Connection, rowids: Iterable[int]):
+    """ Remove the dirty ranges with rowids `rowids`. Changes are not committed. """
+    con.executemany("""DELETE FROM "npy_dirty_range" WHERE rowid=?""", [(r,) for r in rowids])
+
+
+def npy_dirty_ranges(ranges: Dict[Tuple[int, int], List[int]]) -> List[Tuple[int, int, int, int]]:
+    """ Convert tracked `ranges` into (item_id, src, t0, t1) dirty range rows, restricted to the npy items """
+    npy_items = frozenset(go.npy_items)
+    return [(i, s, r[0], r[1]) for (i, s), r in ranges.items() if i in npy_items]
+
+
+def prune_dirty_ranges(con: sqlite3.Connection, item_ids: Iterable[int] = None) -> int:
+    """
+    Remove the dirty ranges of items that are not in `item_ids`, or not in the npy items if undefined, as they are never
+    consumed. Changes are not committed. Return the amount of removed dirty ranges.
+    """
+    item_ids = list(go.npy_items if item_ids is None else item_ids)
+    try:
+        return con.execute("""DELETE FROM "npy_dirty_range" WHERE item_id NOT IN (SELECT value FROM json_each(?))""",
+                           (json.dumps(item_ids),)).rowcount
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return 0
+        raise e
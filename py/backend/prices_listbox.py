@@ -0,0 +1,183 @@
+"""
+This module contains a vectorized implementation for computing prices listbox entries from the npy database.
+
+An entry consists of one row per day, covering the past `n_rows` days. Each day is divided into `n_intervals` equally
+sized intervals. Rather than querying the npy database per interval, the entire window of an item is fetched with one
+range scan, after which the avg5m prices are binned into day x interval cells and all statistics are computed at once.
+The entries that are produced are identical to those produced by the per-interval implementation (see
+NpyDbUpdater.update_prices_listbox_entry).
+
+Examples
+--------
+Computing the listbox of all npy items in one batch;
+    prices_listbox = build_prices_listbox(sqlite3.connect(gp.f_db_npy), go.npy_items)
+"""
+import sqlite3
+from collections.abc import Callable, Iterable
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from venv_auto_loader.active_venv import *
+import global_variables.configurations as cfg
+import util.str_formats as fmt
+__t0__ = time.perf_counter()
+
+
+buy_tags: Dict[int, str] = {0: 'b_0_4', 4: 'b_4_8', 8: 'b_8_12', 12: 'b_12_16', 16: 'b_16_20', 20: 'b_20_24'}
+
+_sql_max_ts: str = """SELECT MAX(timestamp) FROM "item_____" """
+_sql_fetch_window: str = """SELECT timestamp, avg5m_price, wiki_volume FROM "item_____" WHERE timestamp BETWEEN ? AND ?
+                            ORDER BY timestamp"""
+
+
+def window_start(t_max: Optional[int], t_default: int, n_intervals: int = 6) -> int:
+    """ Return the start timestamp of the most recent listbox row, given the most recent npy timestamp `t_max` """
+    interval_start = t_default if t_max is None else t_max - 86100
+    interval_size = int(24 / n_intervals) * 3600
+    if interval_start % interval_size != 0:
+        interval_start = interval_start + cfg.listbox_column_timespan - interval_start % cfg.listbox_column_timespan
+    return interval_start
+
+
+def fetch_window(con: sqlite3.Connection, item_id: int, t_default: int, n_rows: int = cfg.prices_listbox_days,
+                 n_intervals: int = 6) -> Tuple[int, np.ndarray]:
+    """
+    Fetch the npy rows of `item_id` needed to compute its listbox entry. Return the start timestamp of the most recent
+    listbox row and an array with (timestamp, avg5m_price, wiki_volume) rows.
+    """
+    c = con.cursor()
+    c.row_factory = None
+    table = f'{item_id:0>5}'
+    interval_start = window_start(c.execute(_sql_max_ts.replace('_____', table)).fetchone()[0], t_default, n_intervals)
+    parameters = (interval_start - (n_rows - 1) * 86400, interval_start + 86400)
+    rows = c.execute(_sql_fetch_window.replace('_____', table), parameters).fetchall()
+    return interval_start, np.array(rows, dtype=np.int64).reshape(-1, 3)
+
+
+def compute_listbox_rows(data: np.ndarray, interval_start: int, n_rows: int = cfg.prices_listbox_days,
+                         n_intervals: int = 6) -> List[dict]:
+    """
+    Compute the listbox rows from npy `data`, the most recent row starting at `interval_start`.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Array with (timestamp, avg5m_price, wiki_volume) rows, sorted by timestamp
+    interval_start : int
+        Start timestamp of the most recent listbox row
+    n_rows : int, optional, global_variables.configurations.prices_listbox_days by default
+        Amount of rows to produce as output, where each row corresponds to a 24 hour timespan.
+    n_intervals : int, optional, 6 by default
+        Amount of smaller, equally sized intervals to divide each 24-hour timespan in
+
+    Returns
+    -------
+    List[dict]
+        Listbox rows, ordered from most recent to least recent
+
+    Notes
+    -----
+    Within each interval, the buy price is the avg5m price at 5% of the sorted, non-zero prices and the sell price is
+    the price at 95%. Intervals without prices are assigned a buy price of 1 and are excluded from the daily summary.
+    """
+    interval_size = int(24 / n_intervals) * 3600
+    n_cells = n_rows * n_intervals
+    t_lo = interval_start - (n_rows - 1) * 86400
+    timestamps, prices, wiki_volume = data[:, 0], data[:, 1], data[:, 2]
+
+    # Bin the non-zero prices into cells, counted from the least recent interval onwards, sorted by price per cell
+    mask = (prices > 0) & (timestamps >= t_lo) & (timestamps < t_lo + n_cells * interval_size)
+    cell, p = (timestamps[mask] - t_lo) // interval_size, prices[mask]
+    order = np.lexsort((p, cell))
+    cell, p = cell[order], p[order]
+    counts = np.bincount(cell, minlength=n_cells)
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    ar_5p = (counts * .05).astype(np.int64)
+    has_price = counts > 0
+
+    buy, sell = np.ones(n_cells, dtype=np.int64), np.zeros(n_cells, dtype=np.int64)
+    buy[has_price] = p[(offsets + ar_5p)[has_price]]
+    sell[has_price] = p[np.where(ar_5p > 0, offsets + counts - ar_5p, offsets)[has_price]]
+
+    # Reshape to day x interval, most recent day first
+    buy, sell, has_price = [a.reshape(n_rows, n_intervals)[::-1] for a in (buy, sell, has_price)]
+    n_valid = has_price.sum(axis=1)
+    s_last = sell[np.arange(n_rows), n_intervals - 1 - np.argmax(has_price[:, ::-1], axis=1)]
+    s_high = (np.sort(np.where(has_price, sell, 0), axis=1)[:, -3:].sum(axis=1) /
+              np.maximum(np.minimum(n_valid, 3), 1)).astype(np.int64)
+    min_buy = np.where(has_price, buy, np.iinfo(np.int64).max).min(axis=1)
+
+    # Average wiki volume per day, including the first row of the subsequent day
+    day_starts = interval_start - np.arange(n_rows, dtype=np.int64) * 86400
+    cs = np.r_[0, np.cumsum(wiki_volume)]
+    lo = np.searchsorted(timestamps, day_starts, side='left')
+    hi = np.searchsorted(timestamps, day_starts + 86400, side='right')
+    volume = ((cs[hi] - cs[lo]) / np.maximum(hi - lo, 1)).astype(np.int64)
+
+    rows = []
+    for d, day_start in enumerate(day_starts.tolist()):
+        cur = {'t0': fmt.unix_(day_start, fmt_str='%d-%m %H:%M')}
+        for j in range(n_intervals):
+            t = day_start + j * interval_size
+            cur[buy_tags.get(t % 86400 // 3600)] = int(buy[d, j])
+            cur['ts'] = t
+        if n_valid[d] > 0:
+            cur['s_24h_last'] = int(s_last[d])
+            cur['s_24h_high'] = int(s_high[d])
+            cur['volume'] = int(volume[d])
+            cur['delta_s_b'] = int(s_high[d] - min_buy[d])
+        rows.append(cur)
+    return rows
+
+
+def prices_listbox_entry(con: sqlite3.Connection, item_id: int, t_default: int, n_rows: int = cfg.prices_listbox_days,
+                         n_intervals: int = 6, cur_t1: str = None) -> Optional[List[dict]]:
+    """
+    Compute the prices listbox entry of `item_id` using the npy database connected to via `con`. If `cur_t1` is passed
+    and it equals the t0 of the most recent row, the entry is up-to-date and None is returned instead.
+    """
+    interval_start, data = fetch_window(con, item_id, t_default, n_rows, n_intervals)
+    if cur_t1 is not None and cur_t1 == fmt.unix_(interval_start, fmt_str='%d-%m %H:%M'):
+        return None
+    return compute_listbox_rows(data, interval_start, n_rows, n_intervals)
+
+
+def build_prices_listbox(con: sqlite3.Connection, item_ids: Iterable[int], t_default: int = 0,
+                         prices_listbox: Dict[int, List[dict]] = None, n_rows: int = cfg.prices_listbox_days,
+                         n_intervals: int = 6, progress_callback: Callable = None) -> Dict[int, List[dict]]:
+    """
+    Compute the prices listbox entries of all `item_ids` in one batch.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the npy database
+    item_ids : Iterable[int]
+        The item_ids to compute entries for
+    t_default : int, optional, 0 by default
+        Start timestamp used for items without npy rows
+    prices_listbox : Dict[int, List[dict]], optional, None by default
+        Previously computed entries. Entries that are up-to-date are not recomputed.
+    n_rows : int, optional, global_variables.configurations.prices_listbox_days by default
+        Amount of rows per entry
+    n_intervals : int, optional, 6 by default
+        Amount of intervals per row
+    progress_callback : Callable, optional, None by default
+        Executed after each item as progress_callback(n_done: int)
+
+    Returns
+    -------
+    Dict[int, List[dict]]
+        The prices listbox; item_ids mapped to their entry
+    """
+    prices_listbox = {} if prices_listbox is None else prices_listbox
+    for idx, item_id in enumerate(item_ids):
+        cur = prices_listbox.get(item_id)
+        entry = prices_listbox_entry(con, item_id, t_default, n_rows, n_intervals,
+                                     cur_t1=cur[0].get('t0') if cur else None)
+        if entry is not None:
+            prices_listbox[item_id] = entry
+        if progress_callback is not None:
+            progress_callback(idx + 1)
+    return prices_listbox
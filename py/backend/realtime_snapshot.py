@@ -0,0 +1,183 @@
+"""
+This module contains the dense array representation of the realtime prices snapshot and the vectorized kernel that
+scores all items based on it.
+
+A realtime prices snapshot is a dict that maps item_id to its (low, high) realtime prices. RealtimeSnapshot converts it
+into a numpy structured array that is indexed by item_id, such that the prices of all items can be processed in one
+vectorized operation rather than a loop over items. A refresh builds a new array and then replaces the reference to
+the current one; readers that obtained the previous array keep a consistent, unaltered view of it.
+
+market_scores() computes the GE tax, margin, return on investment, high alch profit and death coffer profit of all items
+in one call. The scores are computed once per snapshot and cached along with it.
+
+Examples
+--------
+snapshot = RealtimeSnapshot(realtime_prices())
+scores = snapshot.scores(alch_values)
+best = np.argsort(scores['margin'])[::-1][:10]
+"""
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from venv_auto_loader.active_venv import *
+__t0__ = time.perf_counter()
+
+
+price_dtype: np.dtype = np.dtype([('buy', np.int64), ('sell', np.int64), ('valid', np.bool_)])
+"""dtype of the price array. `valid` is False for items without a buy or sell price in the snapshot."""
+
+score_dtype: np.dtype = np.dtype([('tax', np.int64), ('margin', np.int64), ('roi', np.float64),
+                                  ('alch_profit', np.int64), ('death_coffer', np.int64)])
+"""dtype of the array computed by market_scores()"""
+
+max_tax: int = 5000000
+"""Maximum amount of GE tax that is applied to a single sale"""
+
+nature_rune_id: int = 561
+
+death_coffer_min_price: int = 10000
+"""Minimum guide price of an item that can be offered to the death coffer"""
+
+max_cached_scores: int = 8
+"""Maximum amount of score arrays that are cached per price array"""
+
+
+def price_array(prices: Dict[int, Tuple[Optional[int], Optional[int]]], size: int = None) -> np.ndarray:
+    """
+    Convert realtime `prices` into a structured array with dtype `price_dtype`, indexed by item_id. The buy price is the
+    lowest of the two prices of an item, the sell price the highest. Items without both prices are not valid.
+
+    Parameters
+    ----------
+    prices : Dict[int, Tuple[Optional[int], Optional[int]]]
+        Realtime prices snapshot, which maps item_id to (low, high) prices
+    size : int, optional, None by default
+        Length of the array. By default, the highest item_id plus one.
+    """
+    ids = np.fromiter(prices.keys(), dtype=np.int64, count=len(prices))
+    values = np.array([(-1 if p[0] is None else p[0], -1 if p[1] is None else p[1]) for p in prices.values()],
+                      dtype=np.int64).reshape(-1, 2)
+    size = (int(ids.max()) + 1 if len(ids) > 0 else 0) if size is None else size
+    ar = np.zeros(size, dtype=price_dtype)
+    keep = ids < size
+    ids, values = ids[keep], values[keep]
+    ar['buy'][ids] = values.min(axis=1)
+    ar['sell'][ids] = values.max(axis=1)
+    ar['valid'][ids] = values.min(axis=1) > 0
+    ar['buy'][~ar['valid']], ar['sell'][~ar['valid']] = 0, 0
+    return ar
+
+
+def market_scores(prices: np.ndarray, alch_values: np.ndarray = None, nature_rune_price: int = None,
+                  ge_prices: np.ndarray = None) -> np.ndarray:
+    """
+    Compute the scores of all items in `prices` in one vectorized call. Scores of items without valid prices are 0 (or
+    NaN for the ROI).
+
+    Parameters
+    ----------
+    prices : np.ndarray
+        Price array with dtype `price_dtype`, as returned by price_array()
+    alch_values : np.ndarray, optional, None by default
+        High alch values indexed by item_id. If undefined, alch profits are 0.
+    nature_rune_price : int, optional, None by default
+        Price of a nature rune. By default, its buy price in `prices`.
+    ge_prices : np.ndarray, optional, None by default
+        Guide prices indexed by item_id. If undefined, death coffer profits are 0.
+
+    Returns
+    -------
+    np.ndarray
+        Array with dtype `score_dtype`, indexed by item_id, with fields
+        tax: GE tax applied when selling the item for its sell price
+        margin: sell price minus buy price minus tax
+        roi: margin divided by buy price
+        alch_profit: high alch value minus buy price minus nature rune price
+        death_coffer: guide price times 1.05 minus buy price, for items with a guide price of at least
+        `death_coffer_min_price`
+    """
+    valid, buy, sell = prices['valid'], prices['buy'], prices['sell']
+    scores = np.zeros(len(prices), dtype=score_dtype)
+    tax = np.minimum(sell // 100, max_tax)
+    scores['tax'] = tax
+    scores['margin'] = np.where(valid, sell - buy - tax, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores['roi'] = np.where(valid & (buy > 0), scores['margin'] / buy, np.nan)
+
+    if alch_values is not None:
+        if nature_rune_price is None:
+            nature_rune_price = int(buy[nature_rune_id]) if len(prices) > nature_rune_id else 0
+        n = min(len(prices), len(alch_values))
+        scores['alch_profit'][:n] = np.where(valid[:n], alch_values[:n] - buy[:n] - nature_rune_price, 0)
+
+    if ge_prices is not None:
+        n = min(len(prices), len(ge_prices))
+        eligible = valid[:n] & (ge_prices[:n] >= death_coffer_min_price)
+        scores['death_coffer'][:n] = np.where(eligible, (ge_prices[:n] * 1.05).astype(np.int64) - buy[:n], 0)
+    return scores
+
+
+class _State(NamedTuple):
+    prices: np.ndarray
+    timestamp: float
+    scores: List[Tuple[Optional[np.ndarray], Optional[np.ndarray], np.ndarray]]
+
+
+class RealtimeSnapshot:
+    """
+    Dense, atomically swapped realtime prices snapshot.
+
+    Attributes
+    ----------
+    prices : np.ndarray
+        The current price array, with dtype `price_dtype`
+    timestamp : float
+        Unix timestamp at which the current price array was set
+    """
+    def __init__(self, prices: Dict[int, Tuple[int, int]] = None):
+        self._lock = threading.Lock()
+        self._state = _State(np.zeros(0, dtype=price_dtype), 0.0, [])
+        if prices is not None:
+            self.swap(prices)
+
+    def swap(self, prices: Dict[int, Tuple[int, int]]) -> np.ndarray:
+        """ Build the price array of realtime `prices` and make it the current price array. Return the new array. """
+        ar = price_array(prices)
+        ar.flags.writeable = False
+        self._state = _State(ar, time.time(), [])
+        return ar
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self._state.prices
+
+    @property
+    def timestamp(self) -> float:
+        return self._state.timestamp
+
+    def price(self, item_id: int) -> Optional[Tuple[int, int]]:
+        """ Return the (buy, sell) prices of `item_id`, or None if the snapshot has no valid prices for it """
+        ar = self._state.prices
+        if 0 <= item_id < len(ar) and ar['valid'][item_id]:
+            return int(ar['buy'][item_id]), int(ar['sell'][item_id])
+        return None
+
+    def scores(self, alch_values: np.ndarray = None, ge_prices: np.ndarray = None) -> np.ndarray:
+        """
+        Return the market scores of all items for the current price array (see market_scores()). Scores are cached per
+        price array and per `alch_values`, `ge_prices` array objects, up to `max_cached_scores` combinations. The cache
+        holds a reference to these arrays, so they should not be modified after they are passed.
+        """
+        state = self._state
+        for cached_alch_values, cached_ge_prices, scores in state.scores:
+            if cached_alch_values is alch_values and cached_ge_prices is ge_prices:
+                return scores
+        scores = market_scores(state.prices, alch_values, ge_prices=ge_prices)
+        scores.flags.writeable = False
+        with self._lock:
+            if len(state.scores) >= max_cached_scores:
+                del state.scores[0]
+            state.scores.append((alch_values, ge_prices, scores))
+        return scores
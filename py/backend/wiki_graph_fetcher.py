@@ -0,0 +1,140 @@
+"""
+This module contains the implementation of the concurrent multi-item wiki graph fetcher.
+
+Wiki graphs (the daily wiki price/volume history of an item) are downloaded from the weirdgloop exchange history API,
+which serves one item per request. The WikiGraphFetcher downloads the graphs of a list of items using a pool of worker
+threads. The amount of requests that are in progress per host is capped via a semaphore and the request rate is capped
+by a token bucket that is shared by all workers. Downloads are made via the shared HttpSession, i.e. each worker reuses
+its connection with the host.
+
+Downloaded graphs are parsed directly into a structured numpy array with timestamp, price and volume fields. Graphs
+are yielded as soon as they are downloaded, such that they can be ingested while the remaining graphs are still being
+downloaded.
+
+The url of the API can be configured, which allows the fetcher to be pointed at a local fixture server.
+
+Examples
+--------
+for item_id, graph in WikiGraphFetcher(n_workers=8).fetch(item_ids):
+    ...
+"""
+import http.client
+import threading
+import urllib.error
+import urllib.parse
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from venv_auto_loader.active_venv import *
+from backend.avg5m_backfill import TokenBucket
+from backend.http_session import HttpSession, http_session
+__t0__ = time.perf_counter()
+
+
+weirdgloop_history_api: str = "https://api.weirdgloop.org/exchange/history/osrs/all"
+
+wiki_graph_dtype: np.dtype = np.dtype([('timestamp', np.int64), ('price', np.int64), ('volume', np.int64)])
+"""dtype of parsed wiki graphs. Missing volumes are set to 0."""
+
+
+def parse_wiki_graph(item_id: int, payload: dict, min_ts: int = 0) -> np.ndarray:
+    """
+    Parse the exchange history `payload` of `item_id` into a structured array with dtype `wiki_graph_dtype`, sorted by
+    timestamp. Timestamps are converted from milliseconds to seconds; datapoints older than `min_ts` are omitted.
+    """
+    entries = payload.get(str(item_id)) or []
+    n = len(entries)
+    graph = np.empty(n, dtype=wiki_graph_dtype)
+    graph['timestamp'] = np.fromiter((e.get('timestamp') for e in entries), dtype=np.int64, count=n) // 1000
+    graph['price'] = np.fromiter((e.get('price') or 0 for e in entries), dtype=np.int64, count=n)
+    graph['volume'] = np.fromiter((e.get('volume') if isinstance(e.get('volume'), int) else 0 for e in entries),
+                                  dtype=np.int64, count=n)
+    graph = graph[graph['timestamp'] >= min_ts]
+    return graph[np.argsort(graph['timestamp'], kind='stable')]
+
+
+class WikiGraphFetcher:
+    """
+    Concurrent downloader of the wiki graphs of multiple items.
+
+    Attributes
+    ----------
+    n_workers : int
+        Amount of worker threads
+    max_per_host : int
+        Maximum amount of requests that are in progress per host
+    rate : Optional[float]
+        Maximum amount of requests per second, across all workers. If None, the rate is not limited.
+    url : str
+        Url of the exchange history API; the item_id is passed as the id parameter
+    session : HttpSession
+        Session used to make requests
+    """
+    def __init__(self, n_workers: int = 8, max_per_host: int = 4, rate: Optional[float] = 5.0,
+                 url: str = weirdgloop_history_api, session: HttpSession = None):
+        self.n_workers = n_workers
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.url = url
+        self.session = http_session() if session is None else session
+        self.bucket = None if rate is None else TokenBucket(rate)
+        self.n_failed = 0
+
+        self._lock = threading.Lock()
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """ Return the semaphore that caps the amount of concurrent requests to the host of `url` """
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+        return slot
+
+    def fetch_item(self, item_id: int, min_ts: int = 0) -> np.ndarray:
+        """ Download and parse the wiki graph of `item_id`, omitting datapoints older than `min_ts` """
+        url = f"{self.url}?id={item_id}"
+        with self._host_slot(url):
+            if self.bucket is not None:
+                self.bucket.acquire()
+            payload = self.session.get_json(url)
+        return parse_wiki_graph(item_id, payload, min_ts)
+
+    def fetch(self, item_ids: Iterable[int], min_ts: Dict[int, int] or int = 0) \
+            -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+        """
+        Download the wiki graphs of `item_ids` concurrently and yield (item_id, graph) tuples in the order in which the
+        downloads complete. If a download fails, its graph is None.
+
+        Parameters
+        ----------
+        item_ids : Iterable[int]
+            item_ids of the graphs that are to be downloaded
+        min_ts : Dict[int, int] or int, optional, 0 by default
+            Datapoints older than `min_ts` are omitted. If a dict is passed, it is the lower bound per item_id.
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix='WikiGraphFetcher') as executor:
+                futures = {executor.submit(self.fetch_item, item_id,
+                                           min_ts.get(item_id, 0) if isinstance(min_ts, dict) else min_ts): item_id
+                           for item_id in item_ids}
+                try:
+                    for future in as_completed(futures):
+                        item_id = futures[future]
+                        try:
+                            yield item_id, future.result()
+                        except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError,
+                                AttributeError, TypeError, KeyError) as e:
+                            self.n_failed += 1
+                            print(f"\tFailed to download the wiki graph of item_id={item_id}: {e}")
+                            yield item_id, None
+                finally:
+                    for future in futures:
+                        future.cancel()
+        finally:
+            # The worker threads have exited; close their persistent connections
+            self.session.release_connections()
@@ -7,7 +7,7 @@ import time
 
 import global_variables.path as gp
 import util.str_formats as fmt
-from tasks.backup_timeseries import create_backup
+from tasks.backup_timeseries import IncrementalBackup
 from util.sql import vacuum_into
 
 
@@ -18,7 +18,10 @@ if __name__ == '__main__':
     vacuum_into(gp.f_db_timeseries, gp.dir_timeseries_backup + 'timeseries.db')
     print(f'\tDone in {fmt.delta_t(time.perf_counter()-start_time)}')
     if backup:
-        create_backup(backup_directory=gp.dir_data + 'backup_test/')
+        incremental_backup = IncrementalBackup()
+        incremental_backup.run()
+        print(f'\t{incremental_backup.verify()}')
+        incremental_backup.close()
     print('Done!')
     _ = input('')
     exit(1)
@@ -0,0 +1,175 @@
+"""
+Module with a connection pool for sqlite databases.
+
+A ConnectionPool holds connections with one sqlite database file, such that they can be reused rather than established
+for every statement that is executed;
+- Read connections are read-only and thread-local; each thread lazily establishes its own read connection, which it
+  reuses for every subsequent read. Read connections of threads that have exited are closed whenever a new read
+  connection is established, or via ConnectionPool.release_connections().
+- There is one write connection, which is shared by all threads. Access to it is serialized via a lock. Changes are
+  committed upon leaving ConnectionPool.writer(), or via ConnectionPool.commit().
+
+Each connection is established with a sized prepared statement cache, which means repeatedly executed statements are
+compiled only once per connection. Row factories are resolved once per key and cached within the pool.
+
+Connections are closed via ConnectionPool.close(). If the pool is used after the process was forked, connections that
+were inherited from the parent process are discarded and new ones are established instead.
+
+See Also
+--------
+common.classes.database.Database
+    Executes statements via a ConnectionPool
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import common.row_factories as factories
+__t0__ = time.perf_counter()
+
+
+class ConnectionPool:
+    """
+    Thread-aware pool of connections with the sqlite database at `path`.
+
+    Attributes
+    ----------
+    path : str
+        Path to the database file
+    cached_statements : int
+        Size of the prepared statement cache of each connection
+    timeout : float
+        Amount of seconds a connection waits for a lock to be released before raising an exception
+    write_lock : threading.RLock
+        Lock that serializes the usage of the write connection
+    """
+    def __init__(self, path: str, cached_statements: int = 256, timeout: float = 30.0):
+        self.path = str(path)
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.write_lock = threading.RLock()
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._read_connections: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._write_con: Optional[sqlite3.Connection] = None
+        self._row_factories: Dict[Any, Callable] = {}
+        self._pid = os.getpid()
+        self.closed = False
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        """ Establish a new connection and register it in the pool """
+        if self.closed:
+            raise sqlite3.ProgrammingError(f"Cannot operate on a closed connection pool (path={self.path})")
+        try:
+            con = sqlite3.connect(f"file:{self.path}?mode=ro" if read_only else self.path, uri=read_only,
+                                  timeout=self.timeout, cached_statements=self.cached_statements,
+                                  check_same_thread=False)
+        except sqlite3.OperationalError as e:
+            if read_only and 'invalid uri authority' in str(e):
+                con = sqlite3.connect(self.path, timeout=self.timeout, cached_statements=self.cached_statements,
+                                      check_same_thread=False)
+            else:
+                raise e
+        with self._lock:
+            self._connections.append(con)
+        return con
+
+    def _check_pid(self):
+        """ Discard all connections if this pool was inherited from a parent process """
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._connections, self._read_connections, self._write_con = [], {}, None
+            self._lock, self.write_lock = threading.Lock(), threading.RLock()
+
+    def read_connection(self) -> sqlite3.Connection:
+        """ Return the read-only connection of the current thread. Establish it if it does not exist yet. """
+        self._check_pid()
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            self.release_connections()
+            con = self._connect(read_only=True)
+            with self._lock:
+                self._read_connections[threading.current_thread()] = con
+            self._local.con = con
+        return con
+
+    def release_connections(self) -> int:
+        """ Close the read connections of threads that have exited and return the amount of closed connections """
+        with self._lock:
+            exited = [t for t in self._read_connections if not t.is_alive()]
+            connections = [self._read_connections.pop(t) for t in exited]
+            self._connections = [con for con in self._connections if con not in connections]
+        for con in connections:
+            try:
+                con.close()
+            except sqlite3.Error:
+                ...
+        return len(connections)
+
+    def write_connection(self) -> sqlite3.Connection:
+        """ Return the shared write connection. Callers are expected to hold `write_lock` while using it. """
+        self._check_pid()
+        with self.write_lock:
+            if self._write_con is None:
+                self._write_con = self._connect(read_only=False)
+            return self._write_con
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """
+        Context manager that yields the write connection while holding the write lock. Changes are committed upon
+        leaving the context, or rolled back if an exception was raised.
+        """
+        with self.write_lock:
+            con = self.write_connection()
+            try:
+                yield con
+            except BaseException as e:
+                con.rollback()
+                raise e
+            con.commit()
+
+    def commit(self):
+        """ Commit the pending changes of the write connection, if it was established """
+        with self.write_lock:
+            if self._write_con is not None:
+                self._write_con.commit()
+
+    def rollback(self):
+        """ Roll back the pending changes of the write connection, if it was established """
+        with self.write_lock:
+            if self._write_con is not None:
+                self._write_con.rollback()
+
+    def row_factory(self, key: Any) -> Callable:
+        """ Return the row factory registered as `key` in common.row_factories, resolving it once per key """
+        try:
+            rf = self._row_factories.get(key)
+        except TypeError:
+            return factories.get_row_factory(key)
+        if rf is None:
+            rf = factories.get_row_factory(key)
+            self._row_factories[key] = rf
+        return rf
+
+    def close(self):
+        """ Close all connections in the pool. The pool can no longer be used afterwards. """
+        with self._lock:
+            connections, self._connections, self._read_connections = self._connections, [], {}
+            self._write_con, self.closed = None, True
+        self._local = threading.local()
+        for con in connections:
+            try:
+                con.close()
+            except sqlite3.Error:
+                ...
+
+    def __len__(self):
+        return len(self._connections)
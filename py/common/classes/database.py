@@ -51,6 +51,7 @@ from overrides import override
 
 import common.classes.item
 import common.row_factories as factories
+from common.classes.connection_pool import ConnectionPool
 # import util.verify as verify
 from file.file import File, IFile
 from common.classes.table import Column, Table
@@ -111,10 +112,16 @@ class Database(sqlite3.Connection, IFile):
     
     The Database model class also contains some native sqlite methods for getting certain properties of the connected
     database, e.g. count_rows, get_min/get_max
+    
+    Statements executed via Database.execute() use pooled connections (see common.classes.connection_pool); each thread
+    reuses its own read-only connection and write operations are serialized over one shared write connection.
     """
     file: File
     """The file of this Database"""
     
+    pool: ConnectionPool
+    """Pool of connections used to execute statements with"""
+    
     def __init__(self, path: str or File, tables: Table or Iterable = None, row_factory: Callable = dict_factory,
                  parse_tables: bool = None, read_only: bool = True, **kwargs):
         if isinstance(path, File):
@@ -133,6 +140,10 @@ class Database(sqlite3.Connection, IFile):
         # self.__dict__.update(File(path).__dict__)
         self.row_factory = row_factory
         self.tables, self.cursors = {}, {}
+        
+        if getattr(self, 'pool', None) is not None:
+            self.pool.close()
+        self.pool = ConnectionPool(self.path, cached_statements=kwargs.get('cached_statements', 256))
 
         self.default_factory = row_factory
         for key in (0, tuple, dict):
@@ -141,13 +152,12 @@ class Database(sqlite3.Connection, IFile):
         sqlite_schema_factory = factories.get_row_factory(var.SqliteSchema)
         
         # Automatically extract tables and columns from the connected database
-        _con = self.read_con
-        _con.row_factory = sqlite_schema_factory
-        self.sql_tables: List[var.SqliteSchema] = _con.execute(
-            "SELECT type, name, tbl_name, rootpage FROM sqlite_master WHERE type='table'").fetchall()
+        self.sql_tables: List[var.SqliteSchema] = self.execute(
+            "SELECT type, name, tbl_name, rootpage FROM sqlite_master WHERE type='table'",
+            row_factory=sqlite_schema_factory).fetchall()
         self.sql_indices: List[var.SqliteSchema] = self.execute(
             "SELECT type, name, tbl_name, rootpage FROM sqlite_master WHERE type='index'",
-            factory=sqlite_schema_factory).fetchall()
+            row_factory=sqlite_schema_factory).fetchall()
         
         if parse_tables is None or parse_tables:
             # print(self.db_path)
@@ -172,6 +182,11 @@ class Database(sqlite3.Connection, IFile):
         """
         Execute a sql statement with the parameters provided. If `factory` is passed, execute it with a cursor that has
          the factory fetched by key `factory`. See Examples section for factory args added by default.
+        
+        The statement is executed via a pooled connection; the read-only connection of the current thread, or the
+        shared write connection if `read_only` is False. Write statements are not committed; changes of multiple write
+        statements are committed as one transaction via Database.commit(). A connection can be passed explicitly via the
+        `con` keyword argument instead.
 
         Returns
         -------
@@ -195,10 +210,11 @@ class Database(sqlite3.Connection, IFile):
 
         """
         try:
-            c = kwargs.get("con", self.read_con if read_only else self.write_con)
-            if factory is not None or row_factory is not None:
-                c.row_factory = factories.get_row_factory(factory) if row_factory is None else row_factory
-            
+            con = kwargs.get("con")
+            if con is None and not read_only:
+                with self.pool.write_lock:
+                    return self._cursor(self.pool.write_connection(), factory, row_factory).execute(sql, params)
+            c = self._cursor(self.pool.read_connection() if con is None else con, factory, row_factory)
             return c.execute(sql, params)
         except sqlite3.OperationalError as e:
             if 'no such table: item' in str(e) and isinstance(params, dict) and kwargs.get('recursive') is None:
@@ -216,11 +232,42 @@ class Database(sqlite3.Connection, IFile):
                 print('Parameters:', ())
             raise e
     
+    def _cursor(self, con: sqlite3.Connection, factory: any = None,
+                row_factory: Optional[Callable[[sqlite3.Cursor, tuple], any]] = None) -> sqlite3.Cursor:
+        """ Return a new cursor of `con` with the row factory described by `factory` or `row_factory` """
+        c = con.cursor()
+        if row_factory is not None:
+            c.row_factory = row_factory
+        elif factory is not None:
+            c.row_factory = self.pool.row_factory(factory)
+        return c
+    
+    @override
+    def commit(self):
+        """ Commit the changes made via the pooled write connection, then commit this connection """
+        if getattr(self, 'pool', None) is not None:
+            self.pool.commit()
+        super().commit()
+    
+    @override
+    def rollback(self):
+        """ Roll back the changes made via the pooled write connection, then roll back this connection """
+        if getattr(self, 'pool', None) is not None:
+            self.pool.rollback()
+        super().rollback()
+    
+    @override
+    def close(self):
+        """ Close all pooled connections, then close this connection """
+        if getattr(self, 'pool', None) is not None:
+            self.pool.close()
+        super().close()
+    
     def con_exe_com(self, sql: str, parameters: Optional[Tuple[any, ...] | Dict[str, any]] = tuple([]),
                     execute_many: bool = False):
         """
-        Establish a writeable connection, execute `sql` with parameters `parameters`, commit and close. Can be used to
-        submit something to a Database that is loaded as read-only
+        Execute `sql` with parameters `parameters` via the pooled write connection and commit. Can be used to submit
+        something to a Database that is loaded as read-only
         
         Parameters
         ----------
@@ -232,16 +279,14 @@ class Database(sqlite3.Connection, IFile):
             If True, invoke sqlite3.Connection.execute_many() instead of *.execute()
 
         """
-        _con = self.write_con
         try:
-            if execute_many:
-                _con.executemany(sql, parameters)
-            else:
-                _con.execute(sql, parameters)
+            with self.pool.writer() as _con:
+                if execute_many:
+                    _con.executemany(sql, parameters)
+                else:
+                    _con.execute(sql, parameters)
         except sqlite3.ProgrammingError as e:
             raise sqlite3.ProgrammingError(e)
-        _con.commit()
-        _con.close()
         
     def reconnect(self):
         """ Reconnect with the database file """
@@ -9,7 +9,7 @@ from typing import Callable, Dict, Literal, Optional, Tuple
 
 import global_variables.path as gp
 from entity.localdb import LocalDbEntity
-from global_variables.local_file import rt_prices_snapshot as realtime
+import global_variables.local_file as gl
 
 
 @dataclass(slots=True, match_args=False)
@@ -60,7 +60,7 @@ class Item(LocalDbEntity):
         c = sqlite3.connect(f"file:{gp.f_db_timeseries}?mode=ro", uri=True)
         c.row_factory = lambda _c, _r: _r[0]
         table = f"item{self.item_id:0>5}"
-        rt_entry = realtime[self.item_id]
+        rt_entry = gl.rt_prices_snapshot[self.item_id]
         
         self._current_ge = c.execute(
             f"""SELECT price FROM "{table}" WHERE src=0 ORDER BY timestamp DESC"""
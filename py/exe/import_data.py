@@ -3,7 +3,8 @@ Executable module for data import + update pipeline.
 
 When running this module, take extra care to avoid unexpected interruptions. Interrupting the script introduces a
 serious risk of corrupting the database. This risk can be reduced by not interrupting the script and by creating
-back-ups
+back-ups. Timeseries transfers of rbpi exports are journaled (see backend.ingest_journal); an interrupted transfer
+resumes where it stopped upon the next run.
 
 """
 
@@ -15,20 +16,42 @@ from tasks.util import finish_execution
 
 
 def import_data(generate_arrays: bool = False, vacuum_threshold_mb: int = 3, vacuum_threshold_seconds: int = 90,
-                multithreaded_npy_update: bool = True):
-    """ Import data from the Raspberry Pi and subsequently update npy arrays + prices listbox """
+                multithreaded_npy_update: bool = True, multiprocess_npy_update: bool = True,
+                attach_exports: bool = True):
+    """
+    Import data from the Raspberry Pi and subsequently update npy arrays + prices listbox. The npy db is updated using
+    worker processes if `multiprocess_npy_update`, else using threads if `multithreaded_npy_update`. If
+    `attach_exports`, rbpi exports are merged by attaching them to the timeseries database.
+    """
     _time = time.perf_counter()
     # timeseries_transfer()
     
     from tasks.parse_transactions import parse_logs
     parse_logs(post_exe_print=False)
     
-    from tasks.data_transfer import insert_items, timeseries_transfer_merged
+    from tasks.data_transfer import insert_items, timeseries_transfer_merged, timeseries_merge_attached
     insert_items(__t0__)
-    timeseries_transfer_merged(start_time=__t0__)
+    if attach_exports:
+        timeseries_merge_attached(start_time=__t0__)
+    else:
+        timeseries_transfer_merged(start_time=__t0__)
+    
+    # Recount the rows of item_stats that were invalidated by rows ingested before their most recent timestamp, then
+    # recompute the rows of the materialized views that are affected by the ingested rows
+    import sqlite3
+    import global_variables.path as gp
+    from backend.item_stats import refresh_item_stats
+    from timeseries.view.materialized import refresh_all_materialized_views
+    con = sqlite3.connect(gp.f_db_timeseries)
+    refresh_item_stats(con)
+    refresh_all_materialized_views(con)
+    con.close()
     
     # Generate + VACUUM the npy db and compute listbox entries for GUI
-    if multithreaded_npy_update:
+    if multiprocess_npy_update:
+        from backend.npy_db_updater_process import NpyDbProcessUpdater
+        NpyDbProcessUpdater(start_time=__t0__)
+    elif multithreaded_npy_update:
         from backend.npy_db_updater_threaded import UpdaterThreadManager
         UpdaterThreadManager(start_time=__t0__)
     else:
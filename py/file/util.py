@@ -232,7 +232,7 @@ def _save_npy(data: np.ndarray, path: str, **kwargs):
     https://numpy.org/doc/stable/reference/routines.io.html
     """
     _kwargs = {'fix_imports': True, 'allow_pickle': True}
-    _kwargs.update({kwargs.get(k) for k in frozenset(_kwargs).intersection(kwargs)})
+    _kwargs.update({k: kwargs[k] for k in frozenset(_kwargs).intersection(kwargs) if kwargs[k] is not None})
     np.save(path, data, **_kwargs)
 
 
@@ -266,9 +266,9 @@ def _load_npy(path: str, **kwargs):
     https://numpy.org/doc/stable/reference/routines.io.html
 
     """
-    # keys = ('mmap_mode', 'allow_pickle', 'fix_imports', 'encoding')
+    keys = ('mmap_mode', 'allow_pickle', 'fix_imports', 'encoding')
     _kwargs = {'fix_imports': True, 'allow_pickle': True}
-    _kwargs.update({kwargs.get(k) for k in frozenset(_kwargs).intersection(kwargs)})
+    _kwargs.update({k: kwargs[k] for k in keys if kwargs.get(k) is not None})
     return np.load(path, **_kwargs)
 
 
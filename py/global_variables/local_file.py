@@ -10,15 +10,22 @@ LocalFile subclasses represent files that require frequent updating from externa
 As updating this data almost always involves making a request, the LocalFile classes have integrated methods for keeping
  the files updated. This serves as a safeguard against outdated data and excessive updating.
 
+Instantiating a LocalFile may update it, so rt_prices_snapshot and item_wiki_mapping are created upon their first access
+rather than upon importing this module.
+
 """
 import datetime
+import threading
+from typing import Any, Callable, Dict, Tuple
 
+import numpy as np
 from overrides import override
 
 from venv_auto_loader.active_venv import *
 import backend.download as dl
 import global_variables.configurations as cfg
 import global_variables.path as gp
+from backend.realtime_snapshot import RealtimeSnapshot
 from global_variables.classes import SingletonMeta
 from common.classes.local_file import LocalFile, FlagFile
 __t0__ = time.perf_counter()
@@ -35,12 +42,14 @@ class RealtimePricesSnapshot(LocalFile, metaclass=SingletonMeta):
     The updater is integrated in this class; the snapshot is updated every X seconds, with X being the update frequency
     value set below.
     
-    
+    Each time the snapshot is loaded, its dense array representation (see backend.realtime_snapshot) is rebuilt and
+    swapped in. It can be used for scoring all items at once via market_scores().
     """
     
     def __init__(self):
         update_frequency = self.get_update_frequency()
         self.download_from_rbpi = update_frequency == cfg.rt_rbpi_update_frequency
+        self.snapshot = RealtimeSnapshot()
         super().__init__(path=gp.local_file_rt_prices, update_frequency=update_frequency)
         print(f'Setting up RealtimePricesSnapshot class (allow_rbpi_download={self.download_from_rbpi})')
     
@@ -80,6 +89,27 @@ class RealtimePricesSnapshot(LocalFile, metaclass=SingletonMeta):
             self.file_content = new_data
         return self.file_content
     
+    @override
+    def load_and_verify(self) -> bool:
+        """ Load and verify the snapshot, then swap in the price array of the loaded snapshot if it is valid """
+        verified = super().load_and_verify()
+        if verified:
+            self.snapshot.swap(self.file_content)
+        return verified
+    
+    def price_array(self) -> np.ndarray:
+        """ Return the snapshot as price array, indexed by item_id (see backend.realtime_snapshot.price_array) """
+        self.update()
+        return self.snapshot.prices
+    
+    def market_scores(self, alch_values: np.ndarray = None, ge_prices: np.ndarray = None) -> np.ndarray:
+        """
+        Return the tax, margin, ROI, high alch profit and death coffer profit of all items (see
+        backend.realtime_snapshot)
+        """
+        self.update()
+        return self.snapshot.scores(alch_values, ge_prices)
+    
     def get_price(self, item_id: int) -> Tuple[int, int]:
         """ Get the buy and sell prices for item `item_id` """
         return self.get_value(item_id=item_id)
@@ -93,8 +123,6 @@ class RealtimePricesSnapshot(LocalFile, metaclass=SingletonMeta):
         return self.get_price(item)
 
 
-rt_prices_snapshot = RealtimePricesSnapshot()
-
 
 class ItemWikiMapping(LocalFile, metaclass=SingletonMeta):
     """
@@ -145,8 +173,6 @@ class ItemWikiMapping(LocalFile, metaclass=SingletonMeta):
         return self.get_value(item_id=item_id)
 
 
-item_wiki_mapping = ItemWikiMapping()
-
 
 class DataTransferFlag(FlagFile):
     """
@@ -186,5 +212,28 @@ class TransactionParserFlag(FlagFile):
 flag_parsing_transactions = TransactionParserFlag()
 
 
+_lazy_attributes: Dict[str, Callable[[], Any]] = {
+    'rt_prices_snapshot': RealtimePricesSnapshot,
+    'item_wiki_mapping': ItemWikiMapping
+}
+"""Lazy module attributes, mapped to the LocalFile class that is instantiated upon their first access"""
+_lazy_lock = threading.RLock()
+
+
+def __getattr__(name: str):
+    """ Instantiate lazy module attribute `name` upon its first access (PEP 562) """
+    loader = _lazy_attributes.get(name)
+    if loader is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _lazy_lock:
+        if name not in globals():
+            globals()[name] = loader()
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(set(globals()).union(_lazy_attributes))
+
+
 if __name__ == "__main__":
     ...
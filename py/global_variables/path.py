@@ -129,6 +129,8 @@ f_db_transaction: File = File(dir_data + 'local.db')
 f_db_transaction_new: File = File(dir_data + "transaction_database.db")
 f_db_entity: File = File(dir_data + 'template.db')
 f_db_npy: File = File(dir_databases + 'npy.db')
+f_db_http_cache: File = File(dir_data + 'http_cache.db')
+f_item_catalog: File = File(dir_data + 'item_catalog.bin')
 f_npy_column: File = File(dir_data + 'npy_columns.dat')
 f_prices_listbox: File = File(dir_data + 'prices_listbox.dat')
 f_production_submissions: File = File(dir_data + 'production_submissions.dat')
@@ -9,6 +9,7 @@ import datetime
 import time
 from collections.abc import Collection, Iterable
 from copy import copy, deepcopy
+from typing import Tuple
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -17,7 +18,7 @@ from venv_auto_loader.active_venv import *
 
 import str_formats
 import ts_util
-from model_item import NpyArray
+from backend.npy_array_store import NpyItemArrays, load_npy_array
 from ge_util import remap_item
 from global_values import dow, int32_max, realtime_prices, name_id, delta_t_utc
 from graph_util import xaxis_dow_format, major_format_percentage, xaxis_hod_format, configure_vertical_plots, \
@@ -78,15 +79,15 @@ class Axis:
 
 
 class PricesGraph:
-    def __init__(self, item: NpyArray, t0, t1, y_values, axs_gen=None, output_file: str = None):
+    def __init__(self, item: NpyItemArrays, t0, t1, y_values, axs_gen=None, output_file: str = None):
         """
         Graph designed specifically for the item prices interface. Displays plots of specified `y-values` within the
-        specified unix timestamp interval `t0` and `t1`, using data from the given NpyArray `item`.
+        specified unix timestamp interval `t0` and `t1`, using data from the given item arrays `item`.
 
         Parameters
         ----------
-        item : NpyArray
-            NpyArray object with data that is to be inserted into the graph. Can be changed when calling plot_graph()
+        item : NpyItemArrays
+            Item arrays with data that is to be inserted into the graph. Can be changed when calling plot_graph()
         t0 : int
             Starting timestamp of the graph
         t1 : int
@@ -96,7 +97,7 @@ class PricesGraph:
 
         Methods
         -------
-        plot_graph(p, t0: int, t1: int, item: NpyArray = None, y_values: list = None, vplot_frequencies=None)
+        plot_graph(p, t0: int, t1: int, item: NpyItemArrays = None, y_values: list = None, vplot_frequencies=None)
             Plot the graph using the args and object attributes as graph configs into matplotlib.Axis `p` and returns it
         """
         self.item = item
@@ -113,10 +114,10 @@ class PricesGraph:
         self.axs_gen = axs_gen
         self.output_file = output_file
     
-    def generate_graph(self, p, t0: int, t1: int, item: NpyArray = None, vplot_frequencies=None,
+    def generate_graph(self, p, t0: int, t1: int, item: NpyItemArrays = None, vplot_frequencies=None,
                        t_formatter: str = '%d-%m-%y %H:%M', graph_generator: callable = None):
         """ Generate+insert graph plots and other configs of this graph into matplotlib Axis `p` and return it """
-        if isinstance(item, NpyArray):
+        if isinstance(item, NpyItemArrays):
             self.item = item
         if graph_generator is not None:
             self.axs_gen = graph_generator
@@ -124,7 +125,7 @@ class PricesGraph:
 
 
 class TimeSeriesPlot:
-    def __init__(self, item: NpyArray, y_config: Axis = None, ylim_multipliers: Collection = (1, 1),
+    def __init__(self, item: NpyItemArrays, y_config: Axis = None, ylim_multipliers: Collection = (1, 1),
                  vline_graph: Graph = None):
         """
         Class that serves as a blueprint for plotting timeseries graphs and streamlining plotting data. The x-axis is
@@ -226,7 +227,18 @@ class TimeSeriesPlot:
         return self.fig, self.axs
 
 
-def price_graph(axs: plt.Axes, item: NpyArray, t0: int, t1: int, vplot_frequencies=None, t_formatter: str = None):
+def time_slice(timestamps: np.ndarray, y: np.ndarray, t0: int, t1: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the timestamps and y-values with t0 <= timestamp < t1 and y > 0. `timestamps` should be sorted; the time
+    range is located via a binary search, so only the rows within the range are evaluated.
+    """
+    i0, i1 = np.searchsorted(timestamps, t0, side='left'), np.searchsorted(timestamps, t1, side='left')
+    timestamps, y = timestamps[i0:i1], y[i0:i1]
+    mask = y > 0
+    return timestamps[mask], y[mask]
+
+
+def price_graph(axs: plt.Axes, item: NpyItemArrays, t0: int, t1: int, vplot_frequencies=None, t_formatter: str = None):
     """
     Plot the buy and sell price against the time for the given `item` within the given timespan `t0`, `t1`
 
@@ -234,8 +246,8 @@ def price_graph(axs: plt.Axes, item: NpyArray, t0: int, t1: int, vplot_frequenci
     ----------
     axs: matplotlib.Axes
         The Axes object that will be plotted on
-    item : NpyArray
-        Loaded NpyArray for the item of interest
+    item : NpyItemArrays
+        Item arrays of the item of interest, as opened by load_npy_array()
     t0 : int
         timestamp lower bound
     t1 : int
@@ -250,21 +262,20 @@ def price_graph(axs: plt.Axes, item: NpyArray, t0: int, t1: int, vplot_frequenci
     plots, patches, t0, t1 = {}, {}, t0, t1
     y_values = ['buy_price', 'sell_price']
     
-    if isinstance(item, NpyArray):
+    if isinstance(item, NpyItemArrays):
         item = item
     
     # Get relevant data
     price_plots = []
     for y_val in y_values:
-        y = item.__dict__.get(y_val)
-        np_values_mask = np.nonzero((item.timestamp >= t0) & (t1 > item.timestamp) & (y > 0))
-        price_plots.append((item.timestamp[np_values_mask], y[np_values_mask]))
-        plots[y_val] = item.timestamp[np_values_mask], y[np_values_mask]
+        x_y = time_slice(item.timestamp, getattr(item, y_val), t0, t1)
+        price_plots.append(x_y)
+        plots[y_val] = x_y
     buy_price, sell_price = price_plots[0], price_plots[1]
     del price_plots
     all_prices = np.sort(np.append(buy_price[1], sell_price[1]))
-    bp_24h = buy_price[1][len(buy_price[0][np.nonzero(buy_price[0] < t1 - 86400)]):]
-    sp_24h = sell_price[1][len(sell_price[0][np.nonzero(sell_price[0] < t1 - 86400)]):]
+    bp_24h = buy_price[1][np.searchsorted(buy_price[0], t1 - 86400):]
+    sp_24h = sell_price[1][np.searchsorted(sell_price[0], t1 - 86400):]
     idx_range_p24h = len(np.append(bp_24h, sp_24h)) // 20
     p24h = list(np.sort(np.append(bp_24h, sp_24h)))[idx_range_p24h:-idx_range_p24h]
     
@@ -353,7 +364,7 @@ def price_graph(axs: plt.Axes, item: NpyArray, t0: int, t1: int, vplot_frequenci
     return axs
 
 
-def price_graph_by_dow(axs: plt.Axes, item: NpyArray, n_weeks: int = 4, colors: collections.abc.Mapping = None,
+def price_graph_by_dow(axs: plt.Axes, item: NpyItemArrays, n_weeks: int = 4, colors: collections.abc.Mapping = None,
                        ts_cutoff: int = 14400, **kwargs) -> plt.Axes:
     """
     Plot the price for the given `item_id` as a series of plots per week. Each separate week is plotted as a different
@@ -363,8 +374,8 @@ def price_graph_by_dow(axs: plt.Axes, item: NpyArray, n_weeks: int = 4, colors:
     ----------
     axs: matplotlib.Axes
         The Axes object that will be plotted on
-    item : NpyArray
-        Loaded NpyArray for the item of interest
+    item : NpyItemArrays
+        Item arrays of the item of interest, as opened by load_npy_array()
     n_weeks : int, optional, 4 by default
         The amount of weeks to plot, aside from the current week.
 
@@ -410,8 +421,8 @@ def price_graph_by_dow(axs: plt.Axes, item: NpyArray, n_weeks: int = 4, colors:
                                       label=f'Current week' if weeks_ago == 0 else
                                       f'{weeks_ago} week{"s" if weeks_ago > 1 else ""} ago'))
         for y in (item.buy_price, item.sell_price):
-            x = item.timestamp[np.nonzero((item.timestamp >= t0_) & (item.timestamp < t1_) & (y > 0))] - t0_
-            y = y[np.nonzero((item.timestamp >= t0_) & (item.timestamp < t1_) & (y > 0))]
+            x, y = time_slice(item.timestamp, y, t0_, t1_)
+            x = x - t0_
             y_avg = int(np.average(y))
             avg_prices.append(y_avg)
             y = y / y_avg - 1
@@ -462,7 +473,7 @@ def price_graph_by_dow(axs: plt.Axes, item: NpyArray, n_weeks: int = 4, colors:
     return axs
 
 
-def price_graph_by_hod(axs: plt.Axes, item: NpyArray, n_days: int = 7, colors: collections.abc.Mapping = None,
+def price_graph_by_hod(axs: plt.Axes, item: NpyItemArrays, n_days: int = 7, colors: collections.abc.Mapping = None,
                        ts_cutoff: int = 14400, **kwargs) -> plt.Axes:
     """
     Plot the price for the given `item_id` as an averaged plot per hour of day.
@@ -471,8 +482,8 @@ def price_graph_by_hod(axs: plt.Axes, item: NpyArray, n_days: int = 7, colors: c
     ----------
     axs : matplotlib.Axes
         The Axes object that will be plotted on
-    item : NpyArray
-        Loaded NpyArray for the item of interest
+    item : NpyItemArrays
+        Item arrays of the item of interest, as opened by load_npy_array()
     n_days : int, optional, 7 by default
         The timespan of the plotted graphs in days.
     colors : collections.abc.Mapping, optional, None by default
@@ -527,8 +538,7 @@ def price_graph_by_hod(axs: plt.Axes, item: NpyArray, n_days: int = 7, colors: c
                                           f'{days_ago} day{"s" if days_ago > 1 else ""} ago'))
         
         for y in (item.buy_price, item.sell_price):
-            x = item.timestamp[np.nonzero((item.timestamp >= t0_) & (item.timestamp < t1_) & (y > 0))]
-            y = y[np.nonzero((item.timestamp >= t0_) & (item.timestamp < t1_) & (y > 0))]
+            x, y = time_slice(item.timestamp, y, t0_, t1_)
             y_avg = int(np.average(y))
             y = y / y_avg - 1
             axs.plot(x % 86400, y, color=c, linewidth=1.3 - days_ago * .10)
@@ -559,15 +569,11 @@ def price_graph_by_hod(axs: plt.Axes, item: NpyArray, n_days: int = 7, colors: c
     # rank 10% and rank 90%) * buy_limit OR 10% of avg daily volume, whichever is lower.
     n_cutoff *= 2
     # avg_prices = avg_prices[~np.isnan(avg_prices)]
-    max_ts = max(item.timestamp)
+    max_ts = int(item.timestamp[-1])
     
     # avg_prices should reflect average prices for over the past 24 hours
-    avg_prices = list(item.buy_price[np.nonzero((item.timestamp >= max_ts - 86400) &
-                                                (item.timestamp < max_ts) &
-                                                (item.buy_price > 0))]) + \
-                 list(item.sell_price[np.nonzero((item.timestamp >= max_ts - 86400) &
-                                                 (item.timestamp < max_ts) &
-                                                 (item.sell_price > 0))])
+    avg_prices = list(time_slice(item.timestamp, item.buy_price, max_ts - 86400, max_ts)[1]) + \
+                 list(time_slice(item.timestamp, item.sell_price, max_ts - 86400, max_ts)[1])
     # print('avg prices', avg_prices)
     # print('n_cutoff', n_cutoff)
     # print('wiki_volume', item.wiki_volume[-7:])
@@ -592,7 +598,7 @@ def price_graph_by_hod(axs: plt.Axes, item: NpyArray, n_days: int = 7, colors: c
 
 def price_per_dose(potion_name: str, axs: plt.Axes, t0: int = None, t1: int = None):
     if t1 is None:
-        t1 = int(np.max(NpyArray(name_id.get(potion_name + f'(4)')).sell_price))
+        t1 = int(np.max(load_npy_array(name_id.get(potion_name + f'(4)')).sell_price))
     if t0 is None:
         t0 = t1 - 86400 * 2
     ts_format = '%d-%m %Hh'
@@ -604,20 +610,20 @@ def price_per_dose(potion_name: str, axs: plt.Axes, t0: int = None, t1: int = No
         if next_id is None:
             continue
             # raise ValueError(f"Unable to extract item ids from potion_name {potion_name + f' ({n})'}")
-        npa = NpyArray(next_id)
+        npa = load_npy_array(next_id)
         cur_prices = realtime_prices.get(next_id)
-        x, y, c = npa.timestamp, npa.buy_price / n, bc[n]
-        np_values_mask = np.nonzero((x >= t0) & (t1 > x) & (y > 0))
-        axs.plot(x[np_values_mask], y[np_values_mask], color=bc[n])
-        all_y += list(y[np_values_mask])
+        (x, y), c = time_slice(npa.timestamp, npa.buy_price, t0, t1), bc[n]
+        y = y / n
+        axs.plot(x, y, color=bc[n])
+        all_y += list(y)
         patches.append(mpatches.Patch(color=c, label=f'{n}-dose buy (cur={min(cur_prices)})'))
         cbs.append(min(cur_prices))
         
         if n == 4:
-            y = npa.sell_price / n
-            np_values_mask = np.nonzero((x >= t0) & (t1 > x) & (y > 0))
-            axs.plot(x[np_values_mask], y[np_values_mask], color=sc)
-            all_y += list(y[np_values_mask])
+            x, y = time_slice(npa.timestamp, npa.sell_price, t0, t1)
+            y = y / n
+            axs.plot(x, y, color=sc)
+            all_y += list(y)
             patches.append(mpatches.Patch(color=sc, label=f'{n}-dose sell (cur={max(cur_prices)})'))
     axs.legend(handles=patches, fontsize='small')
     title = f"{potion_name}  {format_ts(t0, ts_format)} - {format_ts(t1, ts_format)}\n" \
@@ -631,7 +637,7 @@ def price_per_dose(potion_name: str, axs: plt.Axes, t0: int = None, t1: int = No
     return axs
 
 
-def plot_prices(axs: plt.Axes, np_ar: NpyArray, t0: int, t1: int):
+def plot_prices(axs: plt.Axes, np_ar: NpyItemArrays, t0: int, t1: int):
     """
     Plot avg5m buy_prices, avg5m sell_prices and wiki_prices using data from `np_ar` in `axs`. Only plot prices for the
     timestamps between `t0` and `t1`.
@@ -640,8 +646,8 @@ def plot_prices(axs: plt.Axes, np_ar: NpyArray, t0: int, t1: int):
     ----------
     axs : matplotlib.pyplot.Axes
         Area to plot the price graphs in
-    np_ar : NpyArray
-        Predefined NpyArray object with all the necessary data
+    np_ar : NpyItemArrays
+        Item arrays with all the necessary data, as opened by load_npy_array()
     t0 : int
         lower bound unix timestamp
     t1 : int
@@ -658,10 +664,8 @@ def plot_prices(axs: plt.Axes, np_ar: NpyArray, t0: int, t1: int):
     y_min, y_max = 2000000000, 0
     
     for y_val in ['buy_price', 'sell_price', 'wiki_price']:
-        y = np_ar.__dict__.get(y_val)
-        np_values_mask = np.nonzero((np_ar.timestamp >= t0) & (t1 > np_ar.timestamp) & (y > 0))
-        y_values = y[np_values_mask]
-        plots.append((np_ar.timestamp[np_values_mask], y_values))
+        x_values, y_values = time_slice(np_ar.timestamp, getattr(np_ar, y_val), t0, t1)
+        plots.append((x_values, y_values))
         y_min, y_max = min(y_min, min(y_values)), max(y_max, max(y_values))
     
     # x-axis
@@ -694,7 +698,7 @@ def plot_volumes():
     pass
 
 
-def plot_prices_weekly(axs: plt.Axes, np_ar: NpyArray):
+def plot_prices_weekly(axs: plt.Axes, np_ar: NpyItemArrays):
     """
     Plot avg5m buy_prices, avg5m sell_prices and wiki_prices using data from `np_ar` in `axs`. Only plot prices for the
     timestamps between `t0` and `t1`.
@@ -703,8 +707,8 @@ def plot_prices_weekly(axs: plt.Axes, np_ar: NpyArray):
     ----------
     axs : matplotlib.pyplot.Axes
         Area to plot the price graphs in
-    np_ar : NpyArray
-        Predefined NpyArray object with all the necessary data
+    np_ar : NpyItemArrays
+        Item arrays with all the necessary data, as opened by load_npy_array()
     t0 : int
         lower bound unix timestamp
     t1 : int
@@ -795,5 +799,5 @@ def plot_prices_weekly(axs: plt.Axes, np_ar: NpyArray):
 
 if __name__ == "__main__":
     fig, a = plt.subplots(1)
-    a = price_graph_by_dow(axs=a, item=NpyArray(2))
+    a = price_graph_by_dow(axs=a, item=load_npy_array(2))
     plt.show()
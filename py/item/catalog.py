@@ -0,0 +1,261 @@
+"""
+Module with the persistent item catalog snapshot, from which the ItemDb is constructed.
+
+The item catalog is a binary snapshot of the item table. It is laid out as follows;
+- An 8-byte magic string, followed by the byte size of the json header and the header itself. The header holds the
+  catalog version, the staleness key, the columns and the layout of the arrays below.
+- A structured numpy array with one record per item. Numeric attributes are stored as fixed-size int64/float64 fields.
+  String attributes are stored as an int32 index into the string table.
+- The string table; each unique string is stored once, as utf-8, along with an array of offsets.
+
+The snapshot is memory-mapped, so only the pages that are accessed are read. A row of the item table is reconstructed
+from its record upon request.
+
+The staleness key consists of the path and table name, and a hash of the contents of the item table. It does not
+depend on the database file itself, as the file also holds other tables (e.g. transactions) that change far more often
+than the item table. PRAGMA data_version is only meaningful within one connection, so it cannot be compared across
+processes. Aggregates like row counts and sums do not detect every edit (e.g. a string replaced by one of equal length),
+hence the item table is read and hashed as a whole; this is cheap compared to parsing it into an ItemDb. If the key of
+the snapshot does not match, the snapshot is rebuilt from the rows that were read.
+
+Examples
+--------
+catalog = load_item_catalog(gp.f_db_item, 'item', Item.sqlite_attributes.fget(Item))
+row = catalog.row(2)
+"""
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+from collections.abc import Iterable, Sequence
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import global_variables.path as gp
+
+CATALOG_VERSION: int = 1
+"""Version of the snapshot layout. Snapshots with a different version are rebuilt."""
+
+_MAGIC: bytes = b'ITEMCAT\x00'
+_header_size = struct.Struct('<I')
+
+
+def staleness_key(db_file: str, table: str, rows: Iterable[tuple]) -> str:
+    """
+    Return the staleness key of `rows` of `table` in the database at `db_file`. The key holds a hash of the contents of
+    `rows`, which should be read in a deterministic order (e.g. ordered by item_id).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        digest.update(repr(row).encode())
+    return json.dumps([os.path.abspath(str(db_file)), table, digest.hexdigest()])
+
+
+def _column_kind(values: Iterable) -> str:
+    """ Return the kind of the column with `values`; 's' (string), 'f' (float) or 'i' (integer) """
+    kind = 'i'
+    for v in values:
+        if isinstance(v, str):
+            return 's'
+        if isinstance(v, float):
+            kind = 'f'
+    return kind
+
+
+def _align(n: int) -> int:
+    return (n + 7) // 8 * 8
+
+
+def build_catalog(columns: Sequence[str], rows: Sequence[tuple], key: str, id_column: str = 'item_id') -> bytes:
+    """
+    Return the catalog snapshot of `rows`, with `columns` as column names and `key` as staleness key.
+
+    Parameters
+    ----------
+    columns : Sequence[str]
+        Names of the columns of `rows`
+    rows : Sequence[tuple]
+        Rows of the item table
+    key : str
+        Staleness key of the item table, see staleness_key()
+    id_column : str, optional, 'item_id' by default
+        Name of the column that rows are looked up by
+
+    Returns
+    -------
+    bytes
+        The serialized snapshot
+    """
+    kinds = [_column_kind([r[i] for r in rows]) for i in range(len(columns))]
+    fields, nullable = [], []
+    for i, (c, k) in enumerate(zip(columns, kinds)):
+        fields.append((c, {'i': '<i8', 'f': '<f8', 's': '<i4'}[k]))
+        if k != 's' and any(r[i] is None for r in rows):
+            nullable.append(c)
+            fields.append((f"{c}__null", 'u1'))
+    dtype = np.dtype(fields)
+
+    strings: Dict[str, int] = {}
+    records = np.zeros(len(rows), dtype=dtype)
+    for i, (c, k) in enumerate(zip(columns, kinds)):
+        values = [r[i] for r in rows]
+        if k == 's':
+            records[c] = [-1 if v is None else strings.setdefault(str(v), len(strings)) for v in values]
+            continue
+        records[c] = [0 if v is None else v for v in values]
+        if c in nullable:
+            records[f"{c}__null"] = [v is None for v in values]
+
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(s) for s in encoded], dtype=np.int64)
+    blob = b''.join(encoded)
+
+    # Offsets of the arrays are relative to the start of the data section, which follows the (aligned) header
+    offsets_offset = _align(records.nbytes)
+    blob_offset = offsets_offset + offsets.nbytes
+    header = json.dumps({
+        'version': CATALOG_VERSION, 'key': key, 'columns': list(columns), 'kinds': kinds, 'nullable': nullable,
+        'id_column': id_column, 'dtype': dtype.descr, 'n_rows': len(rows), 'n_strings': len(encoded),
+        'offsets_offset': offsets_offset, 'blob_offset': blob_offset, 'blob_size': len(blob)}).encode()
+
+    out = bytearray(_MAGIC + _header_size.pack(len(header)) + header)
+    out += b'\x00' * (_align(len(out)) - len(out))
+    data_start = len(out)
+    out += records.tobytes()
+    out += b'\x00' * (data_start + offsets_offset - len(out))
+    out += offsets.tobytes()
+    out += blob
+    return bytes(out)
+
+
+class ItemCatalog:
+    """
+    Read-only view on a catalog snapshot, held in `buffer` (e.g. a memory-mapped snapshot file).
+
+    Attributes
+    ----------
+    key : str
+        Staleness key of the item table at the moment the snapshot was built
+    columns : Tuple[str, ...]
+        Names of the columns of the rows
+    records : np.ndarray
+        Structured array with one record per row
+    strings : List[str]
+        The interned string table
+    item_ids : Tuple[int, ...]
+        Sorted item_ids of all rows
+    """
+    def __init__(self, buffer):
+        if bytes(buffer[:len(_MAGIC)]) != _MAGIC:
+            raise ValueError("Buffer does not contain an item catalog snapshot")
+        n = _header_size.unpack_from(buffer, len(_MAGIC))[0]
+        start = len(_MAGIC) + _header_size.size
+        header = json.loads(bytes(buffer[start:start+n]).decode())
+        data_start = _align(start + n)
+        if header.get('version') != CATALOG_VERSION:
+            raise ValueError(f"Item catalog version {header.get('version')} is not supported")
+        self._buffer = buffer
+        self.key: str = header['key']
+        self.columns: Tuple[str, ...] = tuple(header['columns'])
+        self._kinds: Tuple[str, ...] = tuple(header['kinds'])
+        self._nullable = frozenset(header['nullable'])
+
+        dtype = np.dtype([tuple(f) for f in header['dtype']])
+        self.records = np.frombuffer(buffer, dtype=dtype, count=header['n_rows'], offset=data_start)
+        offsets = np.frombuffer(buffer, dtype='<i8', count=header['n_strings']+1,
+                                offset=data_start+header['offsets_offset'])
+        blob_start = data_start + header['blob_offset']
+        blob = bytes(buffer[blob_start:blob_start+header['blob_size']])
+        self.strings: List[str] = [blob[o0:o1].decode() for o0, o1 in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+        ids = self.records[header['id_column']]
+        self.item_ids: Tuple[int, ...] = tuple(np.unique(ids).tolist())
+        self._index = np.full(max(self.item_ids, default=-1) + 1, -1, dtype=np.int32)
+        self._index[ids] = np.arange(len(ids), dtype=np.int32)
+        self._fields = [(c, k, c in self._nullable) for c, k in zip(self.columns, self._kinds)]
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        """
+        Release the records and close the buffer if it is memory-mapped, such that the snapshot file can be replaced.
+        The catalog cannot be used afterwards.
+        """
+        buffer, self._buffer, self.records = self._buffer, None, None
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+
+    def row(self, item_id: int) -> Optional[tuple]:
+        """ Return the row of `item_id` as it was read from the item table, or None if it does not exist """
+        if item_id < 0 or item_id >= len(self._index):
+            return None
+        idx = self._index[item_id]
+        if idx < 0:
+            return None
+        record = self.records[idx]
+        row = []
+        for c, k, nullable in self._fields:
+            v = record[c].item()
+            if k == 's':
+                row.append(None if v < 0 else self.strings[v])
+            else:
+                row.append(None if nullable and record[f"{c}__null"] else v)
+        return tuple(row)
+
+    def column(self, name: str) -> list:
+        """ Return the values of column `name` for all rows, in the order of the records """
+        values = self.records[name].tolist()
+        if self._kinds[self.columns.index(name)] == 's':
+            return [None if v < 0 else self.strings[v] for v in values]
+        return values
+
+
+def open_item_catalog(path: str) -> Optional[ItemCatalog]:
+    """ Memory-map the catalog snapshot at `path` and return it, or None if it does not exist or is invalid """
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return ItemCatalog(buffer)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_item_catalog(path: str, snapshot: bytes) -> bool:
+    """ Atomically replace the catalog snapshot at `path` with `snapshot`. Return True if it was written. """
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(snapshot)
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        # E.g. if the existing snapshot is memory-mapped on a platform that does not allow replacing it
+        return False
+
+
+def load_item_catalog(db_file: str, table: str, columns: Sequence[str], path: str = gp.f_item_catalog,
+                      id_column: str = 'item_id') -> ItemCatalog:
+    """
+    Return the item catalog of `table` in `db_file`. The `columns` of `table` are read from the database; if the
+    snapshot at `path` was built from the same rows, it is memory-mapped, else it is rebuilt.
+    """
+    con = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        rows = con.execute(f"""SELECT {", ".join(columns)} FROM "{table}" ORDER BY "{id_column}" """).fetchall()
+    finally:
+        con.close()
+    key = staleness_key(db_file, table, rows)
+    catalog = open_item_catalog(path)
+    if catalog is not None and catalog.key == key and catalog.columns == tuple(columns):
+        return catalog
+    if catalog is not None:
+        # The stale snapshot has to be unmapped first, as a memory-mapped file cannot be replaced on Windows
+        catalog.close()
+    snapshot = build_catalog(columns, rows, key, id_column)
+    write_item_catalog(path, snapshot)
+    return ItemCatalog(snapshot)
@@ -7,8 +7,10 @@ from collections.abc import Iterable
 from dataclasses import dataclass, field
 from typing import Callable, Dict, Optional, Tuple
 
+import global_variables.osrs as go
 import global_variables.path as gp
-from global_variables.local_file import rt_prices_snapshot as realtime
+from backend.item_stats import compute_item_stats, get_item_stats
+import global_variables.local_file as gl
 from databases.db_entity import DbEntity
 
 
@@ -56,36 +58,34 @@ class Item(DbEntity):
     _live_data_loaded: bool = field(default=False, init=False, compare=False)
     
     def _load_live_data(self) -> None:
-        """Lazy-loads live trade data attributes from the SQLite database."""
+        """
+        Lazy-loads live trade data attributes from the item_stats table of the timeseries database, which requires one
+        lookup. Statistics of sources that are missing in the item_stats table are computed from the timeseries table.
+        """
         c = sqlite3.connect(f"file:{gp.f_db_timeseries}?mode=ro", uri=True)
-        c.row_factory = self.factory_el0
-        table = f"item{self.item_id:0>5}"
-        rt_entry = realtime[self.item_id]
-        
-        self._current_ge = c.execute(
-            f"""SELECT price FROM "{table}" WHERE src=0 ORDER BY timestamp DESC LIMIT 1"""
-        ).fetchone()
+        stats = get_item_stats(c, self.item_id)
+        for src in range(5):
+            if src not in stats:
+                s = compute_item_stats(c, self.item_id, src)
+                if s is not None:
+                    stats[src] = s
+        c.close()
+        rt_entry = gl.rt_prices_snapshot[self.item_id]
+        wiki = stats.get(0)
+
+        self._current_ge = None if wiki is None else wiki.price
         self._current_buy = min(rt_entry)
         self._current_sell = max(rt_entry)
-        self._current_avg = int(c.execute(
-            f"""SELECT AVG((SELECT price FROM "{table}"
-                            WHERE price > 0 AND src > 0
-                            ORDER BY timestamp DESC LIMIT 7)) """
-        ).fetchone())
-        self._avg_volume_day = int(c.execute(
-            f"""SELECT AVG(volume) FROM "{table}" WHERE src=0
-                            ORDER BY timestamp DESC LIMIT 7"""
-        ).fetchone())
+        recent = max([s for src, s in stats.items() if src > 0 and s.avg_price is not None], key=lambda s: s.t1,
+                     default=None)
+        self._current_avg = None if recent is None else int(recent.avg_price)
+        self._avg_volume_day = None if wiki is None or wiki.avg_volume is None else int(wiki.avg_volume)
         self._current_tax = min(5000000, int(math.floor(self._current_sell * 0.01)))
         self._margin = self._current_sell - self._current_buy
-        
-        sql_count = f"""SELECT COUNT(*) FROM "{table}" WHERE src=? """
-        self._n_wiki = c.execute(sql_count, (0, )).fetchone()
-        self._n_avg5m_b = c.execute(sql_count, (1, )).fetchone()
-        self._n_avg5m_s = c.execute(sql_count, (2, )).fetchone()
-        self._n_rt_b = c.execute(sql_count, (3, )).fetchone()
-        self._n_rt_s = c.execute(sql_count, (4, )).fetchone()
-        
+
+        n_rows = [0 if stats.get(src) is None else stats.get(src).n_rows for src in range(5)]
+        self._n_wiki, self._n_avg5m_b, self._n_avg5m_s, self._n_rt_b, self._n_rt_s = n_rows
+
         self._live_data_loaded = True
 
     @property
@@ -164,7 +164,7 @@ class Item(DbEntity):
     def death_coffer_profit(self) -> Optional[int]:
         """
         Difference between the active buy price and the death coffer price for this item. Is None if the guide price is
-        below 10000.
+        below 10000. The profit is read from the market scores of the ItemDb, which are computed for all items at once.
         
         Returns
         -------
@@ -174,10 +174,7 @@ class Item(DbEntity):
             If the guide price is below 10000, None is returned
 
         """
-        ge = self.current_ge
-        if ge < 10000:
-            return None
-        return int(self.current_ge*1.05) - self.current_buy
+        return go.itemdb.death_coffer_profit(self.item_id)
 
     @property
     def sqlite_path(self) -> str:
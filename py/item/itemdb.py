@@ -4,18 +4,26 @@ Module with an Item database manager.
 All functions regarding getting item data should be relayed via this class
 The ItemDb is instanced as Singleton; it can be imported by importing the itemdb variable from this module.
 Can also be used as "from itemdb import *"
+
+Item data is loaded lazily from the item catalog snapshot (see item.catalog) upon the first lookup. The snapshot is
+memory-mapped; the item table is only read if the snapshot is stale. Item instances are materialized from their rows
+when they are first requested. Realtime prices are not downloaded until they are needed.
 """
 import datetime
 import sqlite3
+import threading
 import time
 from dataclasses import dataclass
 from typing import Tuple, Dict, List
+import numpy as np
 from multipledispatch import dispatch
 
-from backend.download import realtime_prices
+from backend.item_stats import load_item_stats
 from file.file import File
 from global_variables import path as gp
 from global_variables.classes import SingletonMeta
+from backend.realtime_snapshot import death_coffer_min_price
+from item.catalog import ItemCatalog, load_item_catalog
 from item.item_entity import Item
 
 ITEM_DB_FILE: File = gp.f_db_item
@@ -26,26 +34,53 @@ class _ItemDb(metaclass=SingletonMeta):
     """Class for providing Item data. Can be called using ItemDb[item_id] or ItemDb[item_name] to get an Item"""
     _init_time: int or float
     _ids: Tuple[int, ...]
-    _items: Tuple[Item | None, ...]
-    _name_item: Dict[str, Item]
-    _nature_rune_price: Tuple[int, int]
+    _catalog: ItemCatalog | None
+    _items: List[Item | None]
+    _name_id: Dict[str, int]
+    _alch_values: np.ndarray | None
+    _ge_prices: np.ndarray | None
+    _ge_prices_time: float
+    _loaded: bool
     _table: str = "item"
     _most_traded_item_ids = 2, 314, 453, 554, 555, 556, 557, 560, 561, 561, 562, 565, 7936, 12934, 21820, 27616
     db_file: File = gp.f_db_local
-    _rt = realtime_prices()
+    _lock = threading.RLock()
+    ge_prices_ttl = 3600
+    """Seconds after which the guide prices are read from the item_stats table again"""
     
     def __init__(self):
-        t0 = time.time()
-        conn = sqlite3.connect(gp.f_db_local)
-        c = conn.cursor()
-        c.row_factory = lambda cursor, row: row[0]
-        
-        self._ids = tuple(c.execute("SELECT DISTINCT item_id FROM item").fetchall())
-        
-        c.row_factory = lambda cursor, row: Item(*row)
-        self._items = tuple([None if item_id not in self._ids else Item.create(item_id, c) for item_id in range(max(self._ids) + 1)])
-        self._name_item = {_i.item_name: _i for _i in self._items if _i is not None}
-        print(f"ItemDb was set up in {1000*(time.time()-t0):.0f}ms")
+        self._init_time = time.time()
+        self._ids, self._catalog, self._items, self._name_id = (), None, [], {}
+        self._alch_values = None
+        self._ge_prices, self._ge_prices_time = None, 0.0
+        self._loaded = False
+    
+    def _load(self):
+        """Load the item catalog; Items are materialized from its rows once they are requested"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            t0 = time.time()
+            catalog = load_item_catalog(ITEM_DB_FILE, ITEM_DB_TABLE, Item.sqlite_attributes.fget(Item))
+            self._catalog, self._ids = catalog, catalog.item_ids
+            self._items = [None for _ in range(max(self._ids) + 1)]
+            self._name_id = dict(zip(catalog.column('item_name'), catalog.column('item_id')))
+            self._init_time, self._loaded = time.time(), True
+            print(f"ItemDb was set up in {1000*(time.time()-t0):.0f}ms")
+    
+    def _item(self, item_id: int) -> Item | None:
+        """Return the Item of `item_id`, materialize it from its row if this is the first time it is requested"""
+        self._load()
+        if item_id < 0:
+            raise IndexError
+        item = self._items[item_id]
+        if item is None:
+            row = self._catalog.row(item_id)
+            if row is not None:
+                item = self._items[item_id] = Item(*row)
+        return item
     
     # def __init__(self):
     #     global ITEM_DB_FILE, ITEM_DB_TABLE
@@ -76,7 +111,7 @@ class _ItemDb(metaclass=SingletonMeta):
     @dispatch(int)
     def __getitem__(self, item: int) -> Item | None:
         try:
-            return self._items[item]
+            return self._item(item)
         except IndexError:
             return None
             # self._item_does_not_exist(item)
@@ -84,8 +119,8 @@ class _ItemDb(metaclass=SingletonMeta):
     @dispatch(str)
     def __getitem__(self, item: str) -> Item:
         try:
-            # print(self._name_item)
-            return self._name_item[item]
+            self._load()
+            return self._item(self._name_id[item])
         except KeyError:
             self._item_does_not_exist(item)
             
@@ -112,6 +147,7 @@ class _ItemDb(metaclass=SingletonMeta):
             global ITEM_DB_TABLE
             ITEM_DB_TABLE = kwargs['db_table']
         self.__init__()
+        self._load()
     
     @staticmethod
     def _item_does_not_exist(item: int or str):
@@ -130,8 +166,52 @@ class _ItemDb(metaclass=SingletonMeta):
     
     def high_alch_profit(self, item: int or str) -> int:
         """High alch profit of `item`, based on its HA value, current buy price and the nature rune buy price"""
-        item = self[item]
-        return item.alch_value - item.current_buy - min(self._nature_rune_price)
+        return int(self.market_scores()['alch_profit'][self[item].item_id])
+    
+    def death_coffer_profit(self, item: int or str) -> int | None:
+        """Death coffer profit of `item`, or None if its guide price is too low to offer it to the death coffer"""
+        item_id = self[item].item_id
+        ge_prices = self.ge_prices()
+        if item_id >= len(ge_prices) or ge_prices[item_id] < death_coffer_min_price:
+            return None
+        return int(self.market_scores()['death_coffer'][item_id])
+    
+    def alch_values(self) -> np.ndarray:
+        """High alch values of all items as an array indexed by item_id, read from the item catalog"""
+        self._load()
+        if self._alch_values is None:
+            alch_values = np.zeros(len(self._items), dtype=np.int64)
+            alch_values[self._catalog.records['item_id']] = self._catalog.records['alch_value']
+            alch_values.flags.writeable = False
+            self._alch_values = alch_values
+        return self._alch_values
+    
+    def ge_prices(self, refresh: bool = False) -> np.ndarray:
+        """
+        Guide prices of all items as an array indexed by item_id, read from the item_stats table in one query. The
+        prices are read again if they are older than `ge_prices_ttl` seconds, or if `refresh` is True.
+        """
+        self._load()
+        if self._ge_prices is None or refresh or time.time() - self._ge_prices_time > self.ge_prices_ttl:
+            ge_prices = np.zeros(len(self._items), dtype=np.int64)
+            con = sqlite3.connect(f"file:{gp.f_db_timeseries}?mode=ro", uri=True)
+            for item_id, stats in load_item_stats(con).items():
+                wiki = stats.get(0)
+                if wiki is not None and wiki.price is not None and item_id < len(ge_prices):
+                    ge_prices[item_id] = wiki.price
+            con.close()
+            ge_prices.flags.writeable = False
+            self._ge_prices, self._ge_prices_time = ge_prices, time.time()
+        return self._ge_prices
+    
+    def market_scores(self) -> np.ndarray:
+        """
+        Tax, margin, ROI, high alch profit and death coffer profit of all items, computed in one vectorized call from
+        the current realtime prices snapshot. The result is a structured array indexed by item_id; see
+        backend.realtime_snapshot.
+        """
+        from global_variables.local_file import rt_prices_snapshot
+        return rt_prices_snapshot.market_scores(self.alch_values(), self.ge_prices())
     
     def exists(self, item) -> bool:
         """Return True if `item` exists in the ItemDatabase"""
@@ -6,13 +6,18 @@ thus creating a backup as a much faster rate.
 The backup protocol listed here is useful for re-redesigning the database, though.
 All item data is exported to one file per source per item.
 
+The IncrementalBackup exports rows to compressed, append-only chunk files instead. Per item, per src, it keeps track of
+the rows that were backed up already, such that each backup only exports rows that were added since the previous one.
 
 """
 import pickle
 import sqlite3
 import threading
 from collections.abc import Iterable
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 
 from venv_auto_loader.active_venv import *
 import global_variables.osrs as go
@@ -20,8 +25,12 @@ import global_variables.path as gp
 import util.file as uf
 import util.sql as sql
 import util.str_formats as fmt
+from backend.ingest_journal import file_checksum
+from backend.npy_watermark import DirtyRangeTracker
 from file.file import File
 from common import Database
+from common.classes.database import sql_create_timeseries_item_table
+from common.classes.connection_pool import ConnectionPool
 from model.timeseries import TimeseriesDB
 __t0__ = time.perf_counter()
 
@@ -60,7 +69,8 @@ def async_extract_rows(db: str, item_ids: list, backup_dir: str = gp.dir_timeser
     """
     db = Database(db)
     if item_ids is None:
-        item_ids = [int(i[4:]) for i in sql.get_db_contents(c=db.cursor(), get_indices=False)[0] if i[:4] == 'item']
+        item_ids = [int(i[4:]) for i in sql.get_db_contents(c=db.cursor(), get_indices=False)[0]
+                    if len(i) == 9 and i[:4] == 'item' and i[4:].isdigit()]
     
     for item_idx, cur_id in enumerate(item_ids):
         select = f"SELECT * FROM 'item{cur_id:0>5}' WHERE src=?"
@@ -199,7 +209,7 @@ def backup_item_data(db: Database, item_id: int, srcs: Iterable, backup_director
                 path=f'{backup_directory}{src}/{item_id:0>5}.dat')
 
 
-def backup_db(db_file: File, backup_directory: str, n_threads: int = 4, item_ids: list = go.item_ids, srcs: Iterable = None,
+def backup_db(db_file: File, backup_directory: str, n_threads: int = 4, item_ids: list = None, srcs: Iterable = None,
               max_mtime: int = 86400, **kwargs):
     """ Create a pickled backup of the database at `db_file`. Export rows to `backup_directory`
     Parameters
@@ -219,6 +229,8 @@ def backup_db(db_file: File, backup_directory: str, n_threads: int = 4, item_ids
     -------
 
     """
+    if item_ids is None:
+        item_ids = go.item_ids
     db = Database(db_file, read_only=True, parse_tables=False)
     if srcs is None:
         srcs = db.execute("SELECT DISTINCT src FROM 'item00002'", factory=0).fetchall()
@@ -250,7 +262,9 @@ def backup_db(db_file: File, backup_directory: str, n_threads: int = 4, item_ids
         active_threads.append(t)
     
     for t in active_threads:
-        t.run()
+        t.start()
+    for t in active_threads:
+        t.join()
 
 
 def create_backup(db: str or TimeseriesDB = gp.f_db_timeseries, backup_directory: str = gp.dir_timeseries_backup,
@@ -292,7 +306,7 @@ def create_backup(db: str or TimeseriesDB = gp.f_db_timeseries, backup_directory
     if item_ids is None:
         item_ids = [int(i[4:]) for i in
                     list(sql.get_db_contents(c=db.cursor(), get_tables=True, get_indices=False)[0].keys()) if
-                    i[:4] == 'item']
+                    len(i) == 9 and i[:4] == 'item' and i[4:].isdigit()]
     
     threads = []
     for thread_id in range(n_threads + 1):
@@ -328,12 +342,22 @@ def restore_backup(db: TimeseriesDB, backup_dir: str = gp.dir_timeseries_backup,
     t1 : int, optional, None by default
         Upper bound timestamp; omit entries with a timestamp that exceed this value
     replace : bool, optional, True by default
-        If True, execute INSERT OR REPLACE instead of just INSERT, allowing rows to be overwritten.
+        If True, execute INSERT OR REPLACE instead of INSERT OR IGNORE, allowing rows to be overwritten.
+    
+    Notes
+    -----
+    Restored rows are registered via a DirtyRangeTracker, such that derived data of the affected items is updated.
         
     Returns
     -------
     List[tuple]
-        A list with failed attempts to submit data
+        A list with failed attempts to submit data; (404, src, item_id) for missing files and
+        (-1, src, item_id, n_rows) for rows that were not inserted
+
+    See Also
+    --------
+    restore_incremental_backup()
+        Restores an incremental backup using concurrent workers
 
     """
     if isinstance(db, str):
@@ -341,7 +365,8 @@ def restore_backup(db: TimeseriesDB, backup_dir: str = gp.dir_timeseries_backup,
     
     
     if item_ids is None:
-        item_ids = [int(i[4:]) for i in list(sql.get_db_contents(db.cursor(), get_tables=True, get_indices=False)[0].keys()) if i[:4] == 'item']
+        item_ids = [int(i[4:]) for i in list(sql.get_db_contents(db.cursor(), get_tables=True, get_indices=False)[0].keys())
+                    if len(i) == 9 and i[:4] == 'item' and i[4:].isdigit()]
     
     if srcs is None:
         srcs = db.execute('SELECT DISTINCT src, MAX(timestamp) FROM item00002', factory=0).fetchall()
@@ -356,30 +381,476 @@ def restore_backup(db: TimeseriesDB, backup_dir: str = gp.dir_timeseries_backup,
         def include_row(row):
             return t1 >= row[0] >= t0
         
-    failed = []
+    failed, con, dirty_ranges = [], db.write_con, DirtyRangeTracker()
+    prefix = "INSERT OR REPLACE INTO" if replace else "INSERT OR IGNORE INTO"
     for src in srcs:
         cd = backup_dir+f'{src}/'
         
         for item_id in item_ids:
-            
-            prefix = "INSERT OR REPLACE INTO" if replace else "INSERT INTO"
             sql_i = f"{prefix} 'item{item_id:0>5}'(src, timestamp, price, volume) VALUES ({src}, ?, ?, ?)"
 
             try:
-                rows = [el for el in uf.load(cd+f'{item_id:0>5}.dat') if include_row(el)]
+                # Rows are saved as (src, timestamp, price, volume) or as (timestamp, price, volume)
+                rows = sorted([r for r in (el[-3:] for el in uf.load(cd+f'{item_id:0>5}.dat')) if include_row(r)])
             except FileNotFoundError:
                 failed.append((404, src, item_id))
                 continue
-                
-            for row_id, row in enumerate(rows):
-                try:
-                    db.execute(sql_i, row)
-                except sqlite3.IntegrityError:
-                    failed.append((-1, src, item_id, row_id))
+            
+            n = con.executemany(sql_i, rows).rowcount
+            if n < len(rows):
+                failed.append((-1, src, item_id, len(rows) - n))
+            if n > 0:
+                dirty_ranges.add_range(item_id, src, rows[0][0], rows[-1][0])
+        dirty_ranges.flush(con)
+        con.commit()
+    con.close()
     return failed
     
 
-def export_rows_db_old(db_file: str, backup_dir: str, item_ids: list = go.item_ids):
+sql_create_backup_chunk: str = """CREATE TABLE IF NOT EXISTS "backup_chunk"(
+    "file" TEXT PRIMARY KEY,
+    "item_id" INTEGER NOT NULL,
+    "n_rows" INTEGER NOT NULL,
+    "checksum" TEXT NOT NULL,
+    "created" INTEGER NOT NULL)"""
+
+sql_create_backup_range: str = """CREATE TABLE IF NOT EXISTS "backup_range"(
+    "file" TEXT NOT NULL,
+    "item_id" INTEGER NOT NULL,
+    "src" INTEGER NOT NULL,
+    "t0" INTEGER NOT NULL,
+    "t1" INTEGER NOT NULL,
+    "n_rows" INTEGER NOT NULL,
+    PRIMARY KEY(file, src) )"""
+
+sql_create_backup_watermark: str = """CREATE TABLE IF NOT EXISTS "backup_watermark"(
+    "item_id" INTEGER NOT NULL,
+    "src" INTEGER NOT NULL,
+    "timestamp" INTEGER NOT NULL,
+    "n_rows" INTEGER NOT NULL,
+    "ts_sum" INTEGER NOT NULL,
+    "price_sum" INTEGER NOT NULL,
+    "volume_sum" INTEGER NOT NULL,
+    PRIMARY KEY(item_id, src) )"""
+
+sql_select_hwm: str = """SELECT item_id, src, timestamp, n_rows, ts_sum, price_sum, volume_sum FROM "backup_watermark" """
+
+
+class BackupChunk(NamedTuple):
+    """
+    Chunk file with the rows of one item that were exported during one backup
+
+    Attributes
+    ----------
+    file : str
+        Path to the chunk file, relative to the backup directory
+    item_id : int
+        The item_id of the rows in the chunk
+    n_rows : int
+        Amount of rows in the chunk
+    checksum : str
+        sha256 checksum of the chunk file
+    ranges : List[Tuple[int, int, int, int]]
+        (src, t0, t1, n_rows) per src in the chunk
+    watermarks : List[Tuple[int, int, int, int, int, int]]
+        (src, timestamp, n_rows, ts_sum, price_sum, volume_sum) per src in the chunk; the high-water mark and the
+        fingerprint of all rows of that src up to it after the chunk has been registered
+    """
+    file: str
+    item_id: int
+    n_rows: int
+    checksum: str
+    ranges: List[Tuple[int, int, int, int]]
+    watermarks: List[Tuple[int, int, int, int, int, int]]
+
+
+class BackupReport(NamedTuple):
+    """
+    Result of the verification of an incremental backup
+
+    Attributes
+    ----------
+    n_chunks : int
+        Amount of chunks listed in the manifest
+    n_rows : int
+        Amount of rows listed in the manifest
+    missing : List[str]
+        Chunk files listed in the manifest that do not exist
+    corrupted : List[str]
+        Chunk files of which the checksum or contents do not match the manifest
+    orphaned : List[str]
+        Chunk files that are not listed in the manifest, e.g. because a backup was interrupted
+    incomplete : List[Tuple[int, int]]
+        (item_id, src) pairs of which rows in the database up to the high-water mark are missing in the backup
+    """
+    n_chunks: int
+    n_rows: int
+    missing: List[str]
+    corrupted: List[str]
+    orphaned: List[str]
+    incomplete: List[Tuple[int, int]]
+
+    @property
+    def is_valid(self) -> bool:
+        """True if all chunks are present and intact and the backup covers the database up to its high-water marks"""
+        return len(self.missing) == len(self.corrupted) == len(self.incomplete) == 0
+
+
+def load_backup_chunk(path: str) -> np.ndarray:
+    """ Load the chunk file at `path` as an array with (src, timestamp, price, volume) rows """
+    with np.load(path, allow_pickle=False) as npz:
+        return np.column_stack([npz['src'], npz['timestamp'], npz['price'], npz['volume']])
+
+
+class IncrementalBackup:
+    """
+    Incremental backup of the timeseries database.
+    
+    Each backup exports the rows that were added to an item table since the previous backup to a compressed chunk file
+    (npz; src, timestamp, price and volume arrays). Chunk files are never modified after they have been written.
+    Chunks are registered in a sqlite manifest in the backup directory, after their file has been written. Per item,
+    per src, the manifest holds a high-water mark; the highest timestamp backed up, along with the fingerprint (row
+    count and the sums of the timestamp, price and volume columns) of all rows up to that timestamp.
+    
+    Rows are selected by (src, timestamp) rather than rowid, as sqlite may reuse or renumber rowids. Before exporting the
+    rows beyond the high-water mark, the fingerprint of the rows up to it is compared with the database. If it does not
+    match, rows were inserted with an older timestamp afterwards (e.g. data that was downloaded afterwards), replaced or
+    deleted, and all rows of that src are exported again. Upon restoring, rows of more recent chunks replace older ones.
+    Items are exported concurrently by a pool of worker threads, each with its own read-only connection.
+    
+    Examples
+    --------
+    backup = IncrementalBackup()
+    backup.run()
+    report = backup.verify()
+    """
+    manifest_file: str = 'backup_manifest.db'
+    
+    def __init__(self, db_file: str = gp.f_db_timeseries, backup_directory: str = gp.dir_timeseries_backup,
+                 n_workers: int = 4):
+        self.db_file = db_file
+        self.backup_directory = backup_directory if backup_directory.endswith('/') else backup_directory + '/'
+        self.chunk_directory = self.backup_directory + 'chunks/'
+        self.n_workers = n_workers
+        os.makedirs(self.chunk_directory, exist_ok=True)
+        
+        self.manifest = sqlite3.connect(self.backup_directory + self.manifest_file)
+        self.manifest.execute(sql_create_backup_chunk)
+        self.manifest.execute(sql_create_backup_range)
+        self.manifest.execute(sql_create_backup_watermark)
+        if 'rowid1' in [r[1] for r in self.manifest.execute("""PRAGMA table_info("backup_range")""")]:
+            # Ranges registered by rowid; drop the rowid columns. Items without watermarks are exported in full once.
+            self.manifest.execute("""ALTER TABLE "backup_range" RENAME TO "backup_range_rowid" """)
+            self.manifest.execute(sql_create_backup_range)
+            self.manifest.execute("""INSERT OR REPLACE INTO "backup_range"(file, item_id, src, t0, t1, n_rows)
+                                     SELECT file, item_id, src, t0, t1, n_rows FROM "backup_range_rowid" """)
+            self.manifest.execute("""DROP TABLE "backup_range_rowid" """)
+        self.manifest.commit()
+    
+    def high_water_marks(self) -> Dict[int, Dict[int, Tuple[int, int, int, int, int]]]:
+        """ Return the (timestamp, n_rows, ts_sum, price_sum, volume_sum) high-water marks per src, per item_id """
+        hwm = {}
+        for item_id, src, *watermark in self.manifest.execute(sql_select_hwm).fetchall():
+            hwm[item_id] = hwm.get(item_id, {})
+            hwm[item_id][src] = tuple(watermark)
+        return hwm
+    
+    def export_item(self, pool: ConnectionPool, item_id: int, hwm: Dict[int, Tuple[int, int, int, int, int]]) \
+            -> Optional[BackupChunk]:
+        """
+        Export the rows of `item_id` beyond high-water marks `hwm` to a new chunk file. If the fingerprint of the rows
+        of a src up to its high-water mark does not match, export all rows of that src instead. Return the chunk, or
+        None if there were no new rows.
+        """
+        con = pool.read_connection()
+        c = con.cursor()
+        c.row_factory = None
+        table = f'"item{item_id:0>5}"'
+        sql_select = f"""SELECT src, timestamp, price, volume FROM {table} WHERE src=? AND timestamp > ?
+                         ORDER BY timestamp"""
+        # SUM() is an exact integer, whereas TOTAL() is a float that cannot represent sums beyond 2^53 exactly
+        sql_fingerprint = f"""SELECT COUNT(*), COALESCE(SUM(timestamp), 0), COALESCE(SUM(price), 0),
+                              COALESCE(SUM(volume), 0) FROM {table} WHERE src=? AND timestamp <= ?"""
+        
+        # Fingerprints and rows are read within one transaction, such that they reflect the same state of the table
+        parts, watermarks = [], []
+        c.execute("BEGIN")
+        try:
+            for src in range(5):
+                watermark = hwm.get(src)
+                if watermark is not None and \
+                        tuple(c.execute(sql_fingerprint, (src, watermark[0])).fetchone()) == tuple(watermark[1:]):
+                    t1, fingerprint = watermark[0], watermark[1:]
+                else:
+                    t1, fingerprint = -1, (0, 0, 0, 0)
+                
+                rows = c.execute(sql_select, (src, t1)).fetchall()
+                if len(rows) == 0:
+                    continue
+                ar = np.array(rows, dtype=np.int64)
+                parts.append(ar)
+                watermarks.append((src, int(ar[-1, 1]), fingerprint[0] + len(ar),
+                                   *[int(f) + int(ar[:, col].sum()) for f, col in zip(fingerprint[1:], (1, 2, 3))]))
+        finally:
+            con.commit()
+        if len(parts) == 0:
+            return None
+        
+        ar = np.concatenate(parts)
+        ranges = [(int(p[0, 0]), int(p[0, 1]), int(p[-1, 1]), len(p)) for p in parts]
+        
+        file = f"chunks/{item_id:0>5}/{time.time_ns()}.npz"
+        path = self.backup_directory + file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, src=ar[:, 0], timestamp=ar[:, 1], price=ar[:, 2], volume=ar[:, 3])
+        os.replace(path + '.tmp', path)
+        return BackupChunk(file, item_id, len(ar), file_checksum(path), ranges, watermarks)
+    
+    def register(self, chunk: BackupChunk):
+        """ Register `chunk` in the manifest, update the high-water marks of its item and commit it """
+        self.manifest.execute("""INSERT INTO "backup_chunk"(file, item_id, n_rows, checksum, created)
+                                 VALUES (?, ?, ?, ?, ?)""",
+                              (chunk.file, chunk.item_id, chunk.n_rows, chunk.checksum, int(time.time())))
+        self.manifest.executemany("""INSERT INTO "backup_range"(file, item_id, src, t0, t1, n_rows)
+                                     VALUES (?, ?, ?, ?, ?, ?)""",
+                                  [(chunk.file, chunk.item_id, *r) for r in chunk.ranges])
+        self.manifest.executemany("""INSERT OR REPLACE INTO "backup_watermark"(item_id, src, timestamp, n_rows, ts_sum,
+                                     price_sum, volume_sum) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                  [(chunk.item_id, *w) for w in chunk.watermarks])
+        self.manifest.commit()
+    
+    def run(self, item_ids: Iterable[int] = None) -> int:
+        """
+        Export the new rows of `item_ids`, or of all item tables if `item_ids` is None, using `n_workers` concurrent
+        workers. Return the amount of rows that were exported.
+        """
+        pool = ConnectionPool(self.db_file)
+        if item_ids is None:
+            c = pool.read_connection().cursor()
+            c.row_factory = None
+            item_ids = [int(t[0][4:]) for t in c.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                        if len(t[0]) == 9 and t[0][:4] == 'item']
+        item_ids = list(item_ids)
+        hwm = self.high_water_marks()
+        start, n_rows = time.perf_counter(), 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix='IncrementalBackup') as executor:
+                futures = [executor.submit(self.export_item, pool, i, hwm.get(i, {})) for i in item_ids]
+                for idx, future in enumerate(as_completed(futures)):
+                    chunk = future.result()
+                    if chunk is not None:
+                        self.register(chunk)
+                        n_rows += chunk.n_rows
+                    print(f"\t[{fmt.passed_pc(start)}] Exported {n_rows} rows | {idx+1}/{len(futures)} items",
+                          end='\r')
+        finally:
+            pool.close()
+        print(f"\t[{fmt.passed_pc(start)}] Exported {n_rows} rows of {len(item_ids)} items" + ' ' * 20)
+        return n_rows
+    
+    def load_chunk(self, file: str) -> np.ndarray:
+        """ Load chunk `file` as an array with (src, timestamp, price, volume) rows """
+        return load_backup_chunk(self.backup_directory + file)
+    
+    def chunks(self, item_id: int = None) -> List[Tuple[str, int, int, str]]:
+        """ Return the (file, item_id, n_rows, checksum) of all chunks, or of `item_id` only, in order of creation """
+        if item_id is None:
+            return self.manifest.execute("""SELECT file, item_id, n_rows, checksum FROM "backup_chunk"
+                                            ORDER BY created, file""").fetchall()
+        return self.manifest.execute("""SELECT file, item_id, n_rows, checksum FROM "backup_chunk" WHERE item_id=?
+                                        ORDER BY created, file""", (item_id,)).fetchall()
+    
+    def verify(self, compare_db: bool = False, remove_orphans: bool = False) -> BackupReport:
+        """
+        Verify the backup; check if all chunk files exist, are intact and contain the rows listed in the manifest. If
+        `compare_db`, also check if all rows in the database up to the high-water marks are present in the backup. If
+        `remove_orphans`, remove chunk files that are not listed in the manifest.
+        """
+        chunks = self.chunks()
+        ranges = {}
+        for file, src, t0, t1, n in self.manifest.execute("""SELECT file, src, t0, t1, n_rows FROM "backup_range" """):
+            ranges[file] = ranges.get(file, []) + [(src, t0, t1, n)]
+        
+        missing, corrupted, listed, timestamps = [], [], set(), {}
+        for file, item_id, n_rows, checksum in chunks:
+            listed.add(file)
+            path = self.backup_directory + file
+            if not os.path.exists(path):
+                missing.append(file)
+                continue
+            try:
+                if file_checksum(path) != checksum:
+                    raise ValueError
+                ar = self.load_chunk(file)
+                if len(ar) != n_rows:
+                    raise ValueError
+                for src, t0, t1, n in ranges.get(file, []):
+                    ts = ar[ar[:, 0] == src, 1]
+                    if len(ts) != n or ts.min() < t0 or ts.max() > t1:
+                        raise ValueError
+                    if compare_db:
+                        timestamps[(item_id, src)] = timestamps.get((item_id, src), set()).union(ts.tolist())
+            except (ValueError, OSError, KeyError):
+                corrupted.append(file)
+        
+        orphaned = []
+        for d in os.listdir(self.chunk_directory):
+            if not os.path.isdir(self.chunk_directory + d):
+                continue
+            for f in os.listdir(self.chunk_directory + d):
+                if f"chunks/{d}/{f}" not in listed:
+                    orphaned.append(f"chunks/{d}/{f}")
+                    if remove_orphans:
+                        os.remove(self.chunk_directory + f"{d}/{f}")
+        
+        incomplete = []
+        if compare_db:
+            con = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True)
+            for item_id, src_hwm in self.high_water_marks().items():
+                for src, (t1, *_) in src_hwm.items():
+                    db_ts = con.execute(f"""SELECT timestamp FROM "item{item_id:0>5}" WHERE src=? AND timestamp <= ?""",
+                                        (src, t1)).fetchall()
+                    if not frozenset([r[0] for r in db_ts]).issubset(timestamps.get((item_id, src), set())):
+                        incomplete.append((item_id, src))
+            con.close()
+        return BackupReport(len(chunks), sum([c[2] for c in chunks]), missing, corrupted, orphaned, incomplete)
+    
+    def close(self):
+        """ Close the connection with the manifest """
+        self.manifest.close()
+
+
+def _restore_shard(backup_directory: str, shard_file: str, item_ids: List[int], batch_size: int) -> int:
+    """
+    Restore the chunks of `item_ids` into shard database `shard_file`. Executed by restore workers. Shard tables have no
+    primary key; rows are deduplicated and sorted by (src, timestamp) before they are inserted, such that the indexed
+    item tables can be filled with presorted rows afterwards. Return the amount of restored rows.
+    """
+    manifest = sqlite3.connect(f"file:{backup_directory}{IncrementalBackup.manifest_file}?mode=ro", uri=True)
+    con = sqlite3.connect(shard_file)
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    n_rows, n_batch = 0, 0
+    for item_id in item_ids:
+        files = manifest.execute("""SELECT file FROM "backup_chunk" WHERE item_id=? ORDER BY created, file""",
+                                 (item_id,)).fetchall()
+        if len(files) == 0:
+            continue
+        ar = np.concatenate([load_backup_chunk(backup_directory + f[0]) for f in files])
+        
+        # Sort by src, timestamp and order of backup, then keep the most recent version of each row
+        ar = ar[np.lexsort((np.arange(len(ar)), ar[:, 1], ar[:, 0]))]
+        ar = ar[np.r_[(ar[1:, 0] != ar[:-1, 0]) | (ar[1:, 1] != ar[:-1, 1]), True]]
+        
+        table = f'"item{item_id:0>5}"'
+        con.execute(f"""CREATE TABLE IF NOT EXISTS {table}(src INTEGER, timestamp INTEGER, price INTEGER,
+                        volume INTEGER)""")
+        con.executemany(f"""INSERT INTO {table} (src, timestamp, price, volume) VALUES (?, ?, ?, ?)""", ar.tolist())
+        n_rows += len(ar)
+        n_batch += len(ar)
+        if n_batch >= batch_size:
+            con.commit()
+            n_batch = 0
+    con.commit()
+    con.close()
+    manifest.close()
+    return n_rows
+
+
+def restore_incremental_backup(db_file: str = gp.f_db_timeseries, backup_directory: str = gp.dir_timeseries_backup,
+                               item_ids: Iterable[int] = None, n_workers: int = 4, batch_size: int = 1000000) -> int:
+    """
+    Restore the incremental backup in `backup_directory` into the timeseries database at `db_file`.
+    
+    Items are divided over `n_workers` worker processes, each of which restores its items into a separate shard database
+    without indices; index maintenance is deferred until all rows of an item are deduplicated and sorted. Afterwards,
+    each shard is attached to `db_file` and its rows are copied into the item tables. sqlite cannot add a primary key to
+    an existing table, so the item tables are created with their primary key and, if they did not exist yet, filled via
+    a plain INSERT of the rows sorted by primary key, such that both the table and its primary key index are built by
+    appending. Rows in the backup replace existing rows with the same src and timestamp in existing item tables.
+    The timestamp range of the restored rows per item, per src is registered via a DirtyRangeTracker, such that derived
+    data of the affected items is updated.
+    
+    Parameters
+    ----------
+    db_file : str, optional, global_variables.path.f_db_timeseries by default
+        Path to the database to restore the backup into. It is created if it does not exist.
+    backup_directory : str, optional, global_variables.path.dir_timeseries_backup by default
+        Directory of the incremental backup
+    item_ids : Iterable[int], optional, None by default
+        item_ids to restore. If undefined, restore all items in the backup.
+    n_workers : int, optional, 4 by default
+        Amount of worker processes and shard databases
+    batch_size : int, optional, 1000000 by default
+        Minimum amount of rows per transaction within a shard database
+
+    Returns
+    -------
+    int
+        The amount of restored rows
+    """
+    backup_directory = backup_directory if backup_directory.endswith('/') else backup_directory + '/'
+    if item_ids is None:
+        manifest = sqlite3.connect(f"file:{backup_directory}{IncrementalBackup.manifest_file}?mode=ro", uri=True)
+        item_ids = [r[0] for r in manifest.execute("""SELECT DISTINCT item_id FROM "backup_chunk" ORDER BY item_id""")]
+        manifest.close()
+    item_ids = list(item_ids)
+    start = time.perf_counter()
+    shards = []
+    for k in range(max(1, n_workers)):
+        shard_file = f"{db_file}.shard{k}"
+        if os.path.exists(shard_file):
+            os.remove(shard_file)
+        shards.append((shard_file, item_ids[k::max(1, n_workers)]))
+    
+    n_rows = 0
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_restore_shard, backup_directory, f, ids, batch_size) for f, ids in shards]
+            for future in as_completed(futures):
+                n_rows += future.result()
+                print(f"\t[{fmt.passed_pc(start)}] Restored {n_rows} rows into shards "
+                      f"({int(n_rows / max(time.perf_counter() - start, 1e-6))}/s)", end='\r')
+    else:
+        n_rows = _restore_shard(backup_directory, *shards[0], batch_size)
+    
+    con, dirty_ranges = sqlite3.connect(db_file), DirtyRangeTracker()
+    for shard_file, ids in shards:
+        con.execute("""ATTACH DATABASE ? AS shard""", (shard_file,))
+        c = con.cursor()
+        c.row_factory = None
+        shard_tables = {r[0] for r in c.execute("SELECT name FROM shard.sqlite_master WHERE type='table'")}
+        main_tables = {r[0] for r in c.execute("SELECT name FROM main.sqlite_master WHERE type='table'")}
+        for item_id in ids:
+            table = f'item{item_id:0>5}'
+            if table not in shard_tables:
+                continue
+            if table in main_tables:
+                con.execute(f"""INSERT OR REPLACE INTO main."{table}" (src, timestamp, price, volume)
+                                SELECT src, timestamp, price, volume FROM shard."{table}" """)
+            else:
+                con.execute(sql_create_timeseries_item_table(item_id, check_exists=False))
+                con.execute(f"""INSERT INTO main."{table}" (src, timestamp, price, volume)
+                                SELECT src, timestamp, price, volume FROM shard."{table}" ORDER BY src, timestamp""")
+            for src, t0, t1 in c.execute(f"""SELECT src, MIN(timestamp), MAX(timestamp) FROM shard."{table}"
+                                             GROUP BY src""").fetchall():
+                dirty_ranges.add_range(item_id, src, t0, t1)
+        dirty_ranges.flush(con)
+        con.commit()
+        con.execute("""DETACH DATABASE shard""")
+        os.remove(shard_file)
+    con.close()
+    
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    print(f"\t[{fmt.passed_pc(start)}] Restored {n_rows} rows of {len(item_ids)} items ({int(n_rows / elapsed)}/s)"
+          + ' ' * 20)
+    return n_rows
+
+
+def export_rows_db_old(db_file: str, backup_dir: str, item_ids: list = None):
+    if item_ids is None:
+        item_ids = go.item_ids
     # print(l)
     # i = 1335
     ars = [[], [], [], []]
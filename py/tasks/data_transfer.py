@@ -12,7 +12,8 @@ These steps are implemented below. They are typically combined and executed via
 """
 import datetime
 import sqlite3
-from typing import List
+from collections.abc import Iterable
+from typing import Dict, List, Set, Tuple
 
 import pandas as pd
 
@@ -24,10 +25,11 @@ import sqlite.executable
 import sqlite.row_factories
 import util.file as uf
 import util.str_formats as fmt
+from backend.ingest_journal import IngestJournal, file_checksum
+from backend.npy_watermark import DirtyRangeTracker
 from common.classes.database import sql_create_timeseries_item_table, ROConn
 from common.item import Item, augment_itemdb_entry
 # from common.classes.database import ROConn
-from model.timeseries import sql_timeseries_insert
 from sqlite.row_factories import factory_idx0, factory_dict
 from util.logger import prt
 
@@ -96,8 +98,8 @@ def transfer_rbpi_db_files(dir_from: str = gp.dir_rbpi_dat, dir_to: str = gp.dir
     return copied_files, to_remove
 
 
-def transfer_rbpi_db_exports(dir_from: str = gp.dir_rbpi_exports, dir_to: str = gp.dir_temp) \
-        -> Tuple[List[ROConn], List[str], List[int]]:
+def transfer_rbpi_db_exports(dir_from: str = gp.dir_rbpi_exports, dir_to: str = gp.dir_temp,
+                             exclude: Iterable[str] = ()) -> Tuple[List[ROConn], List[str], List[int]]:
     """
     Iterate over db files in `dir_from` that are deemed to be valid exports, given the path. Copy the files to `dir_to`
     and save a read-only connection with each db file. While establishing connections, also compile a list of unique
@@ -111,6 +113,8 @@ def transfer_rbpi_db_exports(dir_from: str = gp.dir_rbpi_exports, dir_to: str =
         Source dir that is to be parsed for db files
     dir_to : str, optional, global_variables.path.dir_temp by default
         Destination dir in which the db files are copied to
+    exclude : Iterable[str], optional, () by default
+        Names of db files in `dir_from` that should not be copied, e.g. exports that have already been merged
     
     Returns
     -------
@@ -127,8 +131,9 @@ def transfer_rbpi_db_exports(dir_from: str = gp.dir_rbpi_exports, dir_to: str =
     sql_items = "SELECT DISTINCT item_id FROM timeseries"
     small_batch_log = gp.f_small_batch_log.load() if gp.f_small_batch_log.exists() else []
     connections, to_remove, item_ids = [], [], None
+    exclude = frozenset(exclude)
     for b in gp.get_files(src=dir_from):
-        if is_invalid_export(b):
+        if is_invalid_export(b) or b in exclude:
             continue
         from_file = dir_from + b
         try:
@@ -152,10 +157,166 @@ def transfer_rbpi_db_exports(dir_from: str = gp.dir_rbpi_exports, dir_to: str =
     return connections, to_remove, item_ids if item_ids is not None else go.item_ids
 
 
-def timeseries_transfer_merged(path: str = gp.f_db_timeseries, start_time: int or float = time.perf_counter()):
-    """ Transfer exported rbpi batches, then extracted rows from rbpi sqlite dbs """
-    global small_batch_log
-    timeseries_exe_start, size_ = time.perf_counter(), os.path.getsize(path)
+def get_timeseries_tables(con: sqlite3.Connection) -> Set[int]:
+    """ Return the item_ids of all item tables in the timeseries database connected to via `con` """
+    c = con.cursor()
+    c.row_factory = factory_idx0
+    return {int(t[4:]) for t in c.execute("""SELECT name FROM sqlite_master WHERE type='table'""").fetchall()
+            if len(t) == 9 and t.startswith('item')}
+
+
+def insert_timeseries_rows(con: sqlite3.Connection, rows: Iterable[Tuple[int, int, int, int, int]],
+                           dirty_ranges: DirtyRangeTracker = None, tables: Set[int] = None) \
+        -> Tuple[List[int], List[int], List[int]]:
+    """
+    Insert timeseries `rows` into the timeseries database connected to via `con`. Rows are grouped per item table and
+    src, missing item tables are created up front and each group is inserted via one INSERT OR IGNORE executemany call.
+    Changes are not committed, such that a batch of rows can be committed as one transaction.
+    
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the timeseries database
+    rows : Iterable[Tuple[int, int, int, int, int]]
+        Rows formatted as (item_id, src, timestamp, price, volume)
+    dirty_ranges : DirtyRangeTracker, optional, None by default
+        If passed, register the timestamp range of each group of which one or more rows were inserted
+    tables : Set[int], optional, None by default
+        item_ids of the tables that exist in the database. Tables that are created are added to it. If undefined, the
+        tables are fetched from the database.
+
+    Returns
+    -------
+    List[int]
+        The amount of inserted rows per src
+    List[int]
+        The amount of ignored rows per src, i.e. rows that already existed or rows that violated a constraint
+    List[int]
+        item_ids of the tables that were created
+    """
+    grouped: Dict[Tuple[int, int], List[tuple]] = {}
+    for r in rows:
+        group = grouped.get(r[:2])
+        if group is None:
+            group = grouped[r[:2]] = []
+        group.append(r[2:])
+    
+    if tables is None:
+        tables = get_timeseries_tables(con)
+    created = sorted(frozenset([k[0] for k in grouped.keys()]).difference(tables))
+    for item_id in created:
+        con.execute(sql_create_timeseries_item_table(item_id=item_id, check_exists=True))
+        tables.add(item_id)
+    
+    inserted, ignored = [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]
+    for (item_id, src), group in grouped.items():
+        n = con.executemany(f"""INSERT OR IGNORE INTO "item{item_id:0>5}" (src, timestamp, price, volume)
+                                VALUES ({src}, ?, ?, ?)""", group).rowcount
+        inserted[src] += n
+        ignored[src] += len(group) - n
+        if n > 0 and dirty_ranges is not None:
+            timestamps = [g[0] for g in group]
+            dirty_ranges.add_range(item_id, src, min(timestamps), max(timestamps))
+    return inserted, ignored, created
+
+
+def merge_export_db(con: sqlite3.Connection, export_path: str, dirty_ranges: DirtyRangeTracker = None,
+                    tables: Set[int] = None, journal: IngestJournal = None, journal_key: str = None,
+                    commit_rows: int = 1000000) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Merge the timeseries rows of the export database at `export_path` into the timeseries database connected to via
+    `con`. The export is attached to `con` and its rows are inserted per item table and src with INSERT OR IGNORE ...
+    SELECT statements, so rows are moved by sqlite without being fetched.
+    Items are merged in ascending item_id order. Changes are committed once at least `commit_rows` rows were merged and
+    once all rows were merged, but only after all rows of an item were merged. If a journal is passed, each commit
+    includes the progress of the export and rows of items that were committed already are skipped.
+    
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the timeseries database. Should not have uncommitted changes.
+    export_path : str
+        Path to the export database with the 'timeseries' table
+    dirty_ranges : DirtyRangeTracker, optional, None by default
+        If passed, register the timestamp range of each item and src of which one or more rows were inserted
+    tables : Set[int], optional, None by default
+        item_ids of the tables that exist in the database. Tables that are created are added to it.
+    journal : IngestJournal, optional, None by default
+        Journal in which the progress is registered. The export should have been registered in it as `journal_key`.
+    journal_key : str, optional, None by default
+        Name under which the export was registered in `journal`
+    commit_rows : int, optional, 1000000 by default
+        Minimum amount of rows merged per commit
+
+    Returns
+    -------
+    List[int]
+        The amount of inserted rows per src
+    List[int]
+        The amount of ignored rows per src, i.e. rows that already existed or rows that violated a constraint
+    List[int]
+        item_ids of the tables that were created
+    """
+    if tables is None:
+        tables = get_timeseries_tables(con)
+    if journal is not None:
+        entry = journal.entry(journal_key)
+        if entry is None:
+            raise ValueError(f"Export {journal_key} has not been registered in the ingest journal")
+        progress = entry.progress
+    else:
+        progress = -1
+    
+    inserted, ignored, created = [0, 0, 0, 0, 0], [0, 0, 0, 0, 0], []
+    con.execute("""ATTACH DATABASE ? AS batch""", (export_path,))
+    try:
+        # The export is staged in an indexed temp table, as export tables are not indexed by item_id
+        con.execute("""DROP TABLE IF EXISTS temp.merge_rows""")
+        con.execute(f"""CREATE TEMP TABLE merge_rows AS SELECT item_id, src, timestamp, price, volume
+                        FROM batch.timeseries WHERE item_id > ? AND item_id NOT IN {go.timeseries_skip_ids}""",
+                    (progress,))
+        con.execute("""CREATE INDEX temp.merge_rows_idx ON merge_rows(item_id, src)""")
+        groups = con.execute("""SELECT item_id, src, COUNT(*), MIN(timestamp), MAX(timestamp) FROM temp.merge_rows
+                                GROUP BY item_id, src ORDER BY item_id, src""").fetchall()
+        
+        created = sorted(frozenset([g[0] for g in groups]).difference(tables))
+        for item_id in created:
+            con.execute(sql_create_timeseries_item_table(item_id=item_id, check_exists=True))
+            tables.add(item_id)
+        
+        def commit(item_id: int, completed: bool):
+            if dirty_ranges is not None:
+                dirty_ranges.flush(con)
+            if journal is not None:
+                journal.update_progress(journal_key, item_id, n_rows, n_inserted, completed)
+            con.commit()
+        
+        n_rows, n_inserted = 0, 0
+        for idx, (item_id, src, n_group, t0, t1) in enumerate(groups):
+            n = con.execute(f"""INSERT OR IGNORE INTO "item{item_id:0>5}" (src, timestamp, price, volume)
+                                SELECT src, timestamp, price, volume FROM temp.merge_rows
+                                WHERE item_id=? AND src=?""", (item_id, src)).rowcount
+            inserted[src] += n
+            ignored[src] += n_group - n
+            n_rows, n_inserted = n_rows + n_group, n_inserted + n
+            if n > 0 and dirty_ranges is not None:
+                dirty_ranges.add_range(item_id, src, t0, t1)
+            
+            if n_rows >= commit_rows and idx + 1 < len(groups) and groups[idx+1][0] != item_id:
+                commit(item_id, False)
+                n_rows, n_inserted = 0, 0
+        commit(groups[-1][0] if len(groups) > 0 else progress, True)
+    except BaseException as e:
+        con.rollback()
+        raise e
+    finally:
+        con.execute("""DROP TABLE IF EXISTS temp.merge_rows""")
+        con.execute("""DETACH DATABASE batch""")
+    return inserted, ignored, created
+
+
+def await_rbpi_export():
+    """ Make sure no rbpi batch is being exported while the exports are transferred. Exit or wait if one is. """
     if 60 < time.time() % 86400 < 240:
         print(' *** A batch is about to be added, rerun the script in 5 minutes ***')
         _ = input('Press ENTER to close')
@@ -165,6 +326,86 @@ def timeseries_transfer_merged(path: str = gp.f_db_timeseries, start_time: int o
         while time.time() < max_time:
             time.sleep(1.0)
             print(f'Sleeping for {max_time-time.time():.1f}s...', end='\r')
+
+
+def stage_export(from_file: str, to_file: str, journal: IngestJournal) -> bool:
+    """
+    Register export `from_file` in `journal` and make sure an identical copy of it exists at `to_file`. An existing copy
+    is reused if its checksum matches. Return False if the export was modified while it was being staged, e.g. because
+    it is still being written, True otherwise.
+    """
+    stat = os.stat(from_file)
+    checksum = file_checksum(from_file)
+    stat_after = os.stat(from_file)
+    if (stat.st_size, stat.st_mtime_ns) != (stat_after.st_size, stat_after.st_mtime_ns):
+        return False
+    entry = journal.register(os.path.split(from_file)[-1], checksum, stat.st_size)
+    if entry.completed or (os.path.exists(to_file) and file_checksum(to_file) == checksum):
+        return True
+    print('Copying', os.path.split(from_file)[-1], os.path.split(to_file)[-1], end='\r')
+    shutil.copy2(from_file, to_file)
+    return file_checksum(to_file) == checksum
+
+
+def timeseries_merge_attached(path: str = gp.f_db_timeseries, start_time: int or float = time.perf_counter(),
+                              dir_from: str = gp.dir_rbpi_exports, dir_to: str = gp.dir_temp):
+    """
+    Merge exported rbpi batches, then rows from the rbpi timeseries db, by attaching each db file to the timeseries
+    database (see merge_export_db). Exports are tracked in the ingest journal; an interrupted merge resumes where it
+    stopped and exports that were merged completely are not merged again. Exports that are modified while they are
+    being staged are skipped and merged during a subsequent transfer. The rbpi timeseries db is not staged, as it is
+    merged without being journaled; instead, it is only attached outside the time windows in which the rbpi writes it.
+    """
+    size_ = os.path.getsize(path)
+    con_to = sqlite3.connect(path)
+    journal = IngestJournal(con_to)
+    dirty_ranges = DirtyRangeTracker()
+    tables = get_timeseries_tables(con_to)
+    success, skipped = [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]
+    
+    exports = [b for b in gp.get_files(src=dir_from) if not is_invalid_export(b)]
+    for idx, b in enumerate(exports + [None]):
+        if b is None:
+            await_rbpi_export()
+            export_path, journal_key = gp.dir_rbpi_dat + 'timeseries.db', None
+        else:
+            export_path, journal_key = dir_to + b, b
+            if not stage_export(dir_from + b, export_path, journal):
+                prt(f'[{idx+1}] Skipping {b}, as it was modified while it was being staged')
+                continue
+            entry = journal.entry(b)
+            if entry.progress > -1 and not entry.completed:
+                prt(f'[{idx+1}] Resuming {b} after item_id={entry.progress}')
+        
+        if journal_key is None or not journal.entry(journal_key).completed:
+            prt(f'Current file: {export_path}' + ' ' * 10, end='\r')
+            b_success, b_skipped, created = merge_export_db(con_to, export_path, dirty_ranges, tables,
+                                                            None if journal_key is None else journal, journal_key)
+            for item_id in created:
+                prt(f" * Created table 'item{item_id:0>5}'")
+            success = [n + b_n for n, b_n in zip(success, b_success)]
+            skipped = [n + b_n for n, b_n in zip(skipped, b_skipped)]
+            prt(f'[{idx+1}] {export_path}: ins={b_success} / dup={b_skipped} | '
+                f'Total: insert={sum(b_success)} duplicate={sum(b_skipped)} sum={sum(b_skipped)+sum(b_success)}')
+        
+        if journal_key is not None:
+            for f in (export_path, dir_from + b):
+                if os.path.exists(f):
+                    os.remove(f)
+            print(f"\t\tDeleted src file {dir_from + b}")
+    con_to.close()
+    
+    print('\t************************************************************************************\n'
+          f'\tTotal insertions: {success} | Total duplicates: {skipped}\n'
+          f'\tDB size: +{fmt.fsize(os.path.getsize(path)-size_)} | '
+          f'Runtime: {fmt.delta_t(time.perf_counter()-start_time)}\n')
+
+
+def timeseries_transfer_merged(path: str = gp.f_db_timeseries, start_time: int or float = time.perf_counter()):
+    """ Transfer exported rbpi batches, then extracted rows from rbpi sqlite dbs """
+    global small_batch_log
+    timeseries_exe_start, size_ = time.perf_counter(), os.path.getsize(path)
+    await_rbpi_export()
     # copied_files, to_remove = transfer_rbpi_db_files()
     copied_files, to_remove, item_ids = transfer_rbpi_db_exports()
     copied_files.append(None)
@@ -172,6 +413,8 @@ def timeseries_transfer_merged(path: str = gp.f_db_timeseries, start_time: int o
     # to_remove
     
     con_to = sqlite3.connect(path)
+    dirty_ranges = DirtyRangeTracker()
+    tables = get_timeseries_tables(con_to)
     success, skipped = [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]
     item_ids.sort()
     transfer_start = time.perf_counter()
@@ -180,33 +423,20 @@ def timeseries_transfer_merged(path: str = gp.f_db_timeseries, start_time: int o
         prt(f'Current file: {cur.file}' + ' ' * 10, end='\r')
         
     for idx, b in enumerate(copied_files):
-        b_success, b_skipped = [0, 0, 0, 0, 0], [0, 0, 0, 0, 0]
         if b is None:
             b = ROConn(gp.dir_rbpi_dat + 'timeseries.db', allow_wcon=True)
         print_current_file(b)
-        # for r in con_from.execute(f"""SELECT item_id, src, timestamp, price, volume FROM 'timeseries'
-        #                        WHERE item_id NOT IN {go.timeseries_skip_ids} AND timestamp < ?""", max_ts).fetchall():
-        for r in b.con.execute(f"""SELECT item_id, src, timestamp, price, volume FROM 'timeseries' WHERE item_id NOT IN {go.timeseries_skip_ids}""").fetchall():
-            src = r[1]
-            sql_insert = sql_timeseries_insert(item_id=r[0], replace=False)
-            try:
-                con_to.execute(sql_insert, r[1:])
-                b_success[src] += 1
-                success[src] += 1
-            except sqlite3.IntegrityError:
-                b_skipped[src] += 1
-                skipped[src] += 1
-            except sqlite3.OperationalError as e:
-                if 'no such table: item' in str(e):
-                    con_to.execute(sql_create_timeseries_item_table(item_id=r[0], check_exists=False))
-                    prt(f" * Created table 'item{r[0]:0>5}'")
-                    print_current_file(b)
-                    con_to.execute(sql_insert, r[1:])
-                else:
-                    raise e
+        rows = b.con.execute(f"""SELECT item_id, src, timestamp, price, volume FROM 'timeseries'
+                                 WHERE item_id NOT IN {go.timeseries_skip_ids}""").fetchall()
+        b_success, b_skipped, created = insert_timeseries_rows(con_to, rows, dirty_ranges, tables)
+        for item_id in created:
+            prt(f" * Created table 'item{item_id:0>5}'")
+        success = [n + b_n for n, b_n in zip(success, b_success)]
+        skipped = [n + b_n for n, b_n in zip(skipped, b_skipped)]
+        dirty_ranges.flush(con_to)
         con_to.commit()
-        prt(f'[{idx+1}] {b.file}: ins={b_success} / skip={b_skipped} | '
-              f'Total: insert={sum(b_success)} skip={sum(b_skipped)} sum={sum(b_skipped)+sum(b_success)}')
+        prt(f'[{idx+1}] {b.file}: ins={b_success} / dup={b_skipped} | '
+              f'Total: insert={sum(b_success)} duplicate={sum(b_skipped)} sum={sum(b_skipped)+sum(b_success)}')
         b.con.close()
         
         if b.file[-13:] != 'timeseries.db':
@@ -223,7 +453,7 @@ def timeseries_transfer_merged(path: str = gp.f_db_timeseries, start_time: int o
     # gp.f_small_batch_log.save(small_batch_log)
 
     print('\t************************************************************************************\n'
-          f'\tTotal insertions: {success} | Total skips: {skipped}\n'
+          f'\tTotal insertions: {success} | Total duplicates: {skipped}\n'
           f'\tDB size: +{fmt.fsize(os.path.getsize(path)-size_)} | '
           f'Runtime: {fmt.delta_t(time.perf_counter()-start_time)}\n')
 
@@ -286,24 +516,23 @@ def timeseries_transfer_new():
             
             try:
                 db = sqlite3.connect(gp.f_db_timeseries)
-                con = sqlite3.connect(gp.dir_temp+b)
-                for row in con.execute('SELECT item_id, src, timestamp, price, volume FROM timeseries').fetchall():
-                    if row[0] in go.timeseries_skip_ids:
-                        continue
-                    try:
-                        db.execute(f"""INSERT INTO "item{row[0]:0>5}" (src, timestamp, price, volume) VALUES
-                                (?, ?, ?, ?)""", row[1:])
-                        success += 1
-                    except sqlite3.IntegrityError:
-                        n_i += 1
-                    except sqlite3.Error as e:
-                        n_e += 1
-                        failed_insertions += 1
-                        print(n_e, b, e)
-                db.commit()
+                journal = IngestJournal(db)
+                if journal.register(b, file_checksum(gp.dir_temp+b), os.path.getsize(gp.dir_temp+b)).completed:
+                    db.close()
+                    print(f'Removing previously merged batch {b}')
+                    to_remove.append(gp.dir_temp+b)
+                    continue
+                try:
+                    b_success, b_skipped, _ = merge_export_db(db, gp.dir_temp+b, DirtyRangeTracker(), journal=journal,
+                                                              journal_key=b)
+                    n, n_i = sum(b_success) + sum(b_skipped), sum(b_skipped)
+                    success += sum(b_success)
+                except sqlite3.Error as e:
+                    n_e += 1
+                    failed_insertions += 1
+                    print(n_e, b, e)
                 db.close()
                 if large_batch and b[6:9].isdigit():
-                    batches.remove(b)
                     if n_e == 0:
                         print(f'Removing batch {b} ({n} rows extracted / {n_e} failed / {n_i} skipped)')
                         to_remove.append(gp.dir_temp+b)
@@ -1,42 +1,109 @@
+"""
+Module for extending the avg5m corrections database with placeholder rows.
+
+For each item, a placeholder row (price=0, volume=0) is inserted for both avg5m sources (src=1, src=2) for every
+5-minute timestamp between the start of the item and the upper bound timestamp, unless a row already exists for that
+timestamp. The timestamp series is generated by a recursive CTE, such that all placeholders of an item are inserted
+with one INSERT OR IGNORE ... SELECT statement within one transaction per item.
+"""
 import sqlite3
 import time
 
 from venv_auto_loader.active_venv import *
 import global_variables.path as gp
 import global_variables.osrs as go
+import util.str_formats as fmt
 import util.unix_time as ut
 
 __t0__ = time.perf_counter()
 
-db = sqlite3.connect(database=f"{gp.dir_data}/avg5m_correction/avg5m_correction.db", uri=True)
+f_db_avg5m_correction: str = f"{gp.dir_data}/avg5m_correction/avg5m_correction.db"
+
+sql_placeholder_series: str = """WITH RECURSIVE series(timestamp) AS (
+    SELECT :t0 UNION ALL SELECT timestamp+300 FROM series WHERE timestamp+300 <= :t1)
+    SELECT src.value AS src, series.timestamp AS timestamp, 0 AS price, 0 AS volume
+    FROM series, (SELECT 1 AS value UNION ALL SELECT 2) AS src"""
+
+
+def placeholder_start(con: sqlite3.Connection, item_id: int, release_date: int = None) -> int:
+    """
+    Return the first timestamp for which placeholders are generated for `item_id`; the most recent of its release date
+    and its oldest correction, or its release date if it has no corrections.
+    """
+    ts = con.execute(f"""SELECT MIN(timestamp) FROM "item{item_id:0>5}" """).fetchone()[0]
+    if release_date is None:
+        return ts
+    return release_date if ts is None else max(release_date, ts)
+
+
+def extend_item_corrections(con: sqlite3.Connection, item_id: int, t0: int, t1: int, dry_run: bool = False) -> int:
+    """
+    Insert placeholder rows for both avg5m sources of `item_id` for each 5-minute step from `t0` up to and including
+    `t1`, skipping timestamps that already have a row. All rows are inserted in one transaction, which is committed.
 
-item_ids = []
-unique_ids = []
-for i in range(30000):
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the avg5m corrections database
+    item_id : int
+        The item_id of the table that is extended
+    t0 : int
+        First timestamp of the series
+    t1 : int
+        Upper bound timestamp of the series
+    dry_run : bool, optional, False by default
+        If True, count the rows that would be inserted without inserting them
+
+    Returns
+    -------
+    int
+        Amount of placeholder rows that were (or would be) inserted
+    """
+    if t0 is None or t0 > t1:
+        return 0
+    table = f'"item{item_id:0>5}"'
+    parameters = {'t0': int(t0), 't1': int(t1)}
+    if dry_run:
+        return con.execute(f"""SELECT COUNT(*) FROM ({sql_placeholder_series}) AS p
+                               WHERE NOT EXISTS (SELECT 1 FROM {table} AS t
+                                                 WHERE t.src=p.src AND t.timestamp=p.timestamp)""",
+                           parameters).fetchone()[0]
     try:
-        item_ids.append(go.itemdb.get(i).get('release_date'))
-        unique_ids.append(i)
-    except AttributeError:
-        item_ids.append(None)
-    
+        n = con.execute(f"""INSERT OR IGNORE INTO {table}(src, timestamp, price, volume) {sql_placeholder_series}""",
+                        parameters).rowcount
+    except BaseException as e:
+        con.rollback()
+        raise e
+    con.commit()
+    return n
+
+
+def extend_avg5m_corrections(db_file: str = f_db_avg5m_correction, max_ts: int = None, dry_run: bool = False) -> int:
+    """
+    Extend the avg5m corrections of all items up to `max_ts`, which is one week ago by default. If `dry_run` is True,
+    only count the placeholder rows that would be inserted. Return the amount of placeholder rows.
+    """
+    con = sqlite3.connect(database=db_file)
+    max_ts = int(time.time() // 300 * 300 - 86400*7) if max_ts is None else max_ts
+    start, n_total = time.perf_counter(), 0
+    try:
+        for i in range(30000):
+            try:
+                release_date = go.itemdb.get(i).get('release_date')
+            except AttributeError:
+                continue
+            try:
+                n_total += extend_item_corrections(con, i, placeholder_start(con, i, release_date), max_ts, dry_run)
+            except sqlite3.OperationalError as e:
+                if 'no such table' not in str(e):
+                    raise e
+            print(f"\t[{fmt.passed_pc(start)}] item_id={i} | Placeholders: {n_total}", end='\r')
+    finally:
+        con.close()
+    print(f"\n\t{'Counted' if dry_run else 'Inserted'} {n_total} placeholder rows up to {ut.loc_unix_dt(max_ts)} "
+          f"in {fmt.passed_pc(start)}")
+    return n_total
+
 
 if __name__ == '__main__':
-    db.row_factory = lambda c, row: row[0]
-    max_ts = time.time() // 300 * 300 - 86400*7
-    for idx, i in enumerate(unique_ids):
-        table = f"item{i:0>5}"
-        try:
-            ts = max(item_ids[i], db.execute(f"""SELECT MIN(timestamp) FROM {table}""").fetchone())
-        except TypeError:
-            ts = item_ids[i]
-        
-        print(idx, i, end='\r')
-        while ts <= max_ts:
-            for src in (1, 2):
-                try:
-                    db.execute(f"""INSERT INTO {table}(src, timestamp, price, volume) VALUES (?, ?, 0, 0)""", (src, ts))
-                except sqlite3.IntegrityError:
-                    ...
-            ts += 300
-        db.commit()
-    
\ No newline at end of file
+    extend_avg5m_corrections()
@@ -1,11 +1,22 @@
 """
 Executable module that is used to fill prices from src=1, 2 that are 0 for some reason.
 
+Timestamps that are to be filled are taken from the avg5m_gaps table in the timeseries database. This table lists the
+5-minute buckets at which one or more reference items have no avg5m price (n_items), or a buy or sell price of 0
+(n_zero), along with the amount of items affected. It is maintained incrementally via update_avg5m_gaps(); per
+reference item, the most recent avg5m timestamp that was scanned is kept and subsequent updates only recompute the
+buckets beyond the oldest of these timestamps.
+
+Gap timestamps and zero price timestamps are downloaded via the queue of the avg5m backfill downloader (see
+backend.avg5m_backfill), which keeps track of the progress made in the timeseries database.
+
 """
 
 import sqlite3
 from collections.abc import Iterable
+from typing import Dict, List, Tuple
 
+import numpy as np
 
 
 from venv_auto_loader.active_venv import *
@@ -13,8 +24,6 @@ import backend.download as dl
 import global_variables.osrs as go
 import global_variables.path as gp
 import global_variables.values as val
-import util.array as u_ar
-import util.file as uf
 import util.str_formats as fmt
 from file.file import File
 from common import SRC
@@ -31,140 +40,231 @@ t_commit = time.perf_counter()
 commit_frequency = 20
 avg5m_srcs = SRC.by_source('avg5m', return_attribute='src_id')
 
+sql_create_avg5m_gaps: str = """CREATE TABLE IF NOT EXISTS "avg5m_gaps"(
+    "timestamp" INTEGER PRIMARY KEY,
+    "n_items" INTEGER NOT NULL,
+    "n_zero" INTEGER NOT NULL)"""
+
+sql_create_avg5m_gaps_index: str = """CREATE INDEX IF NOT EXISTS "avg5m_gaps_n_items" ON "avg5m_gaps"(n_items)"""
+
+sql_create_avg5m_gap_scan: str = """CREATE TABLE IF NOT EXISTS "avg5m_gap_scan"(
+    "item_id" INTEGER PRIMARY KEY,
+    "timestamp" INTEGER NOT NULL)"""
+
+sql_select_gap_intervals: str = """SELECT prev, timestamp FROM (
+    SELECT timestamp, LAG(timestamp, 1, :t0) OVER (ORDER BY timestamp) AS prev FROM (
+        SELECT DISTINCT timestamp FROM "item_____"
+        WHERE src IN (1, 2) AND price > 0 AND timestamp > :t0 AND timestamp <= :t1))
+    WHERE timestamp - prev > 300"""
+
+sql_select_zero_buckets: str = """SELECT timestamp FROM "item_____" WHERE src IN (1, 2) AND timestamp > :t0 AND
+    timestamp <= :t1 GROUP BY timestamp HAVING MIN(price) = 0"""
+
+
+def create_gap_tables(con: sqlite3.Connection):
+    """ Create the avg5m gap tables in the database connected to via `con`, if they do not exist """
+    for sql in (sql_create_avg5m_gaps, sql_create_avg5m_gaps_index, sql_create_avg5m_gap_scan):
+        con.execute(sql)
 
-def commit_data(db: sqlite3.Connection, t_commit: int, done: Iterable, to_do: Iterable, progress_file: str = None):
-    """ Every `commit_frequency` seconds, commit rows to db and save the progress made in `progress_file` """
-    if time.perf_counter() > t_commit:
-        db.commit()
-        to_do = u_ar.unique_values(frozenset(to_do).difference(done), return_type=list, sort_ascending=True)
-        if progress_file is not None:
-            uf.save(to_do, path=progress_file)
-        return to_do, [], int(time.perf_counter() + commit_frequency)
-    else:
-        return to_do, done, t_commit
+
+def item_gap_intervals(con: sqlite3.Connection, item_id: int, t0: int, t1: int) -> np.ndarray:
+    """
+    Return the (t_prev, t_next) intervals of `item_id` within (`t0`, `t1`] during which it has no avg5m price; the
+    5-minute buckets strictly between t_prev and t_next have no price. `t0` is treated as a bucket with a price. If the
+    most recent price precedes `t1`, the interval that follows it ends at `t1` + 300.
+    """
+    c = con.cursor()
+    c.row_factory = None
+    parameters = {'t0': t0, 't1': t1}
+    table = f'{item_id:0>5}'
+    intervals = c.execute(sql_select_gap_intervals.replace('_____', table), parameters).fetchall()
+    t_last = c.execute(f"""SELECT MAX(timestamp) FROM "item{table}" WHERE src IN (1, 2) AND price > 0 AND
+                           timestamp > :t0 AND timestamp <= :t1""", parameters).fetchone()[0]
+    t_last = t0 if t_last is None else t_last
+    if t_last < t1:
+        intervals.append((t_last, t1 + 300))
+    return np.array(intervals, dtype=np.int64).reshape(-1, 2)
 
 
-def fill_avg5m_zero_prices(db_file: File = gp.f_db_timeseries, cooldown: float = 3.0, commit_frequency_sec: int = 20,
-                           item_ids: Iterable = go.most_traded_items, lb_ts: int = val.min_avg5m_ts_query_online,
-                           ub_ts: int = time.time(), skip_ids: Iterable = go.timeseries_skip_ids, progress_file: File = File(gp.dir_temp+'fill_avg5m_to_do.dat')):
+def update_avg5m_gaps(con: sqlite3.Connection, item_ids: Iterable[int] = go.most_traded_items,
+                      lb_ts: int = val.min_avg5m_ts, ub_ts: int = None, full_refresh: bool = False) -> int:
     """
-    Iterate over all items, collect timestamps from src=1 or 2 where price=0 and try to fill the missing data.
+    Update the avg5m_gaps table of the timeseries database connected to via `con` and commit the changes. Buckets are
+    recomputed from the oldest scanned timestamp of `item_ids` onwards, or from `lb_ts` if `full_refresh`.
     
     Parameters
     ----------
-    db_file : str
-        Path to the timeseries database
-    cooldown : int, optional, 3.0 by default
-        Ensures each iteration takes at least this many seconds. Used to limit the amount of requests made.
-    commit_frequency_sec : int, optional, 20 by default
-        Frequency in seconds for which to commit the submitted rows to the database.
-    item_ids : int, optional, global_variables.osrs.most_traded_items by default
-        Item_id to use as reference when gathering a list of timestamps. If set to None, iterate over all item_ids.
-    lb_ts : int, optional, global_variables.values.min_avg5m_ts_query_online by default
-        Lower bound timestamp; do not include timestamps smaller than `min_ts`. Is set to absolute minimum by default.
+    con : sqlite3.Connection
+        Connection with the timeseries database
+    item_ids : Iterable[int], optional, global_variables.osrs.most_traded_items by default
+        Reference items; the amount of items affected by a gap is counted among these items
+    lb_ts : int, optional, global_variables.values.min_avg5m_ts by default
+        Lower bound timestamp for items that have not been scanned yet
     ub_ts : int, optional, None by default
-        Upper bound timestamp; exclude timestamps larger than `max_ts`. Should not exceed the largest timestamp in db.
-    skip_ids : Iterable, optional, global_variables.osrs.timeseries_skip by default
-        A list of item_ids that should not be included whatsoever
-    progress_file : str, optional, global_variables.path.dir_temp+'fill_avg5m_to_do.dat'
-        If a file exists at this path, load its contents and resume the list. If the process is interrupted via a
-        KeyboardInterrupt, the to-do list minus the processed timestamps is saved at this path.
+        Upper bound timestamp. By default, the most recent avg5m timestamp of the reference items.
+    full_refresh : bool, optional, False by default
+        If True, discard all scanned timestamps and recompute all buckets from `lb_ts` onwards
+
     Returns
     -------
-
+    int
+        The amount of buckets that were (re)computed as gaps or zero price buckets
     """
-    global shutdown, db_size_start, last_print, n_inserts, t_commit
-    t_commit = time.perf_counter() + commit_frequency_sec
-    db = Database(db_file)
-    db_size_start = db_file.fsize()
-    
+    create_gap_tables(con)
+    item_ids = sorted(frozenset(item_ids).difference(go.timeseries_skip_ids))
+    c = con.cursor()
+    c.row_factory = None
+    if full_refresh:
+        con.execute("""DELETE FROM "avg5m_gap_scan" """)
+    scanned: Dict[int, int] = dict(c.execute("""SELECT item_id, timestamp FROM "avg5m_gap_scan" """).fetchall())
+    t0 = min([scanned.get(i, lb_ts - lb_ts % 300 - 300) for i in item_ids])
     if ub_ts is None:
-        ub_ts = db.execute("""SELECT MAX(timestamp) FROM 'item00002' WHERE src IN (1, 2)""").fetchone()
+        ub_ts = max([c.execute(f"""SELECT MAX(timestamp) FROM "item{i:0>5}" WHERE src IN (1, 2)""").fetchone()[0] or t0
+                     for i in item_ids])
+    t1 = int(ub_ts - ub_ts % 300)
+    if t1 <= t0:
+        return 0
     
-    # Exclude skip_ids from item_ids
-    item_ids = list(frozenset(item_ids).difference(skip_ids))
-    item_ids.sort()
-    ts_done = []
-    start = time.perf_counter()
-    # rows = db.execute("""SELECT B.timestamp, B.price, B.volume, S.price, S.volume FROM 'item10' AS B, 'item10' AS S WHERE B.src+1=S.src AND S.timestamp = B.timestamp""", factory=tuple).fetchall()
-    # new_ts = time.time()
+    # Count the items without a price per bucket via a difference array over the gap intervals
+    n_buckets = (t1 - t0) // 300
+    diff, n_zero = np.zeros(n_buckets + 1, dtype=np.int64), np.zeros(n_buckets, dtype=np.int64)
+    for item_id in item_ids:
+        intervals = item_gap_intervals(con, item_id, t0, t1)
+        np.add.at(diff, (intervals[:, 0] - t0) // 300, 1)
+        np.add.at(diff, (intervals[:, 1] - t0) // 300 - 1, -1)
+        zeros = np.array(c.execute(sql_select_zero_buckets.replace('_____', f'{item_id:0>5}'),
+                                   {'t0': t0, 't1': t1}).fetchall(), dtype=np.int64).reshape(-1)
+        np.add.at(n_zero, (zeros - t0) // 300 - 1, 1)
+        
+        t_last = t1 if len(intervals) == 0 or intervals[-1, 1] <= t1 else int(intervals[-1, 0])
+        scanned[item_id] = max(scanned.get(item_id, t0), t_last)
+    n_items = np.cumsum(diff)[:n_buckets]
     
-    i, to_do, loaded_file = None, [], False
-    p = (lb_ts, ub_ts)
-    if progress_file.exists():
+    timestamps = t0 + 300 * np.arange(1, n_buckets + 1, dtype=np.int64)
+    mask = (n_items > 0) | (n_zero > 0)
+    con.execute("""DELETE FROM "avg5m_gaps" WHERE timestamp > ?""", (t0,))
+    con.executemany("""INSERT INTO "avg5m_gaps"(timestamp, n_items, n_zero) VALUES (?, ?, ?)""",
+                    zip(timestamps[mask].tolist(), n_items[mask].tolist(), n_zero[mask].tolist()))
+    con.executemany("""INSERT OR REPLACE INTO "avg5m_gap_scan"(item_id, timestamp) VALUES (?, ?)""",
+                    [(i, scanned[i]) for i in item_ids])
+    con.commit()
+    return int(mask.sum())
+
+
+def get_avg5m_gaps(con: sqlite3.Connection, t0: int = 0, t1: int = None, min_items: int = 1,
+                   zero_only: bool = False) -> List[int]:
+    """
+    Return the gap timestamps between `t0` and `t1` that affect at least `min_items` items, ranked by the amount of
+    items affected. If `zero_only`, return the timestamps at which at least `min_items` items have a buy or sell price
+    of 0 instead, ranked by the amount of such items.
+    """
+    c = con.cursor()
+    c.row_factory = None
+    column = 'n_zero' if zero_only else 'n_items'
+    return [r[0] for r in c.execute(f"""SELECT timestamp FROM "avg5m_gaps" WHERE timestamp BETWEEN ? AND ? AND
+                                        {column} >= ? ORDER BY {column} DESC, timestamp""",
+                                    (t0, int(time.time()) if t1 is None else t1, min_items)).fetchall()]
+
+
+def _backfill(db_file: str, gaps: List[Tuple[int, int]], rate: float, n_workers: int, url: str = None,
+              legacy_progress_file: File = None) -> int:
+    """
+    Queue the (timestamp, priority) tuples in `gaps` in the avg5m backfill queue and download the pending timestamps
+    concurrently. Timestamps listed in `legacy_progress_file` are queued as well, after which the file is removed.
+    Return the amount of rows inserted.
+    """
+    from backend.avg5m_backfill import Avg5mBackfill, wiki_prices_api
+    backfill = Avg5mBackfill(db_file, rate=rate, n_workers=n_workers, url=wiki_prices_api if url is None else url)
+    if legacy_progress_file is not None and legacy_progress_file.exists():
         try:
-            to_do = progress_file.load()
-            loaded_file = True
-            print(f'Resuming from loaded file at {progress_file}')
+            print(f'Queued {backfill.enqueue(legacy_progress_file.load())} timestamps from {legacy_progress_file}')
         except EOFError:
-            print(f'EOF Error while trying to load existing progress file at {progress_file}')
-    
-    if not loaded_file:
-        n = len(item_ids)
-        print('Gathering timestamps. If you wish to proceed with the current list, press CTRL+C.\n')
-        for idx, i in enumerate(item_ids):
-            try:
-                print(f'\tProgress: {idx+1}/{n} timestamps found: {len(to_do)}          ', end='\r')
-                to_do += db.execute(
-                    f"""SELECT DISTINCT timestamp FROM 'item{i:0>5}' WHERE price=0 AND src IN (1, 2) AND timestamp BETWEEN ? AND ? AND timestamp NOT IN {str(tuple(to_do))}""",
-                    p, factory=0).fetchall()
-                # if idx % 50 == 49:
-                #     to_do = u_ar.unique_values(to_do, list)
-            except KeyboardInterrupt:
-                break
-        to_do = u_ar.unique_values(_set=to_do, sort_ascending=True, return_type=tuple)
-        progress_file.save(to_do)
-    n = len(to_do)
-    print(f"\n  * Gathered {n} different timestamps")
-
-    sell_keys, buy_keys = ['avgHighPrice', 'highPriceVolume'], ['avgLowPrice', 'lowPriceVolume']
-    t_commit = time.perf_counter() + commit_frequency_sec
-    _, timestamps_done = '            ', []
+            print(f'EOF Error while trying to load existing progress file at {legacy_progress_file}')
+        legacy_progress_file.delete()
+    n_queued = backfill.enqueue([g[0] for g in gaps], [g[1] for g in gaps])
+    print(f'Queued {n_queued} of {len(gaps)} gap timestamps | Pending: {len(backfill.pending())}')
     try:
-        for idx, ts in enumerate(to_do):
-            timestamps_done.append(ts)
-            t_ = time.perf_counter()
-            data = dl.download_wiki_prices_rt_averaged(timestamp=int(ts))[0]
-            for i in item_ids:
-                el = data.get(str(i))
-                _insert = f"""INSERT OR REPLACE INTO 'item{i:0>5}'(src, timestamp, price, volume) VALUES (?, ?, ?, ?)"""
-                for src, keys in zip((1, 2), (buy_keys, sell_keys)):
-                    try:
-                        price, volume = [el.get(k) for k in keys]
-                        if price > 0:
-                            db.execute(_insert, (src, ts, price, volume))
-                            
-                            n_inserts += 1
-                    except AttributeError:
-                        ...
-                    except TypeError:
-                        ...
-            tpc = time.perf_counter()
-            last_print = f" Timestamp #{idx+1}/{n}  {ts} {fmt.unix_(ts)}  N_inserts: {n_inserts}  " \
-                         f"File: +{fmt.fsize(db_file.fsize() - db_size_start)}{_}"
-            print(last_print, end='\r')
-            to_do, done, t_commit = commit_data(db, t_commit, ts_done, to_do, progress_file)
-            
-            time.sleep(max(.1, cooldown - (tpc - t_)))
-    except KeyboardInterrupt:
-        # Process was manually interrupted; save progress to `progress_file`
-        progress_file.save(u_ar.unique_values(frozenset(to_do).difference(ts_done), return_type=tuple, sort_ascending=True))
-        shutdown = True
+        return backfill.run()
     finally:
-        print('\n\n')
-        ts_done += timestamps_done
-        db.commit()
-        
-        db.close()
-        
-        # To-do list was fully completed and a previously created file exists
-        if not shutdown and progress_file.exists():
-            progress_file.delete()
-        print(f'Done! Runtime: {fmt.delta_t(time.perf_counter() - start)} | Inserts: {n_inserts} | '
-                  f'Db file size: +{fmt.fsize(db_file.fsize()-db_size_start)}')
-        _ = input('Press ENTER to close')
-        return
-        
+        backfill.close()
+
+
+def fill_avg5m_zero_prices(db_file: str = gp.f_db_timeseries, cooldown: float = 3.0, n_workers: int = 1,
+                           item_ids: Iterable[int] = go.most_traded_items, lb_ts: int = val.min_avg5m_ts_query_online,
+                           ub_ts: int = None, min_items: int = 1, url: str = None) -> int:
+    """
+    Update the avg5m gaps and download the timestamps between `lb_ts` and `ub_ts` at which at least `min_items`
+    reference items have a buy or sell price of 0 again. Timestamps are queued in the avg5m backfill queue, such that an
+    interrupted run resumes with the remaining timestamps upon the next run. Timestamps at which the most items have a
+    price of 0 are downloaded first. Return the amount of rows inserted.
+    
+    Parameters
+    ----------
+    db_file : str, optional, global_variables.path.f_db_timeseries by default
+        Path to the timeseries database
+    cooldown : float, optional, 3.0 by default
+        Minimum amount of seconds between two requests
+    n_workers : int, optional, 1 by default
+        Amount of concurrent download workers
+    item_ids : Iterable[int], optional, global_variables.osrs.most_traded_items by default
+        Reference items used to detect prices of 0. Items in global_variables.osrs.timeseries_skip_ids are excluded.
+    lb_ts : int, optional, global_variables.values.min_avg5m_ts_query_online by default
+        Lower bound timestamp
+    ub_ts : int, optional, None by default
+        Upper bound timestamp. By default, the most recent avg5m timestamp of the reference items.
+    min_items : int, optional, 1 by default
+        Minimum amount of reference items with a price of 0 at a timestamp
+    url : str, optional, None by default
+        Url of the prices API. By default, the url of the wiki prices API.
+    """
+    start = time.perf_counter()
+    con = sqlite3.connect(db_file)
+    print('Gathering timestamps...')
+    n_gaps = update_avg5m_gaps(con, item_ids, lb_ts, ub_ts)
+    print(f'\tUpdated {n_gaps} avg5m gaps in {fmt.passed_pc(start)}')
+    gaps = con.execute("""SELECT timestamp, n_zero FROM "avg5m_gaps" WHERE timestamp BETWEEN ? AND ? AND n_zero >= ?""",
+                       (lb_ts, int(time.time()) if ub_ts is None else ub_ts, min_items)).fetchall()
+    con.close()
+    n_rows = _backfill(db_file, gaps, 1 / cooldown, n_workers, url, File(gp.dir_temp+'fill_avg5m_to_do.dat'))
+    print(f'Done! Runtime: {fmt.delta_t(time.perf_counter() - start)} | Inserts: {n_rows}')
+    return n_rows
+
+
+def backfill_avg5m_gaps(db_file: str = gp.f_db_timeseries, rate: float = 2.0, n_workers: int = 4,
+                        item_ids: Iterable[int] = go.most_traded_items, lb_ts: int = val.min_avg5m_ts_query_online,
+                        ub_ts: int = None, min_items: int = 1, url: str = None) -> int:
+    """
+    Update the avg5m gaps, queue the gap timestamps between `lb_ts` and `ub_ts` that affect at least `min_items`
+    reference items and download them concurrently via the avg5m backfill downloader. Gaps that affect the most items
+    are downloaded first. Return the amount of rows inserted.
+    
+    Parameters
+    ----------
+    db_file : str, optional, global_variables.path.f_db_timeseries by default
+        Path to the timeseries database
+    rate : float, optional, 2.0 by default
+        Maximum amount of requests per second
+    n_workers : int, optional, 4 by default
+        Amount of concurrent download workers
+    item_ids : Iterable[int], optional, global_variables.osrs.most_traded_items by default
+        Reference items used to detect gaps
+    lb_ts : int, optional, global_variables.values.min_avg5m_ts_query_online by default
+        Lower bound timestamp
+    ub_ts : int, optional, None by default
+        Upper bound timestamp. By default, the most recent avg5m timestamp of the reference items.
+    min_items : int, optional, 1 by default
+        Minimum amount of reference items affected by a gap
+    url : str, optional, None by default
+        Url of the prices API. By default, the url of the wiki prices API.
+    """
+    lb_ts = max(lb_ts, val.min_avg5m_ts_query_online)
+    con = sqlite3.connect(db_file)
+    update_avg5m_gaps(con, item_ids, lb_ts, ub_ts)
+    gaps = con.execute("""SELECT timestamp, n_items FROM "avg5m_gaps" WHERE timestamp BETWEEN ? AND ? AND
+                          n_items >= ?""", (lb_ts, int(time.time()) if ub_ts is None else ub_ts, min_items)).fetchall()
+    con.close()
+    return _backfill(db_file, gaps, rate, n_workers, url)
+
 
 def fill_missing_avg5m(db_file: File = gp.f_db_timeseries, cooldown: float = 3.0, commit_frequency_sec: int = 20,
                        ref_id: int = go.most_traded_items, lb_ts: int = val.min_avg5m_ts, ub_ts: int = None,
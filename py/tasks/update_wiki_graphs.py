@@ -0,0 +1,79 @@
+"""
+Executable module that refreshes the wiki graphs (src=0) of the timeseries database.
+
+The graphs of the items are downloaded concurrently via the WikiGraphFetcher. Each graph is ingested as soon as its
+download completes; rows newer than the most recent wiki datapoint of the item are inserted into its timeseries table
+and the affected timestamp range is registered as dirty, such that the npy arrays are updated accordingly.
+
+"""
+import sqlite3
+from collections.abc import Iterable
+
+from venv_auto_loader.active_venv import *
+import global_variables.osrs as go
+import global_variables.path as gp
+import util.str_formats as fmt
+from backend.npy_watermark import DirtyRangeTracker
+from backend.wiki_graph_fetcher import WikiGraphFetcher, weirdgloop_history_api
+from common import SRC
+from tasks.data_transfer import get_timeseries_tables, insert_timeseries_rows
+__t0__ = time.perf_counter()
+
+
+def update_wiki_graphs(db_file: str = gp.f_db_timeseries, item_ids: Iterable[int] = None, n_workers: int = 8,
+                       max_per_host: int = 4, rate: float = 5.0, url: str = weirdgloop_history_api,
+                       commit_items: int = 50) -> int:
+    """
+    Download the wiki graphs of `item_ids` concurrently and insert their new datapoints into the timeseries database.
+    Return the amount of rows inserted.
+
+    Parameters
+    ----------
+    db_file : str, optional, global_variables.path.f_db_timeseries by default
+        Path to the timeseries database
+    item_ids : Iterable[int], optional, None by default
+        item_ids of the graphs that are refreshed. By default, all items that have a timeseries table.
+    n_workers : int, optional, 8 by default
+        Amount of concurrent download workers
+    max_per_host : int, optional, 4 by default
+        Maximum amount of concurrent requests to the API host
+    rate : float, optional, 5.0 by default
+        Maximum amount of requests per second
+    url : str, optional, the weirdgloop exchange history API by default
+        Url of the exchange history API
+    commit_items : int, optional, 50 by default
+        Amount of ingested graphs after which changes are committed
+    """
+    src = SRC.w.src_id
+    con = sqlite3.connect(db_file)
+    tables = get_timeseries_tables(con)
+    item_ids = sorted(tables.difference(go.timeseries_skip_ids) if item_ids is None else item_ids)
+    min_ts = {}
+    for item_id in frozenset(item_ids).intersection(tables):
+        ts = con.execute(f"""SELECT MAX(timestamp) FROM "item{item_id:0>5}" WHERE src=?""", (src,)).fetchone()[0]
+        if ts is not None:
+            min_ts[item_id] = ts + 1
+
+    fetcher = WikiGraphFetcher(n_workers=n_workers, max_per_host=max_per_host, rate=rate, url=url)
+    dirty_ranges, start, n_inserted = DirtyRangeTracker(), time.perf_counter(), 0
+    try:
+        for idx, (item_id, graph) in enumerate(fetcher.fetch(item_ids, min_ts), start=1):
+            if graph is not None and len(graph) > 0:
+                inserted, _, _ = insert_timeseries_rows(con, ((item_id, src, *r) for r in graph.tolist()),
+                                                        dirty_ranges, tables)
+                n_inserted += sum(inserted)
+            if idx % commit_items == 0:
+                dirty_ranges.flush(con)
+                con.commit()
+            print(f"\t[{fmt.passed_pc(start)}] {idx}/{len(item_ids)} graphs | Inserted: {n_inserted} | "
+                  f"Failed: {fetcher.n_failed}  ", end='\r')
+    finally:
+        dirty_ranges.flush(con)
+        con.commit()
+        con.close()
+    print('')
+    return n_inserted
+
+
+if __name__ == '__main__':
+    update_wiki_graphs()
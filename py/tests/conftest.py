@@ -0,0 +1,75 @@
+"""
+Shared fixtures of the tests. The tests are run from the py directory, e.g. python -m pytest tests
+
+The local_server fixture is a local stand-in for the remote APIs; it serves the responses produced by a callable that is
+set by the test, and it records the requests it received.
+"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ReceivedRequest(NamedTuple):
+    """ Request received by the LocalServer; `client_port` identifies the connection it was sent over """
+    path: str
+    headers: Dict[str, str]
+    client_port: int
+
+
+class LocalServer:
+    """
+    HTTP/1.1 server listening on localhost, which supports keep-alive connections. Each GET request is answered with the
+    (status, headers, body) tuple returned by `respond`, which is passed the path and the headers of the request.
+    """
+    def __init__(self):
+        self.respond: Callable[[str, Dict[str, str]], Tuple[int, Dict[str, str], bytes]] = \
+            lambda path, headers: (404, {}, b'')
+        self.requests: List[ReceivedRequest] = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                headers = dict(self.headers.items())
+                with server._lock:
+                    server.requests.append(ReceivedRequest(self.path, headers, self.client_address[1]))
+                status, response_headers, body = server.respond(self.path, headers)
+                self.send_response(status)
+                for key, value in response_headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name='LocalServer')
+        self._thread.start()
+
+    def paths(self) -> List[str]:
+        """ Return the paths of the received requests """
+        with self._lock:
+            return [r.path for r in self.requests]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def local_server():
+    server = LocalServer()
+    yield server
+    server.close()
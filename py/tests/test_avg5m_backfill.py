@@ -0,0 +1,175 @@
+"""
+Tests of backend.avg5m_backfill, which run the backfill downloader against the local_server fixture
+"""
+import json
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+import global_variables.osrs as go
+from backend.avg5m_backfill import Avg5mBackfill, TokenBucket, CLAIMED, DONE, FAILED
+
+ts0 = 1700000100
+"""Timestamp of the first avg5m snapshot used in the tests"""
+
+snapshot = {"data": {"2": {"avgHighPrice": 200, "highPriceVolume": 5, "avgLowPrice": 190, "lowPriceVolume": 7}}}
+
+
+def timestamp_of(path: str) -> int:
+    """ Return the timestamp parameter of a /5m request path """
+    return int(urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)['timestamp'][0])
+
+
+def json_response(payload) -> tuple:
+    return 200, {'Content-Type': 'application/json'}, json.dumps(payload).encode()
+
+
+@pytest.fixture(autouse=True)
+def npy_items(monkeypatch):
+    """ Ingested rows register dirty ranges of the npy items; keep them independent of the local item database """
+    monkeypatch.setitem(vars(go), 'npy_items', (2,))
+
+
+@pytest.fixture
+def backfill(tmp_path, local_server):
+    backfill = Avg5mBackfill(db_file=str(tmp_path / 'timeseries.db'), rate=100.0, n_workers=2, max_attempts=3,
+                             backoff=.01, url=local_server.url, timeout=5.0)
+    yield backfill
+    backfill.close()
+
+
+def run(backfill: Avg5mBackfill, limit: int = None, timeout: float = 10.0) -> int:
+    """ Run `backfill` in a separate thread, such that a hanging run fails the test rather than blocking it """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(backfill.run(limit)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "The backfill did not finish"
+    return result[0]
+
+
+def queue_status(db_file: str) -> dict:
+    con = sqlite3.connect(db_file)
+    rows = con.execute("""SELECT timestamp, status, attempts FROM "avg5m_backfill_queue" """).fetchall()
+    con.close()
+    return {ts: (status, attempts) for ts, status, attempts in rows}
+
+
+def test_token_bucket_limits_the_request_rate():
+    bucket = TokenBucket(rate=20.0, capacity=1)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # The first token is available immediately, the other four are added at 20 tokens per second
+    assert time.monotonic() - start >= .18
+
+
+def test_token_bucket_is_shared_across_threads():
+    bucket = TokenBucket(rate=50.0, capacity=1)
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(3)]) for _ in range(4)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.monotonic() - start >= 11 / 50 - .02
+
+
+def test_snapshot_rows_are_inserted(backfill, local_server):
+    local_server.respond = lambda path, headers: json_response(snapshot)
+    backfill.enqueue([ts0, ts0 + 300])
+
+    assert run(backfill) == 4
+    assert sorted(local_server.paths()) == [f"/5m?timestamp={ts0}", f"/5m?timestamp={ts0 + 300}"]
+    con = sqlite3.connect(backfill.db_file)
+    rows = con.execute("""SELECT src, timestamp, price, volume FROM "item00002" ORDER BY timestamp, src""").fetchall()
+    con.close()
+    assert rows == [(1, ts0, 190, 7), (2, ts0, 200, 5), (1, ts0 + 300, 190, 7), (2, ts0 + 300, 200, 5)]
+    assert backfill.pending() == []
+    assert {status for status, _ in queue_status(backfill.db_file).values()} == {DONE}
+
+
+def test_failed_requests_are_retried(backfill, local_server):
+    def respond(path, headers):
+        return (500, {}, b'') if local_server.paths().count(path) <= 2 else json_response(snapshot)
+    local_server.respond = respond
+    backfill.enqueue([ts0])
+
+    assert run(backfill) == 2
+    assert backfill.n_requests == 3
+    assert queue_status(backfill.db_file)[ts0][0] == DONE
+
+
+def test_retries_are_limited_to_max_attempts(backfill, local_server):
+    local_server.respond = lambda path, headers: (503, {}, b'')
+    backfill.enqueue([ts0])
+
+    assert run(backfill) == 0
+    assert len(local_server.requests) == backfill.max_attempts
+    assert queue_status(backfill.db_file)[ts0] == (FAILED, backfill.max_attempts)
+
+
+def test_client_errors_are_not_retried(backfill, local_server):
+    local_server.respond = lambda path, headers: (404, {}, b'')
+    backfill.enqueue([ts0])
+
+    assert run(backfill) == 0
+    assert len(local_server.requests) == 1
+    assert queue_status(backfill.db_file)[ts0] == (FAILED, 1)
+
+
+def test_malformed_payloads_are_reported_as_failed(backfill, local_server):
+    payloads = {ts0: {"data": {"2": None}}, ts0 + 300: [1, 2, 3], ts0 + 600: snapshot}
+    local_server.respond = lambda path, headers: json_response(payloads[timestamp_of(path)])
+    backfill.enqueue(list(payloads))
+
+    assert run(backfill) == 2
+    assert backfill.n_failed == 2
+    status = queue_status(backfill.db_file)
+    assert status[ts0] == (FAILED, 1)
+    assert status[ts0 + 300] == (FAILED, 1)
+    assert status[ts0 + 600][0] == DONE
+
+
+def test_queue_persists_between_runs(tmp_path, local_server):
+    local_server.respond = lambda path, headers: json_response(snapshot)
+    db_file, timestamps = str(tmp_path / 'timeseries.db'), [ts0, ts0 + 300, ts0 + 600]
+    backfill = Avg5mBackfill(db_file=db_file, rate=100.0, n_workers=2, backoff=.01, url=local_server.url)
+    assert backfill.enqueue(timestamps, priorities=[0, 2, 1]) == 3
+    assert run(backfill, limit=1) == 2
+    assert local_server.paths() == [f"/5m?timestamp={ts0 + 300}"]
+    backfill.close()
+
+    resumed = Avg5mBackfill(db_file=db_file, rate=100.0, n_workers=2, backoff=.01, url=local_server.url)
+    try:
+        assert resumed.pending() == [ts0 + 600, ts0]
+        assert resumed.enqueue(timestamps) == 0
+        assert run(resumed) == 4
+        assert resumed.pending() == []
+    finally:
+        resumed.close()
+
+
+def test_claimed_timestamps_of_an_interrupted_run_are_resumed(backfill, local_server):
+    local_server.respond = lambda path, headers: json_response(snapshot)
+    backfill.enqueue([ts0])
+    backfill.con.execute("""UPDATE "avg5m_backfill_queue" SET status=?""", (CLAIMED,))
+    backfill.con.commit()
+
+    assert backfill.pending() == [ts0]
+    assert run(backfill) == 2
+    assert queue_status(backfill.db_file)[ts0][0] == DONE
+
+
+def test_failed_timestamps_can_be_retried(backfill, local_server):
+    local_server.respond = lambda path, headers: (404, {}, b'')
+    backfill.enqueue([ts0])
+    run(backfill)
+    assert backfill.pending() == []
+
+    local_server.respond = lambda path, headers: json_response(snapshot)
+    assert backfill.retry_failed() == 1
+    assert run(backfill) == 2
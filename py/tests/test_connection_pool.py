@@ -0,0 +1,53 @@
+"""
+Tests of common.classes.connection_pool
+"""
+import sqlite3
+import threading
+
+import pytest
+
+from common.classes.connection_pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    path = str(tmp_path / 'pool.db')
+    con = sqlite3.connect(path)
+    con.execute("""CREATE TABLE "t"(x INTEGER)""")
+    con.close()
+    pool = ConnectionPool(path)
+    yield pool
+    pool.close()
+
+
+def read_in_thread(pool: ConnectionPool) -> sqlite3.Connection:
+    """ Establish a read connection in a separate thread that exits afterwards, and return the connection """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pool.read_connection()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_read_connections_are_reused_per_thread(pool):
+    assert pool.read_connection() is pool.read_connection()
+    assert read_in_thread(pool) is not pool.read_connection()
+
+
+def test_read_connections_of_exited_threads_are_closed(pool):
+    pool.read_connection()
+    con = read_in_thread(pool)
+    assert len(pool) == 2
+
+    assert pool.release_connections() == 1
+    assert len(pool) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        con.execute("""SELECT * FROM "t" """)
+    # The read connection of a live thread is kept
+    pool.read_connection().execute("""SELECT * FROM "t" """)
+
+
+def test_read_connections_of_exited_threads_are_closed_upon_connecting(pool):
+    for _ in range(3):
+        read_in_thread(pool)
+    assert len(pool) == 1
@@ -0,0 +1,173 @@
+"""
+Tests of backend.http_session, which make requests to the local_server fixture
+"""
+import json
+import sqlite3
+import threading
+import time
+import urllib.error
+
+import pytest
+
+from backend.http_session import CachedResponse, HttpSession, ResponseCache, get_ttl
+
+body = json.dumps({"data": {"2": {"high": 200, "low": 190}}}).encode()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'http_cache.db'))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def session(cache):
+    session = HttpSession(cache, timeout=5.0)
+    yield session
+    session.close()
+
+
+def etag_response(etag: str = '"v1"'):
+    """ Return a respond function that serves `body` with ETag `etag` and answers matching conditional requests """
+    def respond(path, headers):
+        if headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'ETag': etag, 'Content-Type': 'application/json'}, body
+    return respond
+
+
+def expire(cache: ResponseCache, url: str, ttl: int):
+    """ Mark the cached response of `url` as downloaded `ttl` seconds ago """
+    cache.touch(url, int(time.time()) - ttl, ttl)
+
+
+def test_connections_are_kept_alive(session, local_server):
+    local_server.respond = etag_response()
+    for i in range(3):
+        assert session.get(f"{local_server.url}/latest?i={i}", ttl=None) == body
+    assert len(local_server.requests) == 3
+    assert len({r.client_port for r in local_server.requests}) == 1
+
+
+def test_connections_are_kept_per_thread(session, local_server):
+    local_server.respond = etag_response()
+    threads = [threading.Thread(target=lambda i=i: [session.get(f"{local_server.url}/{i}/{j}", ttl=None)
+                                                    for j in range(2)]) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({r.client_port for r in local_server.requests}) == 2
+    assert session.release_connections() == 2
+
+
+def test_fresh_responses_are_served_from_the_cache(session, local_server):
+    local_server.respond = etag_response()
+    url = f"{local_server.url}/mapping"
+    assert session.get_json(url, ttl=60) == json.loads(body)
+    assert session.get_json(url, ttl=60) == json.loads(body)
+    assert len(local_server.requests) == 1
+    assert session.stats['downloaded'] == 1
+    assert session.stats['hit'] == 1
+
+
+def test_expired_responses_are_revalidated(session, cache, local_server):
+    local_server.respond = etag_response()
+    url = f"{local_server.url}/mapping"
+    session.get(url, ttl=60)
+    expire(cache, url, 60)
+
+    assert session.get(url, ttl=60) == body
+    assert local_server.requests[-1].headers.get('If-None-Match') == '"v1"'
+    assert session.stats['not_modified'] == 1
+    # The age of the revalidated response is reset
+    assert session.get(url, ttl=60) == body
+    assert len(local_server.requests) == 2
+
+
+def test_modified_responses_replace_the_cached_response(session, cache, local_server):
+    local_server.respond = etag_response('"v1"')
+    url = f"{local_server.url}/mapping"
+    session.get(url, ttl=60)
+    expire(cache, url, 60)
+
+    new_body = json.dumps({"data": {}}).encode()
+    local_server.respond = lambda path, headers: (200, {'ETag': '"v2"'}, new_body)
+    assert session.get(url, ttl=60) == new_body
+    assert cache.get(url).etag == '"v2"'
+    assert session.stats['downloaded'] == 2
+
+
+def test_responses_without_ttl_are_not_cached(session, cache, local_server):
+    local_server.respond = etag_response()
+    url = f"{local_server.url}/item"
+    session.get(url, ttl=None)
+    session.get(url, ttl=None)
+    assert len(local_server.requests) == 2
+    assert cache.get(url) is None
+
+
+def test_wiki_graphs_are_not_cached():
+    assert get_ttl("https://api.weirdgloop.org/exchange/history/osrs/all?id=2") is None
+    assert get_ttl("https://prices.runescape.wiki/api/v1/osrs/latest") == 60
+
+
+def test_error_status_codes_are_raised(session, cache, local_server):
+    local_server.respond = lambda path, headers: (503, {}, b'')
+    url = f"{local_server.url}/latest"
+    with pytest.raises(urllib.error.HTTPError) as e:
+        session.get(url, ttl=60)
+    assert e.value.code == 503
+    assert cache.get(url) is None
+
+
+def test_expired_responses_are_pruned(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'http_cache.db'), max_stale=60, prune_interval=0)
+    try:
+        t = int(time.time())
+        cache.put(CachedResponse('old', None, None, t - 3600, body), 60)
+        cache.put(CachedResponse('new', None, None, t, body), 60)
+        assert cache.get('old') is None
+        assert cache.get('new') is not None
+    finally:
+        cache.close()
+
+
+def test_corrupt_cache_entries_are_downloaded_again(session, cache, local_server):
+    local_server.respond = etag_response()
+    url = f"{local_server.url}/mapping"
+    session.get(url, ttl=60)
+    con = sqlite3.connect(cache.path)
+    con.execute("""UPDATE "http_cache" SET body='corrupt', fetched='corrupt' WHERE url=?""", (url,))
+    con.commit()
+    con.close()
+
+    assert cache.get(url) is None
+    assert session.get(url, ttl=60) == body
+    assert len(local_server.requests) == 2
+    # Without a cached response, the request is not conditional
+    assert 'If-None-Match' not in local_server.requests[-1].headers
+
+
+def test_undecodable_cached_bodies_are_downloaded_again(session, cache, local_server):
+    local_server.respond = etag_response()
+    url = f"{local_server.url}/mapping"
+    session.get(url, ttl=60)
+    con = sqlite3.connect(cache.path)
+    con.execute("""UPDATE "http_cache" SET body=? WHERE url=?""", (body[:10], url))
+    con.commit()
+    con.close()
+
+    assert session.get_json(url, ttl=60) == json.loads(body)
+    assert len(local_server.requests) == 2
+    assert cache.get(url).body == body
+
+
+def test_undecodable_downloaded_bodies_are_raised(session, cache, local_server):
+    local_server.respond = lambda path, headers: (200, {}, b'not json')
+    url = f"{local_server.url}/mapping"
+    with pytest.raises(ValueError):
+        session.get_json(url, ttl=60)
+    assert len(local_server.requests) == 1
+    assert cache.get(url) is None
@@ -0,0 +1,61 @@
+"""
+Tests of timeseries.view.materialized, which refresh materialized views of rows ingested via a DirtyRangeTracker
+"""
+import sqlite3
+
+import pytest
+
+import global_variables.osrs as go
+from backend.npy_watermark import DirtyRangeTracker
+from common.classes.database import sql_create_timeseries_item_table
+from timeseries.view import TimeseriesView
+from timeseries.view.materialized import get_hwm, refresh_all_materialized_views, refresh_materialized_view, \
+    verify_materialized_view
+
+ts0 = 1700006400
+"""Timestamp of the first row used in the tests"""
+
+
+@pytest.fixture(autouse=True)
+def npy_items(monkeypatch):
+    """ Ingested rows register dirty ranges of the npy items; keep them independent of the local item database """
+    monkeypatch.setitem(vars(go), 'npy_items', (2,))
+
+
+@pytest.fixture
+def con(tmp_path):
+    con = sqlite3.connect(str(tmp_path / 'timeseries.db'))
+    con.execute(sql_create_timeseries_item_table(2, check_exists=False))
+    yield con
+    con.close()
+
+
+def ingest(con: sqlite3.Connection, rows: list):
+    """ Insert (src, timestamp, price, volume) `rows` of item 2 and register them via a DirtyRangeTracker """
+    tracker = DirtyRangeTracker()
+    con.executemany("""INSERT OR REPLACE INTO "item00002"(src, timestamp, price, volume) VALUES (?, ?, ?, ?)""", rows)
+    for src, ts, _, _ in rows:
+        tracker.add(2, src, ts)
+    tracker.flush(con)
+    con.commit()
+
+
+def test_late_rows_are_materialized(con):
+    ingest(con, [(src, ts0 + i * 300, 100 + i, 5) for i in range(2000) for src in (1, 2)])
+    refresh_materialized_view(con, 2, TimeseriesView.FIVE_MINUTES)
+    hwm = get_hwm(con, 2, TimeseriesView.FIVE_MINUTES)
+
+    # A backfilled datapoint that lies well before the lookback period of the high-water mark
+    ingest(con, [(1, ts0 + 300, 150, 9)])
+    assert get_hwm(con, 2, TimeseriesView.FIVE_MINUTES) == ts0 + 300
+    assert not verify_materialized_view(con, 2, TimeseriesView.FIVE_MINUTES, t1=hwm).is_consistent
+
+    assert refresh_all_materialized_views(con) > 0
+    assert get_hwm(con, 2, TimeseriesView.FIVE_MINUTES) == hwm
+    assert verify_materialized_view(con, 2, TimeseriesView.FIVE_MINUTES).is_consistent
+
+
+def test_views_that_were_not_materialized_are_not_refreshed(con):
+    ingest(con, [(1, ts0, 100, 5), (2, ts0, 110, 5)])
+    assert refresh_all_materialized_views(con) == 0
+    assert get_hwm(con, 2, TimeseriesView.FIVE_MINUTES) is None
@@ -0,0 +1,99 @@
+"""
+Tests of backend.wiki_graph_fetcher, which fetch wiki graphs from the local_server fixture
+"""
+import json
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import pytest
+
+from backend.http_session import HttpSession
+from backend.wiki_graph_fetcher import WikiGraphFetcher, parse_wiki_graph
+
+
+def history(item_id: int, n: int = 3) -> dict:
+    """ Return an exchange history payload of `item_id` with `n` daily datapoints """
+    return {str(item_id): [{"id": str(item_id), "timestamp": (1700006400 - d * 86400) * 1000, "price": 100 + d,
+                            "volume": 10 * d if d else None} for d in range(n)]}
+
+
+def item_id_of(path: str) -> int:
+    return int(urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)['id'][0])
+
+
+def json_response(payload) -> tuple:
+    return 200, {'Content-Type': 'application/json'}, json.dumps(payload).encode()
+
+
+@pytest.fixture
+def session():
+    session = HttpSession(timeout=5.0)
+    yield session
+    session.close()
+
+
+def fetcher(local_server, session, **kwargs) -> WikiGraphFetcher:
+    return WikiGraphFetcher(url=f"{local_server.url}/exchange/history/osrs/all", session=session,
+                            **{'n_workers': 4, 'rate': None, **kwargs})
+
+
+def test_graphs_are_parsed_in_chronological_order():
+    graph = parse_wiki_graph(2, history(2))
+    assert graph['timestamp'].tolist() == [1700006400 - d * 86400 for d in (2, 1, 0)]
+    assert graph['price'].tolist() == [102, 101, 100]
+    assert graph['volume'].tolist() == [20, 10, 0]
+    assert parse_wiki_graph(2, history(2), min_ts=1700006400).size == 1
+    assert parse_wiki_graph(2, {}).size == 0
+
+
+def test_graphs_of_all_items_are_fetched(local_server, session):
+    local_server.respond = lambda path, headers: json_response(history(item_id_of(path)))
+    graphs = dict(fetcher(local_server, session).fetch([2, 6, 8, 10]))
+    assert sorted(graphs) == [2, 6, 8, 10]
+    assert all(np.array_equal(graphs[i], parse_wiki_graph(i, history(i))) for i in graphs)
+
+
+def test_min_ts_is_applied_per_item(local_server, session):
+    local_server.respond = lambda path, headers: json_response(history(item_id_of(path)))
+    graphs = dict(fetcher(local_server, session).fetch([2, 6], min_ts={2: 1700006400}))
+    assert graphs[2].size == 1
+    assert graphs[6].size == 3
+
+
+def test_failed_items_do_not_abort_the_fetch(local_server, session):
+    responses = {
+        2: json_response(history(2)),
+        6: (404, {}, b''),
+        8: (200, {}, b'not json'),
+        10: json_response({"10": {"timestamp": 0}}),
+        12: json_response({"12": [None]}),
+        13: json_response([1, 2]),
+        14: json_response({"14": 5}),
+        15: json_response({"15": [{"price": 100}]}),
+    }
+    local_server.respond = lambda path, headers: responses[item_id_of(path)]
+    f = fetcher(local_server, session)
+    graphs = dict(f.fetch(responses))
+    assert sorted(graphs) == sorted(responses)
+    assert graphs[2].size == 3
+    assert sorted([i for i, graph in graphs.items() if graph is None]) == [6, 8, 10, 12, 13, 14, 15]
+    assert f.n_failed == 7
+
+
+def test_concurrent_requests_per_host_are_capped(local_server, session):
+    lock, active = threading.Lock(), [0, 0]
+
+    def respond(path, headers):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(.05)
+        with lock:
+            active[0] -= 1
+        return json_response(history(item_id_of(path)))
+    local_server.respond = respond
+    graphs = dict(fetcher(local_server, session, n_workers=8, max_per_host=2).fetch(range(2, 14)))
+    assert len(graphs) == 12
+    assert active[1] <= 2
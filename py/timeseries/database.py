@@ -19,6 +19,8 @@ from typing import Dict, List, Literal, NamedTuple, Optional, Tuple
 import global_variables.path as gp
 from timeseries.types import SrcLike, OrderBy, Orderable
 from timeseries.view import TimeseriesView, sql_create_timeseries_extension_view
+from timeseries.view.materialized import ConsistencyReport, materialized_table, refresh_materialized_view, \
+    verify_materialized_view
 
 _tables_per_db = {}
 
@@ -93,7 +95,7 @@ class TimeseriesDatabase:
         else:
             tables = c.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()
             _tables_per_db[self.path] = tables
-        object.__setattr__(self, "tables", tuple([int(i[4:]) for i in tables if i.startswith('item')]))
+        object.__setattr__(self, "tables", tuple([int(i[4:]) for i in tables if len(i) == 9 and i.startswith('item')]))
         
         if not self.order_by.strip().startswith("ORDER BY"):
             msg = f"The ORDER BY clause does not meet the expected format (_order_by={self._order_by})"
@@ -267,7 +269,7 @@ class TimeseriesDatabase:
     
     def add_timeseries_view(self, ts_view: TimeseriesView, item_ids: Optional[int | Iterable[int]] = None):
         """Extend the tables related to `item_ids` with the """
-        con = self.connection
+        con = sqlite3.connect(self.path)
         c = con.cursor()
         c.row_factory = lambda cursor, row: row[0]
         
@@ -282,6 +284,41 @@ class TimeseriesDatabase:
             con.execute(sql_create_timeseries_extension_view(item_id, ts_view))
         con.commit()
         print(f"Added {len(item_ids)} {ts_view.row_timespan} timeseries views to the database at '{self.path}'")
+    
+    def refresh_materialized_views(self, ts_view: TimeseriesView, item_ids: Optional[int | Iterable[int]] = None,
+                                   full_refresh: bool = False) -> int:
+        """
+        Refresh the materialized version of `ts_view` for `item_ids`, or for all items if `item_ids` is undefined.
+        Rows are refreshed from the high-water mark of each item onwards, unless `full_refresh` is True. Return the
+        amount of rows that were (re)computed.
+        """
+        item_ids = self.tables if item_ids is None else [item_ids] if isinstance(item_ids, int) else item_ids
+        con = sqlite3.connect(self.path)
+        n = sum([refresh_materialized_view(con, item_id, ts_view, full_refresh) for item_id in item_ids])
+        con.close()
+        return n
+    
+    def verify_materialized_views(self, ts_view: TimeseriesView, item_ids: Optional[int | Iterable[int]] = None) \
+            -> List[ConsistencyReport]:
+        """Compare the materialized version of `ts_view` with its VIEW definition for `item_ids`, or for all items"""
+        item_ids = self.tables if item_ids is None else [item_ids] if isinstance(item_ids, int) else item_ids
+        con = self.connection
+        reports = [verify_materialized_view(con, item_id, ts_view) for item_id in item_ids]
+        con.close()
+        return reports
+    
+    def load_extended_rows(self, item_id: int, ts_view: TimeseriesView, t0: Optional[int] = None,
+                           t1: Optional[int] = None) -> List[sqlite3.Row]:
+        """
+        Load the rows of the materialized version of `ts_view` for `item_id` with a timestamp between `t0` and `t1`
+        (inclusive). Rows are returned as sqlite3.Row objects, sorted by timestamp.
+        """
+        con = self.connection
+        con.row_factory = sqlite3.Row
+        rows = con.execute(f"""SELECT * FROM {materialized_table(item_id, ts_view)} {self._where(None, t0, t1)}
+                               ORDER BY timestamp""", tuple([t for t in (t0, t1) if t is not None])).fetchall()
+        con.close()
+        return rows
         
         
 
@@ -0,0 +1,222 @@
+"""
+Implementation of materialized extended timeseries views.
+
+The extended timeseries VIEWs are recomputed entirely each time they are read, which includes a correlated subquery
+per output row to find the most recent wiki datapoint. A materialized view is a regular table with the same rows as the
+VIEW, that has the timestamp as its primary key. Reads are plain range scans on this key.
+
+Materialized views are refreshed incrementally. A high-water mark is kept per item, per view; the most recent timestamp
+that was materialized. During a refresh, rows from the high-water mark minus a lookback period onwards are recomputed,
+using the VIEW definition with a lower bound timestamp injected. The lookback covers rows that span an interval that
+starts prior to the high-water mark, such as daily rows.
+
+Datapoints may also arrive after rows that they affect were materialized, e.g. backfilled avg5m datapoints, wiki
+datapoints or restored backups. Rows ingested via a DirtyRangeTracker (see backend.npy_watermark) lower the high-water
+marks of the materialized views of their item to the smallest ingested timestamp, such that the next refresh
+recomputes all rows affected by them. Unlike the npy dirty ranges, this covers all items and is not consumed by the npy
+db updater.
+
+Examples
+--------
+con = sqlite3.connect(gp.f_db_timeseries)
+refresh_materialized_view(con, 2, TimeseriesView.FIVE_MINUTES)
+report = verify_materialized_view(con, 2, TimeseriesView.FIVE_MINUTES)
+"""
+import sqlite3
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from timeseries.view import TimeseriesView
+
+default_lookback: int = 2 * 86400
+"""Seconds prior to the high-water mark that are recomputed during an incremental refresh"""
+
+sql_create_hwm: str = """CREATE TABLE IF NOT EXISTS "materialized_view_hwm"(
+    "item_id" INTEGER NOT NULL,
+    "view" TEXT NOT NULL,
+    "timestamp" INTEGER NOT NULL,
+    PRIMARY KEY(item_id, view) ) WITHOUT ROWID"""
+
+sql_upsert_hwm: str = """INSERT INTO "materialized_view_hwm"(item_id, view, timestamp) VALUES (?, ?, ?)
+    ON CONFLICT(item_id, view) DO UPDATE SET timestamp=excluded.timestamp"""
+
+sql_select_hwm: str = """SELECT timestamp FROM "materialized_view_hwm" WHERE item_id=? AND view=?"""
+
+sql_invalidate_hwm: str = """UPDATE "materialized_view_hwm" SET timestamp=MIN(timestamp, ?) WHERE item_id=?"""
+
+
+class ConsistencyReport(NamedTuple):
+    """
+    Result of a comparison between a materialized view and its VIEW definition
+
+    Attributes
+    ----------
+    item_id : int
+        The item_id of the materialized view
+    view : str
+        The row timespan of the view, e.g. '5m'
+    n_rows : int
+        Amount of rows in the materialized view that were compared
+    n_missing : int
+        Amount of rows produced by the VIEW definition that are missing or different in the materialized view
+    n_unexpected : int
+        Amount of rows in the materialized view that are not produced by the VIEW definition
+    """
+    item_id: int
+    view: str
+    n_rows: int
+    n_missing: int
+    n_unexpected: int
+
+    @property
+    def is_consistent(self) -> bool:
+        """True if the materialized view is identical to the VIEW definition"""
+        return self.n_missing == 0 and self.n_unexpected == 0
+
+
+def materialized_table(item_id: int, ts_view: TimeseriesView) -> str:
+    """
+    Name of the materialized view table of `item_id` for view `ts_view`. The name does not start with 'item', such that
+    it is not mistaken for a timeseries item table.
+    """
+    return f'"materialized_{ts_view.row_timespan}_{item_id:0>5}"'
+
+
+def _legacy_materialized_table(item_id: int, ts_view: TimeseriesView) -> str:
+    """Name of the materialized view table of `item_id` for view `ts_view` prior to the rename"""
+    return f'item{item_id:0>5}_{ts_view.row_timespan}_materialized'
+
+
+def sql_select_view(item_id: int, ts_view: TimeseriesView, t0: bool = False) -> str:
+    """
+    Return the SELECT statement that defines `ts_view` for `item_id`. If `t0` is True, rows are restricted to timestamps
+    greater than or equal to the named parameter :t0.
+    """
+    sql = str(ts_view).strip()
+    prefix = "CREATE VIEW __OUT_TABLE__ AS"
+    if not sql.startswith(prefix):
+        raise ValueError(f"Unable to derive a SELECT statement from the {ts_view.row_timespan} view definition")
+    sql = sql[len(prefix):].strip().rstrip(';')
+    return (sql
+            .replace('/*__T0__*/', 'AND timestamp >= :t0' if t0 else '')
+            .replace('__TIMESERIES_TABLE__', f'"item{item_id:0>5}"'))
+
+
+def create_materialized_view(con: sqlite3.Connection, item_id: int, ts_view: TimeseriesView):
+    """
+    Create the materialized view table of `item_id` for `ts_view` if it does not exist. A table with the legacy name is
+    renamed instead. Changes are not committed.
+    """
+    con.execute(sql_create_hwm)
+    legacy = _legacy_materialized_table(item_id, ts_view)
+    if con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (legacy,)).fetchone() is not None:
+        con.execute(f"""ALTER TABLE "{legacy}" RENAME TO {materialized_table(item_id, ts_view)}""")
+        return
+    columns = [d[0] for d in con.execute(f"SELECT * FROM ({sql_select_view(item_id, ts_view)}) LIMIT 0").description]
+    columns = ['"timestamp" INTEGER PRIMARY KEY'] + [f'"{c}"' for c in columns if c != 'timestamp']
+    con.execute(f"""CREATE TABLE IF NOT EXISTS {materialized_table(item_id, ts_view)}({', '.join(columns)})""")
+
+
+def get_hwm(con: sqlite3.Connection, item_id: int, ts_view: TimeseriesView) -> Optional[int]:
+    """Return the high-water mark of the materialized view of `item_id` for `ts_view`, or None if there is none"""
+    try:
+        row = con.execute(sql_select_hwm, (item_id, ts_view.row_timespan)).fetchone()
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return None
+        raise e
+    return None if row is None else row[0]
+
+
+def invalidate_materialized_views(con: sqlite3.Connection, ranges: Dict[Tuple[int, int], List[int]]) -> int:
+    """
+    Lower the high-water marks of the materialized views of the items in `ranges` to the smallest timestamp ingested
+    per item, such that their next refresh recomputes the rows affected by the ingested rows. `ranges` maps
+    (item_id, src) tuples to [t0, t1] timestamp ranges, as tracked by backend.npy_watermark.DirtyRangeTracker. Changes
+    are not committed. Return the amount of views that were affected.
+    """
+    t0 = {}
+    for (item_id, _), r in ranges.items():
+        t0[item_id] = min(r[0], t0.get(item_id, r[0]))
+    try:
+        return con.executemany(sql_invalidate_hwm, [(t, item_id) for item_id, t in t0.items()]).rowcount
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return 0
+        raise e
+
+
+def refresh_materialized_view(con: sqlite3.Connection, item_id: int, ts_view: TimeseriesView,
+                              full_refresh: bool = False, lookback: int = default_lookback) -> int:
+    """
+    Refresh the materialized view of `item_id` for `ts_view` and commit the changes. Return the amount of rows that were
+    (re)computed.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection with the timeseries database
+    item_id : int
+        The item_id of the materialized view
+    ts_view : TimeseriesView
+        The view that is materialized
+    full_refresh : bool, optional, False by default
+        If True, recompute all rows, rather than only the rows from the high-water mark onwards
+    lookback : int, optional, 2 days by default
+        Amount of seconds prior to the high-water mark that are recomputed as well
+
+    Returns
+    -------
+    int
+        The amount of rows that were inserted
+    """
+    create_materialized_view(con, item_id, ts_view)
+    table = materialized_table(item_id, ts_view)
+    hwm = None if full_refresh else get_hwm(con, item_id, ts_view)
+    t0 = 0 if hwm is None else hwm - lookback
+
+    con.execute(f"""DELETE FROM {table} WHERE timestamp >= ?""", (t0,))
+    n = con.execute(f"""INSERT INTO {table} SELECT * FROM ({sql_select_view(item_id, ts_view, True)})""",
+                    {'t0': t0}).rowcount
+    hwm = con.execute(f"""SELECT MAX(timestamp) FROM {table}""").fetchone()[0]
+    if hwm is not None:
+        con.execute(sql_upsert_hwm, (item_id, ts_view.row_timespan, hwm))
+    con.commit()
+    return n
+
+
+def refresh_all_materialized_views(con: sqlite3.Connection) -> int:
+    """
+    Refresh all materialized views that were created before, i.e. that have a high-water mark, and commit the changes.
+    Return the amount of rows that were (re)computed.
+    """
+    try:
+        maintained = con.execute("""SELECT item_id, view FROM "materialized_view_hwm" """).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return 0
+        raise e
+    views = {ts_view.row_timespan: ts_view for ts_view in TimeseriesView}
+    return sum([refresh_materialized_view(con, item_id, views[view]) for item_id, view in maintained if view in views])
+
+
+def verify_materialized_view(con: sqlite3.Connection, item_id: int, ts_view: TimeseriesView,
+                             t0: Optional[int] = None, t1: Optional[int] = None) -> ConsistencyReport:
+    """
+    Compare the rows of the materialized view of `item_id` for `ts_view` with the rows produced by its VIEW definition.
+    Only rows with a timestamp between `t0` and `t1` (inclusive) are compared; by default all rows up to the high-water
+    mark.
+    """
+    table = materialized_table(item_id, ts_view)
+    t0 = 0 if t0 is None else t0
+    if t1 is None:
+        t1 = get_hwm(con, item_id, ts_view)
+        t1 = -1 if t1 is None else t1
+    parameters = {'t0': t0, 't1': t1}
+    where = "WHERE timestamp BETWEEN :t0 AND :t1"
+    sql_mat = f"""SELECT * FROM {table} {where}"""
+    sql_view = f"""SELECT * FROM ({sql_select_view(item_id, ts_view, True)}) {where}"""
+
+    n_rows = con.execute(f"""SELECT COUNT(*) FROM {table} {where}""", parameters).fetchone()[0]
+    n_missing = con.execute(f"""SELECT COUNT(*) FROM ({sql_view} EXCEPT {sql_mat})""", parameters).fetchone()[0]
+    n_unexpected = con.execute(f"""SELECT COUNT(*) FROM ({sql_mat} EXCEPT {sql_view})""", parameters).fetchone()[0]
+    return ConsistencyReport(item_id, ts_view.row_timespan, n_rows, n_missing, n_unexpected)
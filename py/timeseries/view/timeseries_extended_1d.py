@@ -5,7 +5,7 @@ related to.
 In this VIEW, data is aggregated per day.
 Given the larger amount of datapoints per row, the data is defined as statistic
 
-
+The /*__T0__*/ comment marks where a lower bound timestamp is injected when the VIEW is materialized incrementally.
 """
 
 extended_timeseries_view_1d = """
@@ -19,7 +19,7 @@ WITH
         SELECT MIN(timestamp)
         FROM __TIMESERIES_TABLE__
         WHERE src > 0
-      )
+      ) /*__T0__*/
   ),
 
   -- 2) join in all the raw columns plus compute sales_tax
@@ -83,7 +83,7 @@ WITH
 -- 3) now reference that precomputed sales_tax to get your final margin
 SELECT
   timestamp,
-  year, month, day, hour, minute, second, weekday, hour_id, day_id, week_id,
+  year, month, day, weekday, day_id, week_id,
 
   wiki_price,
   wiki_volume,
@@ -5,9 +5,11 @@ related to.
 The rows in this VIEW span an interval of 300 seconds.
 Each timestamp occurs every 5th minute (i.e. timestamp%300==0)
 
-This VIEW has completely substituted the npy database.
+This VIEW has completely substituted the npy database. A materialized version of this VIEW can be maintained via
+timeseries.view.materialized.
+
+The /*__T0__*/ comments mark where a lower bound timestamp is injected when the VIEW is materialized incrementally.
 """
-import sqlite3
 
 extended_timeseries_view_5m = """
 
@@ -21,7 +23,7 @@ WITH
         SELECT MIN(timestamp)
         FROM __TIMESERIES_TABLE__
         WHERE src > 0
-      )
+      ) /*__T0__*/
   ),
   realtime_agg AS (
     SELECT
@@ -31,7 +33,7 @@ WITH
       MAX(price)         AS rt_price_max,
       AVG(price)         AS rt_price_avg
     FROM __TIMESERIES_TABLE__
-    WHERE src > 2
+    WHERE src > 2 /*__T0__*/
     GROUP BY ts
   ),
 
@@ -160,10 +162,3 @@ def sql_extended_timeseries_table(item_id: int) -> str:
     return (extended_timeseries_view_5m
             .replace('__TIMESERIES_TABLE__', f'"item{item_id:0>5}"')
             .replace('__OUT_TABLE__', f'"item{item_id:0>5}_5m_extended"'))
-
-
-db = sqlite3.connect(r"C:\osrs\data\subset.db")
-db.execute(sql_extended_timeseries_table(2))
-# print(db.execute("SELECT sqlite_version() AS lib_version, sqlite_source_id() AS build_id ").fetchall())
-# db.commit()
-db.close()
\ No newline at end of file
@@ -1,8 +1,15 @@
 """
 Module with TransactionDatabase handlers for inventory related logic
 
+The inventory table is maintained by the triggers in transaction.sql.trigger; each inventory row is resumed from the
+row that precedes it, so appending a transaction only computes its own row. When importing many transactions at once,
+bulk_import() disables these triggers and rebuilds the inventory in one sorted pass afterwards.
 """
+import json
 import sqlite3
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 
 from typing import List, Dict
 
@@ -13,6 +20,7 @@ from abc import ABC
 import global_variables.path as gp
 from transaction.controller.inventory_entry import InventoryEntry
 from transaction.database.basic_database import BasicTransactionDatabase
+from transaction.sql.trigger import inventory_triggers, sql_recompute_inventory, sql_rebuild_inventory
 
 
 @dataclass(slots=True)
@@ -76,6 +84,97 @@ class InventoryDatabase(BasicTransactionDatabase):
         c = conn.cursor()
         c.row_factory = cls.row_factory
     
+    def recompute_inventory(self, item_id: int, timestamp: int, con: sqlite3.Connection = None):
+        """
+        Recompute the inventory rows of `item_id` from the transaction that precedes `timestamp` onwards. Changes are
+        committed if no connection `con` is passed.
+        """
+        commit = con is None
+        con = self.connect() if con is None else con
+        con.execute(sql_recompute_inventory,
+                    {'item_id': item_id, 'timestamp': timestamp, 'update_timestamp': int(time.time())})
+        if commit:
+            con.commit()
+    
+    def rebuild_inventory(self, item_ids: Iterable[int] = None, con: sqlite3.Connection = None) -> int:
+        """
+        Delete and recompute the inventory rows of `item_ids`, or of all items if undefined, in one sorted pass over
+        their transactions. Changes are committed if no connection `con` is passed.
+        
+        Parameters
+        ----------
+        item_ids : Iterable[int], optional, None by default
+            The items of which the inventory is rebuilt. If undefined, the entire inventory is rebuilt.
+        con : sqlite3.Connection, optional, None by default
+            Writable connection with the database
+
+        Returns
+        -------
+        int
+            The amount of inventory rows that were inserted
+
+        """
+        commit = con is None
+        con = self.connect() if con is None else con
+        if item_ids is None:
+            con.execute("""DELETE FROM "inventory" """)
+            params = {'item_ids': None}
+        else:
+            item_ids = [int(i) for i in item_ids]
+            con.execute("""DELETE FROM "inventory" WHERE item_id IN (SELECT value FROM json_each(?))""",
+                        (json.dumps(item_ids),))
+            params = {'item_ids': json.dumps(item_ids)}
+        n = con.execute(sql_rebuild_inventory, {**params, 'update_timestamp': int(time.time())}).rowcount
+        if commit:
+            con.commit()
+        return n
+    
+    @contextmanager
+    def bulk_import(self, rebuild: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        Context manager for inserting, updating or deleting many transactions. The inventory triggers are dropped upon
+        entering and recreated upon exiting. Yields a writable connection; changes made through it are committed upon
+        exiting, or rolled back if an exception was raised.
+        
+        If `rebuild`, the inventory is cleared upon entering, such that transactions can be deleted without violating
+        foreign key constraints, and it is rebuilt in one sorted pass upon exiting. The inventory is rebuilt even if an
+        exception was raised, as changes that were committed within the context have no inventory rows otherwise.
+        
+        Parameters
+        ----------
+        rebuild : bool, optional, True by default
+            If False, do not clear and rebuild the inventory. Deleting transactions that are referenced by inventory
+            rows will fail if foreign keys are enforced.
+
+        Examples
+        --------
+        with InventoryDatabase().bulk_import() as con:
+            con.executemany(sql, transactions)
+        """
+        con = self.connect()
+        for name in inventory_triggers:
+            con.execute(f"""DROP TRIGGER IF EXISTS {name}""")
+        if rebuild:
+            con.execute("""DELETE FROM "inventory" """)
+        try:
+            yield con
+        except BaseException:
+            con.rollback()
+            raise
+        finally:
+            try:
+                if rebuild:
+                    t0 = time.perf_counter()
+                    n = self.rebuild_inventory(con=con)
+                    print(f"Rebuilt {n} inventory rows in {1000*(time.perf_counter()-t0):.0f}ms")
+            except BaseException:
+                con.rollback()
+                raise
+            finally:
+                for sql in inventory_triggers.values():
+                    con.execute(sql)
+                con.commit()
+    
     def execute_all_transactions(self, item_id: int):
         """
         Load and Execute all transactions that are eligible for execution and subsequently update inventory entries.
@@ -38,9 +38,9 @@ from typing import Dict
 import global_variables.path as gp
 from transaction.constants import update_timestamp, raw_transaction_keys
 from transaction.database import *
-from transaction.database import BasicTransactionDatabase
+from transaction.database import BasicTransactionDatabase, InventoryDatabase
 from transaction.raw import factory_raw_transaction, RawTransactionEntry, resolve_duplicates, RuneliteExportEntry, \
-    runelite_export, ExchangeLoggerEntry, FlippingUtilitiesEntry, flipping_utilities, exchange_logger
+    runelite_export, ExchangeLoggerEntry, FlippingUtilitiesEntry, flipping_utilities, exchange_logger, create_match_index
 from transaction.row_factories import _factory_idx0, factory_dict
 from transaction.sql import sql_insert, sql_select, sql_update, sql_delete
 from transaction.sql.update import sql_update_transaction
@@ -78,6 +78,16 @@ class TransactionDatabase(BasicTransactionDatabase):#, RawTransactionDatabase):
     path: str = field(default=str(gp.f_db_transaction_new))
     """Path to the database"""
     
+    def connect(self, read_only: bool = False, **kwargs) -> sqlite3.Connection:
+        """
+        Connect to the database, see BasicTransactionDatabase.connect(). Writable connections ensure the index used to
+        match raw transactions exists, such that an existing database is migrated upon the first connection.
+        """
+        conn = BasicTransactionDatabase.connect(self, read_only, **kwargs)
+        if not read_only:
+            create_match_index(conn)
+        return conn
+    
     def insert_transaction(self, transaction: Transaction):
         """Insert `transaction` into the transaction table"""
         con = self.connect()
@@ -168,18 +178,17 @@ class TransactionDatabase(BasicTransactionDatabase):#, RawTransactionDatabase):
         else:
             raise RuntimeError("Aborted operation")
         
-        conn = db.connect()
-        c = conn.cursor()
-        c.row_factory = _factory_idx0
-        tables = c.execute(sql_select.table_names).fetchall()
-        tables = [s for s in tables if "transaction" in s]
-        tables = sorted(tables, key=len)
-        
-        for t in tables:
-            conn.execute(sql_delete.all_rows(str(t)))
-            conn.commit()
-        conn.execute("UPDATE sqlite_sequence SET seq=0")
-        conn.commit()
+        # Deleting transactions one by one via the inventory triggers is quadratic; rebuild the inventory afterwards
+        with InventoryDatabase(path=db.path).bulk_import() as conn:
+            c = conn.cursor()
+            c.row_factory = _factory_idx0
+            tables = c.execute(sql_select.table_names).fetchall()
+            tables = [s for s in tables if "transaction" in s]
+            tables = sorted(tables, key=len)
+            
+            for t in tables:
+                conn.execute(sql_delete.all_rows(str(t)))
+            conn.execute("UPDATE sqlite_sequence SET seq=0")
         conn.execute("VACUUM")
         print("All rows have been cleared!")
         conn.close()
@@ -450,33 +459,91 @@ class TransactionDatabase(BasicTransactionDatabase):#, RawTransactionDatabase):
             con.execute(sql, params)
             con.commit()
     
-    def sync_raw_table(self):
+    def sync_raw_table(self, batch_size: int = 5000, bulk_threshold: int = 1000) -> Dict[str, int]:
         """
-        Iterate over all raw_transaction table entries and submit those that are eligible into the transaction table.
-        The submitted transactions are linked to the sourcing raw_transaction via a foreign_key. The idea is that both
-        remain synced to some extent.
+        Submit all raw_transaction table entries that are eligible and that have not been submitted yet into the
+        transaction table. The submitted transactions are linked to the sourcing raw_transaction via a foreign_key. The
+        idea is that both remain synced to some extent.
+        
+        Pending raw transactions are fetched with a single anti-join. They are converted and inserted via executemany,
+        committing once per batch rather than once per transaction. If many transactions are pending, the inventory
+        triggers are disabled during the insertion and all batches are committed at once along with the inventory,
+        which is rebuilt afterwards (see InventoryDatabase.bulk_import).
+        
+        Parameters
+        ----------
+        batch_size : int, optional, 5000 by default
+            Amount of transactions that are inserted per executemany call, and per commit if the inventory triggers are
+            enabled
+        bulk_threshold : int, optional, 1000 by default
+            Minimum amount of pending transactions for disabling the inventory triggers while inserting
+
+        Returns
+        -------
+        Dict[str, int]
+            Amount of submitted transactions per source, the total amount submitted and the amount of skipped raw
+            transactions that are not eligible for submission
         """
         con = self.connect()
         c = con.cursor()
-        c.row_factory = _factory_idx0
+        c.row_factory = factory_raw_transaction
+        pending = c.execute(sql_select.pending_raw_transactions).fetchall()
+        con.close()
         
-        raw_ids = c.execute("""SELECT transaction_id FROM raw_transaction
-        WHERE transaction_id NOT IN
-        ( SELECT raw_transaction_id FROM 'transaction' ); """).fetchall()
+        counts = {"exchange_logger": 0, "flipping_utilities": 0, "runelite_export": 0, "legacy": 0, "submitted": 0,
+                  "skipped": 0}
+        rows = []
+        for raw in pending:
+            if not self.can_submit(raw):
+                counts["skipped"] += 1
+                continue
+            rows.append({
+                "raw_transaction_id": raw.transaction_id,
+                "item_id": raw.item_id,
+                "timestamp_created": raw.timestamp_created,
+                "timestamp": raw.timestamp,
+                "is_buy": raw.is_buy,
+                "quantity": raw.quantity,
+                "max_quantity": raw.max_quantity,
+                "price": raw.price,
+                "offered_price": raw.offered_price,
+                "value": raw.value,
+                "ge_slot": raw.ge_slot,
+                "account_name": raw.account_name,
+                "status": 1 if raw.status is None else raw.status,
+                "tag": "L" if raw.tag is None else raw.tag,
+                "update_timestamp": raw.update_timestamp
+            })
+            sources = [k for k in ("exchange_logger", "flipping_utilities", "runelite_export")
+                       if getattr(raw, f"{k}_id") is not None]
+            for k in sources if sources else ("legacy",):
+                counts[k] += 1
         
-        c.row_factory = factory_raw_transaction
-        n_added = 0
-        for transaction_id in raw_ids:
-            transaction = c.execute(sql_select.raw_transaction_by_transaction_id,
-                                    (transaction_id,)).fetchone()
+        def insert(conn: sqlite3.Connection, commit: bool):
+            for idx in range(0, len(rows), batch_size):
+                conn.executemany(sql_insert.insert_transaction_dict, rows[idx:idx+batch_size])
+                if commit:
+                    conn.commit()
+        
+        if len(rows) >= bulk_threshold:
+            # Committed once by bulk_import, together with the rebuilt inventory
+            inventory_db = InventoryDatabase(path=self.path, pragma_foreign_keys=self.pragma_foreign_keys)
+            with inventory_db.bulk_import() as conn:
+                insert(conn, False)
+        elif len(rows) > 0:
+            conn = self.connect()
             try:
-                if self.can_submit(transaction):
-                    self.submit_raw_transaction(transaction)
-                    n_added += 1
-            except TypeError as e:
-                print(transaction)
+                insert(conn, True)
+            except Exception as e:
+                conn.rollback()
                 raise e
-        print(f"Added {n_added} transactions")
+            finally:
+                conn.close()
+        
+        counts["submitted"] = len(rows)
+        print(f"Added {len(rows)} transactions (" +
+              ", ".join(f"{k}: {v}" for k, v in counts.items() if k != "submitted") + ")")
+        return counts
 #
 
 # import json
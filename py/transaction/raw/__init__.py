@@ -9,7 +9,7 @@ from transaction.raw.raw_exchange_logger_entry import ExchangeLoggerEntry
 from transaction.raw.raw_runelite_export_entry import RuneliteExportEntry
 from transaction.raw.raw_transaction_entry import RawTransactionEntry, factory_raw_transaction
 from transaction.raw.raw_transaction_finder import flipping_utilities, exchange_logger, runelite_export, \
-    resolve_duplicates
+    resolve_duplicates, create_match_index
 
 __all__ = ("FlippingUtilitiesEntry", "ExchangeLoggerEntry", "RuneliteExportEntry", "RawTransactionEntry",
-           "flipping_utilities", "exchange_logger", "runelite_export", "resolve_duplicates")
+           "flipping_utilities", "exchange_logger", "runelite_export", "resolve_duplicates", "create_match_index")
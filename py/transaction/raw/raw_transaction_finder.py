@@ -4,10 +4,16 @@ There are functions for attempting to find a corresponding raw transaction based
 of transactions, as well as a merged function, that will make a call to both.
 
 It is recommended to use the merged function.
+
+For reconciling an entire import at once, use find_duplicates() / merge_duplicates(). Rather than querying the
+raw_transaction table once per entry, all rows are read in (item_id, is_buy, quantity, price, timestamp) order, which is
+served by the idx_raw_transaction_match index, and duplicates are found in a single sweep. Each row is only compared
+with preceding rows of the same (item_id, is_buy, quantity, price) group that are at most `delta_t` seconds older.
 """
 from collections import namedtuple
 
 import sqlite3
+from collections.abc import Iterable
 from typing import Optional, Tuple, List, Dict
 
 from transaction.constants import delta_t, empty_tuple
@@ -15,6 +21,7 @@ from transaction.raw.raw_exchange_logger_entry import ExchangeLoggerEntry
 from transaction.raw.raw_flipping_utilities_entry import FlippingUtilitiesEntry
 from transaction.raw.raw_runelite_export_entry import RuneliteExportEntry
 from transaction.row_factories import factory_dict
+from transaction.sql.index import sql_create_index
 
 
 def exchange_logger_flipping_utilities(cur: sqlite3.Cursor, t: ExchangeLoggerEntry) -> Optional[int]:
@@ -413,66 +420,145 @@ def compare_potential_duplicates(con: sqlite3.Connection, *ids) -> List[Tuple[in
     """Compare all raw transactions, identified by their id, and return the identical pairs (i.e. they refer to the same transaction"""
     c = con.cursor()
     c.row_factory = factory_dict
-    transactions = [c.execute("""SELECT * FROM "raw_transaction" WHERE transaction_id=?""", (_id,)).fetchone() for _id
-                    in ids]
-    
-    keys = ("account_name", "ge_slot", "max_quantity", "offered_price")
-    
-    results = []
-    for i, t1 in enumerate(transactions):
-        for j, t2 in enumerate(transactions):
-            is_identical = True
-            if i == j:
-                continue
-            
-            _count = 0
-            for key in keys:
-                if t1.get(key) is not None and t2.get(key) is not None:
-                    is_identical = is_identical and t1.get(key) != t2.get(key)
-                else:
-                    _count += 1
-            if _count == len(keys) or is_identical:
-                results.append((t1['transaction_id'], t2['transaction_id']))
-    
-    return results
+    sql = sql_select_raw_transactions_sorted.replace(
+        "ORDER BY", f"""WHERE transaction_id IN ({", ".join("?" for _ in ids)}) ORDER BY""")
+    return [(group[0], _id) for group in find_duplicates(c.execute(sql, ids).fetchall()) for _id in group[1:]]
 
 
 def resolve_duplicates(conn, _ids) -> Tuple[int, ...]:
+    """Merge the raw transactions among `_ids` that are duplicates and return the ids of the remaining transactions"""
     dups = compare_potential_duplicates(conn, *_ids)
     if len(dups) > 0:
-        temp = []
+        kept = {}
         for (a, b) in dups:
+            a, b = kept.get(a, a), kept.get(b, b)
             keep_id = merge_transactions(conn, a, b)
-            if a == keep_id and b in temp:
-                temp.remove(b)
-            elif b == keep_id and a in temp:
-                temp.remove(a)
-            temp.append(keep_id)
-        return tuple(temp)
+            kept = {k: keep_id if v in (a, b) else v for k, v in kept.items()}
+            kept[a] = kept[b] = keep_id
+        return tuple(dict.fromkeys(kept.get(_id, _id) for _id in _ids))
     return _ids
 
 
-def merge_duplicates(path: str):
+_sources = ("exchange_logger_id", "flipping_utilities_id", "runelite_export_id")
+_match_key = ("item_id", "is_buy", "quantity", "price")
+
+sql_select_raw_transactions_sorted = f"""SELECT transaction_id, item_id, timestamp, is_buy, quantity, max_quantity,
+    price, account_name, ge_slot, {", ".join(_sources)} FROM "raw_transaction"
+    ORDER BY item_id, is_buy, quantity, price, timestamp"""
+
+
+def _compatible(a: Optional[any], b: Optional[any]) -> bool:
+    """Return True if either value is undefined, or if both values are equal"""
+    return a is None or b is None or a == b
+
+
+def is_duplicate(a: Dict[str, any], b: Dict[str, any], _delta_t: int = delta_t) -> bool:
+    """
+    Return True if raw transactions `a` and `b` refer to the same transaction. This is the pairwise equivalent of the
+    point queries defined above;
+    - Both rows have the same item_id, is_buy, quantity and price, and they originate from different sources.
+    - If one of the rows only originates from a Runelite export, its timestamp is at most `delta_t` seconds before that
+      of the other row. Otherwise, the timestamps and max quantities are identical.
+    - Account names and GE slots are identical, unless either of them is undefined.
+    """
+    if any(a[k] != b[k] for k in _match_key):
+        return False
+    src_a = frozenset(k for k in _sources if a.get(k) is not None)
+    src_b = frozenset(k for k in _sources if b.get(k) is not None)
+    if src_a & src_b:
+        return False
+    
+    runelite_export_only = frozenset(("runelite_export_id",))
+    if runelite_export_only in (src_a, src_b):
+        # A Runelite export timestamp may precede that of the other sources, but it is never later
+        re, other = (a, b) if src_a == runelite_export_only else (b, a)
+        if not other['timestamp'] - _delta_t <= re['timestamp'] <= other['timestamp']:
+            return False
+    elif a['timestamp'] != b['timestamp'] or not _compatible(a.get('max_quantity'), b.get('max_quantity')):
+        return False
+    
+    ge_slot_a = None if a.get('ge_slot') == -1 else a.get('ge_slot')
+    ge_slot_b = None if b.get('ge_slot') == -1 else b.get('ge_slot')
+    account_a = None if a.get('account_name') is None else str(a['account_name']).lower()
+    account_b = None if b.get('account_name') is None else str(b['account_name']).lower()
+    return _compatible(ge_slot_a, ge_slot_b) and _compatible(account_a, account_b)
+
+
+def find_duplicates(rows: Iterable[Dict[str, any]], _delta_t: int = delta_t) -> List[Tuple[int, ...]]:
+    """
+    Find raw transactions that refer to the same transaction via a windowed sweep over `rows`.
+    
+    Parameters
+    ----------
+    rows : Iterable[Dict[str, any]]
+        Raw transaction rows as dicts, sorted by (item_id, is_buy, quantity, price, timestamp)
+    _delta_t : int, optional, transaction.constants.delta_t by default
+        Maximum amount of seconds a Runelite export timestamp may precede that of another source
+
+    Returns
+    -------
+    List[Tuple[int, ...]]
+        Groups of transaction_ids of raw transactions that refer to the same transaction, in ascending order. All
+        members of a group are pairwise duplicates according to is_duplicate(), hence a group holds at most one row per
+        source.
+    """
+    groups: Dict[int, List[Dict[str, any]]] = {}
+    window: List[Dict[str, any]] = []
+    for row in rows:
+        if window and tuple(window[-1][k] for k in _match_key) != tuple(row[k] for k in _match_key):
+            window = []
+        else:
+            window = [w for w in window if w['timestamp'] >= row['timestamp'] - _delta_t]
+        
+        # Join the group of the oldest matching row, provided that the row is a duplicate of each of its members.
+        # Matches are not transitive; a Runelite export row that matches two distinct Exchange Logger rows may only be
+        # merged with one of them.
+        group = [row]
+        for w in window:
+            candidate = groups[w['transaction_id']]
+            if all(is_duplicate(m, row, _delta_t) for m in candidate):
+                candidate.append(row)
+                group = candidate
+                break
+        groups[row['transaction_id']] = group
+        window.append(row)
     
+    unique = {id(g): g for g in groups.values()}.values()
+    return [tuple(sorted(m['transaction_id'] for m in g)) for g in unique if len(g) > 1]
+
+
+def create_match_index(conn: sqlite3.Connection):
+    """
+    Create the idx_raw_transaction_match index on the raw_transaction table of `conn` if it does not exist yet, as the
+    per-row match lookups and duplicate detection rely on it. Does nothing if there is no raw_transaction table.
+    """
+    try:
+        conn.execute(sql_create_index.raw_transaction_item_buy_quantity_price_timestamp)
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise e
+    conn.commit()
+
+
+def merge_duplicates(path: str, _delta_t: int = delta_t) -> int:
+    """
+    Reconcile all rows in the raw_transaction table of the database at `path` by merging the rows that refer to the
+    same transaction. Return the amount of rows that were merged into another row.
+    """
     conn = sqlite3.connect(path)
+    create_match_index(conn)
     cursor = conn.cursor()
     cursor.row_factory = factory_dict
-    rows = cursor.execute("SELECT * FROM 'raw_transaction' ORDER BY item_id ASC, timestamp ASC").fetchall()
-    p = None
-    for row in rows:
-        if p is None:
-            p = row
-            continue
-        if row['quantity'] == p['quantity'] and \
-            row['item_id'] == p['item_id'] and \
-                row['price'] == p['price'] and \
-                row['timestamp'] == p['timestamp']:
-            print("merging", row['transaction_id'], p['transaction_id'])
-            print(row)
-            print(p, '\n\n')
-            merge_transactions(conn, row['transaction_id'], p['transaction_id'])
-        p = row
-        
+    n_merged = 0
+    for group in find_duplicates(cursor.execute(sql_select_raw_transactions_sorted), _delta_t):
+        keep_id = group[0]
+        for merge_id in group[1:]:
+            print("merging", keep_id, merge_id)
+            keep_id = merge_transactions(conn, keep_id, merge_id)
+            n_merged += 1
+    conn.close()
+    return n_merged
+    
     # df = pd.DataFrame()
     #
     # transaction_ids = df['transaction_id'].tolist()
@@ -22,7 +22,7 @@ index_inventory_transactionid = \
 
 
 index_transaction_item_timestamp = \
-    f"""CREATE INDEX idx_item_status_timestamp ON "transaction" (item_id, status, timestamp);"""
+    f"""CREATE INDEX idx_transaction_item_timestamp ON "transaction" (item_id, timestamp);"""
 
 
 index_raw_runelite_export_transaction_item_timestamp = \
@@ -40,9 +40,14 @@ index_raw_exchange_logger_transaction_item_timestamp = \
 index_raw_transaction_item_status_timestamp = \
     """CREATE INDEX idx_item_status_timestamp ON "raw_transaction" (item_id, status, timestamp);"""
 
+index_raw_transaction_item_buy_quantity_price_timestamp = \
+    """CREATE INDEX IF NOT EXISTS idx_raw_transaction_match ON "raw_transaction" (item_id, is_buy, quantity, price,
+    timestamp);"""
+
 _dict = dict(locals())
 _keys = ('item_item', 'transaction_item_status_timestamp', 'inventory_item_timestamp', 'inventory_transactionid',
-         'transaction_item_timestamp', 'raw_runelite_export_transaction_item_timestamp', 'raw_flipping_utilities_transaction_item_timestamp', 'raw_exchange_logger_transaction_item_timestamp', 'raw_transaction_item_status_timestamp')
+         'transaction_item_timestamp', 'raw_runelite_export_transaction_item_timestamp', 'raw_flipping_utilities_transaction_item_timestamp', 'raw_exchange_logger_transaction_item_timestamp', 'raw_transaction_item_status_timestamp',
+         'raw_transaction_item_buy_quantity_price_timestamp')
 
 sql_create_index = namedtuple(
     "CreateIndexSQL",
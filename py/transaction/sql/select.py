@@ -86,6 +86,15 @@ check_if_exists = \
 
 insert_old_trasction = f"""SELECT * FROM {TableList.TRANSACTION} ORDER BY transaction_id"""
 
+pending_raw_transactions = \
+    f"""
+    SELECT r.* FROM {TableList.RAW_TRANSACTION} r
+    LEFT JOIN {TableList.TRANSACTION} t ON t.raw_transaction_id = r.transaction_id
+    WHERE t.raw_transaction_id IS NULL
+    ORDER BY r.transaction_id
+    """
+"""Anti-join that fetches all raw_transaction rows that have not been submitted to the transaction table"""
+
 table_names = """SELECT name FROM sqlite_master WHERE type='table' and name != "sqlite_sequence";"""
 """Query that can be executed to fetch all table names"""
 
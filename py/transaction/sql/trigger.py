@@ -15,20 +15,30 @@ trigger_raw_transaction_post_insert_tag_update : str
     be tagged as "L", referring to Legacy transaction.
     
 trigger_transaction_post_insert_inventory_row : str
-    CREATE TRIGGER statement that inserts and subsequently updates inventory rows upon insertion of a new transaction.
-    The trigger ensures that inventory reflects the cumulative effect of transactions, maintaining balance, average
-    buy price, profit, and other relevant metrics. It also sets the 'executed' flag based on the transaction's
-    timestamp relative to other transactions for the same item.
+    CREATE TRIGGER statement that inserts an inventory row upon insertion of a new transaction and computes it from
+    the inventory row that precedes it. The inventory reflects the cumulative effect of transactions, maintaining
+    balance, average buy price, profit, and other relevant metrics. It also sets the 'executed' flag based on the
+    transaction's timestamp relative to other transactions for the same item. If the transaction was appended, only
+    its own row and that of the preceding transaction are computed. If it was back-dated, the rows that follow it are
+    recomputed as well.
     
 trigger_transaction_post_update_inventory_row : str
-    SQL statement that updates inventory rows following an update to a transaction. It recalculates and updates
-    inventory metrics such as balance, average buy price, profit, and 'executed' status, ensuring consistency
-    with the updated transaction data.
+    CREATE TRIGGER statement that recomputes the inventory rows affected by an update to a transaction. It recalculates
+    and updates inventory metrics such as balance, average buy price, profit, and 'executed' status, ensuring
+    consistency with the updated transaction data.
     
 trigger_transaction_post_delete_inventory_row : str
     CREATE TRIGGER statement that deletes the corresponding inventory row when a transaction is deleted and updates
     subsequent inventory rows for the same item. This trigger maintains the integrity of the inventory data by
     reflecting the removal of a transaction and adjusting the cumulative metrics accordingly.
+
+sql_recompute_inventory : str
+    UPDATE statement that recomputes the inventory rows of an item from a given timestamp onwards. The triggers above
+    execute the same statement.
+
+sql_rebuild_inventory : str
+    INSERT statement that computes the inventory rows of a set of items in one sorted pass over their transactions.
+    It is used after importing transactions with the inventory triggers disabled.
 """
 from collections import namedtuple
 
@@ -82,113 +92,154 @@ trigger_raw_transaction_post_insert_tag_update = \
 """Updates the tag in case it has no value. "L" refers to legacy transaction. See module docstring for more info"""
 
 
+def _inventory_ledger(item_filter: str, start: str = None) -> str:
+    """
+    Return a SELECT statement that computes the inventory state of each distinct (item_id, timestamp) of the
+    transactions that match `item_filter`. If `start` is passed, only timestamps >= `start` are computed; the state
+    before `start` is resumed from the most recent inventory row of that item prior to `start`.
+    
+    The state is cumulative over all transactions with status=1 and a timestamp <= the timestamp of the row. Each
+    cumulative sum is a window over the (item_id, timestamp) groups, which makes the computation linear in the amount of
+    transactions that are recomputed, rather than quadratic.
+    """
+    since = "" if start is None else f" AND t.timestamp >= {start}"
+    before = "NULL" if start is None else f"""(SELECT i.id FROM "inventory" i
+                    WHERE i.item_id = g.item_id AND i.timestamp < {start} ORDER BY i.timestamp DESC LIMIT 1)"""
+    return f"""
+    WITH grp AS (
+        SELECT
+            t.item_id,
+            t.timestamp,
+            SUM(CASE WHEN t.status = 1 AND t.is_buy = 1 THEN t.quantity ELSE 0 END) AS bought,
+            SUM(CASE WHEN t.status = 1 AND t.is_buy = 1 THEN t.price * t.quantity ELSE 0 END) AS invested,
+            SUM(CASE WHEN t.status = 1 AND t.is_buy = 1 THEN 1 ELSE 0 END) AS purchases,
+            SUM(CASE WHEN t.status = 1 AND t.is_buy = 0 THEN t.quantity ELSE 0 END) AS sold,
+            SUM(CASE WHEN t.status = 1 AND t.is_buy = 0 THEN t.price * t.quantity ELSE 0 END) AS revenue,
+            SUM(CASE WHEN t.status = 1 AND t.is_buy = 0 THEN 1 ELSE 0 END) AS sales,
+            SUM(CASE WHEN t.status = 1 THEN t.tax ELSE 0 END) AS tax
+        FROM "transaction" t
+        WHERE {item_filter}{since}
+        GROUP BY t.item_id, t.timestamp
+    ),
+    base AS (
+        SELECT
+            g.item_id,
+            COALESCE(i.profit, 0) AS profit,
+            COALESCE(i.tax, 0) AS tax,
+            COALESCE(i.invested_value, 0) AS invested_value,
+            COALESCE(i.current_value, 0) AS current_value,
+            COALESCE(i.n_purchases, 0) AS n_purchases,
+            COALESCE(i.n_bought, 0) AS n_bought,
+            COALESCE(i.n_sales, 0) AS n_sales,
+            COALESCE(i.n_sold, 0) AS n_sold
+        FROM (SELECT DISTINCT item_id FROM grp) g
+        LEFT JOIN "inventory" i ON i.id = {before}
+    ),
+    cumulative AS (
+        SELECT
+            g.item_id,
+            g.timestamp,
+            g.sold,
+            g.revenue,
+            b.profit AS base_profit,
+            b.tax + SUM(g.tax) OVER w AS tax,
+            b.invested_value + SUM(g.invested) OVER w AS invested_value,
+            b.current_value + SUM(g.revenue) OVER w AS current_value,
+            b.n_purchases + SUM(g.purchases) OVER w AS n_purchases,
+            b.n_bought + SUM(g.bought) OVER w AS n_bought,
+            b.n_sales + SUM(g.sales) OVER w AS n_sales,
+            b.n_sold + SUM(g.sold) OVER w AS n_sold,
+            g.timestamp = MAX(g.timestamp) OVER (PARTITION BY g.item_id) AS executed
+        FROM grp g JOIN base b ON b.item_id = g.item_id
+        WINDOW w AS (PARTITION BY g.item_id ORDER BY g.timestamp ROWS UNBOUNDED PRECEDING)
+    ),
+    average AS (
+        SELECT *,
+            CASE WHEN n_bought > 0 THEN CAST(invested_value AS REAL) / n_bought ELSE 0 END AS average_buy_price
+        FROM cumulative
+    )
+    SELECT
+        item_id,
+        timestamp,
+        n_bought - n_sold AS balance,
+        average_buy_price,
+        base_profit + SUM(revenue - average_buy_price * sold) OVER (
+            PARTITION BY item_id ORDER BY timestamp ROWS UNBOUNDED PRECEDING) AS profit,
+        tax,
+        invested_value,
+        current_value,
+        n_purchases,
+        n_bought,
+        n_sales,
+        n_sold,
+        executed
+    FROM average
+    """
+
+
+def _suffix_start(item_id: str, timestamp: str) -> str:
+    """
+    SQL expression for the first timestamp that is to be recomputed if a transaction of `item_id` at `timestamp` was
+    added, altered or removed. This is the timestamp of the preceding transaction, such that its executed flag is
+    updated as well.
+    """
+    return f"""COALESCE((SELECT MAX(t0.timestamp) FROM "transaction" t0
+                WHERE t0.item_id = {item_id} AND t0.timestamp < {timestamp}), {timestamp})"""
+
+
+def _inventory_recompute(item_id: str, timestamp: str, update_timestamp: str) -> str:
+    """
+    UPDATE statement that recomputes the inventory rows of `item_id` from the transaction that precedes `timestamp`
+    onwards, resuming from the inventory row prior to it.
+    """
+    start = _suffix_start(item_id, timestamp)
+    return f"""
+    UPDATE "inventory"
+    SET
+        "balance" = s.balance,
+        "average_buy_price" = s.average_buy_price,
+        "profit" = s.profit,
+        "tax" = s.tax,
+        "invested_value" = s.invested_value,
+        "current_value" = s.current_value,
+        "n_purchases" = s.n_purchases,
+        "n_bought" = s.n_bought,
+        "n_sales" = s.n_sales,
+        "n_sold" = s.n_sold,
+        "executed" = s.executed,
+        "update_timestamp" = {update_timestamp}
+    FROM ({_inventory_ledger(f"t.item_id = {item_id}", start)}) AS s
+    WHERE "inventory".item_id = {item_id} AND "inventory".timestamp >= {start}
+        AND "inventory".item_id = s.item_id AND "inventory".timestamp = s.timestamp;"""
+
+
 trigger_transaction_post_insert_inventory_row = \
     f"""
     -- Trigger for INSERT on transaction table
     CREATE TRIGGER IF NOT EXISTS transaction_insert_inventory
     AFTER INSERT ON "transaction"
     BEGIN
-        -- Insert a new inventory row
-        INSERT INTO "inventory" (
-            "transaction_id",
-            "item_id",
-            "balance",
-            "average_buy_price",
-            "profit",
-            "tax",
-            "invested_value",
-            "current_value",
-            "n_purchases",
-            "n_bought",
-            "n_sales",
-            "n_sold",
-            "executed",
-            "update_timestamp",
-            "timestamp"
-        )
-        SELECT
-            NEW.transaction_id,
-            NEW.item_id,
-            CASE WHEN NEW.is_buy = 1 THEN NEW.quantity ELSE -NEW.quantity END,
-            CASE WHEN NEW.is_buy = 1 THEN NEW.price ELSE 0 END,
-            0,
-            NEW.tax,
-            CASE WHEN NEW.is_buy = 1 THEN NEW.price * NEW.quantity ELSE 0 END,
-            0,
-            CASE WHEN NEW.is_buy = 1 THEN 1 ELSE 0 END,
-            CASE WHEN NEW.is_buy = 1 THEN NEW.quantity ELSE 0 END,
-            CASE WHEN NEW.is_buy = 0 THEN 1 ELSE 0 END,
-            CASE WHEN NEW.is_buy = 0 THEN NEW.quantity ELSE 0 END,
-            CASE
-                WHEN NEW.timestamp = (SELECT MAX(t2.timestamp) FROM "transaction" t2 WHERE t2.item_id = NEW.item_id) THEN 1
-                ELSE 0
-            END,
-            NEW.update_timestamp,
-            NEW.timestamp
-        ;
-        UPDATE "inventory"
-        SET
-            "balance" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE -t.quantity END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "average_buy_price" = (SELECT
-                                        CASE
-                                            WHEN SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END) > 0
-                                            THEN CAST(SUM(CASE WHEN t.is_buy = 1 THEN t.price * t.quantity ELSE 0 END) AS REAL) / SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END)
-                                            ELSE 0
-                                        END
-                                    FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "profit" = (SELECT
-                            SUM(
-                                (CASE WHEN t.is_buy = 0 THEN t.price * t.quantity ELSE 0 END) -
-                                (CASE WHEN t.is_buy = 0 THEN (SELECT i2.average_buy_price from inventory i2 where i2.transaction_id = t.transaction_id)*t.quantity ELSE 0 END)
-                            )
-                        FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "tax" = (SELECT SUM(t.tax) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "invested_value" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.price * t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "current_value" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN t.price * t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "n_purchases" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN 1 ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "n_bought" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "n_sales" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN 1 ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "n_sold" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-            "executed" = CASE
-                WHEN i.timestamp = (SELECT MAX(i2.timestamp) from inventory i2 where i2.item_id = NEW.item_id) THEN 1
-                ELSE 0
-            END,
-            "update_timestamp" = NEW.update_timestamp
-        WHERE "item_id" = NEW.item_id AND "timestamp" >= (SELECT timestamp from inventory where transaction_id = NEW.transaction_id);
+        -- Insert a new inventory row, its values are computed below
+        INSERT INTO "inventory" ("transaction_id", "item_id", "timestamp", "update_timestamp")
+        VALUES (NEW.transaction_id, NEW.item_id, NEW.timestamp, NEW.update_timestamp);
+        {_inventory_recompute("NEW.item_id", "NEW.timestamp", "NEW.update_timestamp")}
     END;
     """
 
 trigger_transaction_post_update_inventory_row = \
-    """
-    UPDATE "inventory"
-    SET
-        "balance" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE -t.quantity END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "average_buy_price" = (SELECT
-                                    CASE
-                                        WHEN SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END) > 0
-                                        THEN CAST(SUM(CASE WHEN t.is_buy = 1 THEN t.price * t.quantity ELSE 0 END) AS REAL) / SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END)
-                                        ELSE 0
-                                    END
-                                FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "profit" = (SELECT
-                        SUM(
-                            (CASE WHEN t.is_buy = 0 THEN t.price * t.quantity ELSE 0 END) -
-                            (CASE WHEN t.is_buy = 0 THEN (SELECT i2.average_buy_price from inventory i2 where i2.transaction_id = t.transaction_id)*t.quantity ELSE 0 END)
-                        )
-                    FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "tax" = (SELECT SUM(t.tax) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "invested_value" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.price * t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "current_value" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN t.price * t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "n_purchases" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN 1 ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "n_bought" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "n_sales" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN 1 ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "n_sold" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = NEW.item_id AND t.timestamp <= NEW.timestamp AND t.status = 1),
-        "executed" = CASE
-            WHEN i.timestamp = (SELECT MAX(i2.timestamp) from inventory i2 where i2.item_id = NEW.item_id) THEN 1
-            ELSE 0
-        END,
-        "update_timestamp" = NEW.update_timestamp
-    WHERE "item_id" = NEW.item_id AND "timestamp" >= (SELECT timestamp from inventory where transaction_id = NEW.transaction_id);
+    f"""
+    -- Trigger for UPDATE on transaction table
+    CREATE TRIGGER IF NOT EXISTS transaction_update_inventory
+    AFTER UPDATE OF "item_id", "timestamp", "is_buy", "quantity", "price", "status" ON "transaction"
+    BEGIN
+        UPDATE "inventory" SET "item_id" = NEW.item_id, "timestamp" = NEW.timestamp
+        WHERE "transaction_id" = NEW.transaction_id;
+        {_inventory_recompute("OLD.item_id", "OLD.timestamp", "NEW.update_timestamp")}
+        {_inventory_recompute(
+            "NEW.item_id",
+            "(CASE WHEN OLD.item_id = NEW.item_id THEN MIN(OLD.timestamp, NEW.timestamp) ELSE NEW.timestamp END)",
+            "NEW.update_timestamp")}
+    END;
     """
 
 
@@ -199,40 +250,35 @@ trigger_transaction_post_delete_inventory_row = \
     BEGIN
         -- Delete the corresponding inventory row
         DELETE FROM "inventory" WHERE "transaction_id" = OLD.transaction_id;
-    
-        -- Update inventory rows for the same item_id and later timestamps
-        UPDATE "inventory"
-        SET
-            "balance" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE -t.quantity END) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "average_buy_price" = (SELECT
-                                        CASE
-                                            WHEN SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END) > 0
-                                            THEN CAST(SUM(CASE WHEN t.is_buy = 1 THEN t.price * t.quantity ELSE 0 END) AS REAL) / SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END)
-                                            ELSE 0
-                                        END
-                                    FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "profit" = (SELECT
-                            SUM(
-                                (CASE WHEN t.is_buy = 0 THEN t.price * t.quantity ELSE 0 END) -
-                                (CASE WHEN t.is_buy = 0 THEN (SELECT i2.average_buy_price from inventory i2 where i2.transaction_id = t.transaction_id)*t.quantity ELSE 0 END)
-                            )
-                        FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "tax" = (SELECT SUM(t.tax) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "invested_value" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.price * t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "current_value" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN t.price * t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "n_purchases" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN 1 ELSE 0 END) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "n_bought" = (SELECT SUM(CASE WHEN t.is_buy = 1 THEN t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "n_sales" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN 1 ELSE 0 END) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "n_sold" = (SELECT SUM(CASE WHEN t.is_buy = 0 THEN t.quantity ELSE 0 END) FROM "transaction" t WHERE t.item_id = OLD.item_id AND t.timestamp <= i.timestamp AND t.status = 1),
-            "executed" = CASE
-                WHEN i.timestamp = (SELECT MAX(i2.timestamp) from inventory i2 where i2.item_id = OLD.item_id) THEN 1
-                ELSE 0
-            END,
-            "update_timestamp" = strftime('%s','now')
-        WHERE "item_id" = OLD.item_id AND "timestamp" > OLD.timestamp;
+        {_inventory_recompute("OLD.item_id", "OLD.timestamp", "strftime('%s','now')")}
     END;
     """
 
+inventory_triggers: Dict[str, str] = {
+    'transaction_insert_inventory': trigger_transaction_post_insert_inventory_row,
+    'transaction_update_inventory': trigger_transaction_post_update_inventory_row,
+    'transaction_delete_inventory': trigger_transaction_post_delete_inventory_row
+}
+"""The triggers that maintain the inventory table, by name"""
+
+sql_recompute_inventory: str = _inventory_recompute(":item_id", ":timestamp", ":update_timestamp")
+"""Recompute the inventory rows of :item_id from the transaction preceding :timestamp onwards"""
+
+sql_rebuild_inventory: str = f"""
+    INSERT INTO "inventory" ("transaction_id", "item_id", "timestamp", "balance", "average_buy_price", "profit", "tax",
+        "invested_value", "current_value", "n_purchases", "n_bought", "n_sales", "n_sold", "executed",
+        "update_timestamp")
+    SELECT tr.transaction_id, tr.item_id, tr.timestamp, s.balance, s.average_buy_price, s.profit, s.tax,
+        s.invested_value, s.current_value, s.n_purchases, s.n_bought, s.n_sales, s.n_sold, s.executed,
+        :update_timestamp
+    FROM "transaction" tr
+    JOIN ({_inventory_ledger(
+        "(:item_ids IS NULL OR t.item_id IN (SELECT value FROM json_each(:item_ids)))")}) AS s
+        ON s.item_id = tr.item_id AND s.timestamp = tr.timestamp
+    """
+"""Insert the inventory rows of the items in the json list :item_ids (or of all items if NULL) in one sorted pass.
+Existing inventory rows of these items are to be deleted first."""
+
 _dict = dict(locals())
 
 _keys = ('raw_transaction_post_insert_tag_update', 'transaction_post_insert_inventory_row',
@@ -111,7 +111,7 @@ def get_graph_interval(npy_array, t0: int, t1: int, y_values: Iterable = None):
     Parameters
     ----------
     npy_array
-        data_preprocessing.NpyArray object. In order to load it, there should be an existing NpyArray file for that item
+        NpyItemArrays of the item, as opened by backend.npy_array_store.load_npy_array(). Its timestamps are sorted.
     t0 : int
         Minimum unix timestamp for the requested interval
     t1: int
@@ -132,8 +132,8 @@ def get_graph_interval(npy_array, t0: int, t1: int, y_values: Iterable = None):
     it
     """
     x, y = npy_array.timestamp, npy_array.columns if y_values is None else y_values
-    
-    return {col: npy_array.__dict__.get(col)[np.nonzero((t1 > x) & (x >= t0))] for col in ['timestamp'] + y}
+    i0, i1 = np.searchsorted(x, t0, side='left'), np.searchsorted(x, t1, side='left')
+    return {col: getattr(npy_array, col)[i0:i1] for col in ['timestamp'] + list(y)}
 
 
 def unique_values(_set: Iterable, return_type: Callable = list, sort_ascending: bool = None):
@@ -0,0 +1,74 @@
+"""
+This module contains methods for reporting the startup time of the project modules.
+
+Project modules record the moment at which their imports completed as `__t0__ = time.perf_counter()`. The startup
+report orders the imported modules by this timestamp. For each module, it lists the time elapsed since the first module
+completed its imports, as well as the time elapsed since the preceding module did, which approximates the time that was
+spent on loading the module itself.
+
+Lazy module attributes (e.g. those of global_variables.osrs) that were computed so far are listed as well.
+
+Examples
+--------
+import util.startup
+util.startup.startup_report()
+"""
+import sys
+import time
+from typing import List, NamedTuple
+
+
+class ModuleTiming(NamedTuple):
+    """
+    Startup timing of one module
+
+    Attributes
+    ----------
+    module : str
+        Name of the module
+    offset_ms : float
+        Milliseconds between the first recorded __t0__ and the __t0__ of this module
+    delta_ms : float
+        Milliseconds between the preceding recorded __t0__ and the __t0__ of this module
+    """
+    module: str
+    offset_ms: float
+    delta_ms: float
+
+
+def module_timings() -> List[ModuleTiming]:
+    """ Return the startup timings of all imported modules that recorded a __t0__ timestamp, ordered by __t0__ """
+    recorded = sorted([(t0, name) for name, module in list(sys.modules.items())
+                       if isinstance(t0 := getattr(module, '__t0__', None), float)])
+    if len(recorded) == 0:
+        return []
+    first, prev, timings = recorded[0][0], recorded[0][0], []
+    for t0, name in recorded:
+        timings.append(ModuleTiming(name, 1000 * (t0 - first), 1000 * (t0 - prev)))
+        prev = t0
+    return timings
+
+
+def startup_report(min_ms: float = 0.0, print_report: bool = True) -> List[ModuleTiming]:
+    """
+    Compose a report of the startup timings of the imported modules and print it if `print_report` is True. Modules
+    that took less than `min_ms` milliseconds are omitted. Return the timings that were reported.
+    """
+    timings = [t for t in module_timings() if t.delta_ms >= min_ms]
+    if print_report:
+        print(f"\n *** Startup report ({len(timings)} modules) ***")
+        for t in timings:
+            print(f"\t{t.offset_ms:>9.1f}ms  (+{t.delta_ms:>7.1f}ms)  {t.module}")
+        osrs = sys.modules.get('global_variables.osrs')
+        if osrs is not None and hasattr(osrs, '_lazy_attributes'):
+            loaded = [a for a in osrs._lazy_attributes if a in vars(osrs)]
+            print(f"\tLazy global_variables.osrs attributes loaded: {', '.join(loaded) if loaded else 'none'}")
+    return timings
+
+
+if __name__ == '__main__':
+    _t = time.perf_counter()
+    import global_variables.osrs
+    import item.itemdb
+    print(f"Imported global_variables.osrs and item.itemdb in {1000*(time.perf_counter()-_t):.1f}ms")
+    startup_report()